@@ -0,0 +1,90 @@
+"""
+Support for --adaptive, which varies the number of tests running at once
+based on how busy the rest of the system is.
+"""
+
+import os
+import time
+
+
+def _read_pressure(resource):
+    """Return the total microseconds that some tasks have been stalled on the
+    given resource ('cpu' or 'memory'), from the linux PSI interface, or None
+    if it isn't available.
+    """
+    try:
+        with open('/proc/pressure/%s' % resource) as f:
+            for line in f:
+                if line.startswith('some '):
+                    return int(line.rsplit('total=', 1)[1])
+    except (IOError, OSError, IndexError, ValueError):
+        pass
+    return None
+
+
+class LoadMonitor(object):
+    """Decides how many tests should be running at once, between 1 and
+    max_active, by sampling the load average and the CPU and memory pressure
+    (PSI) every interval seconds.
+
+    The load from our own running tests is subtracted from the load average to
+    estimate how many CPUs everything else is using, and the limit moves one
+    step at a time toward max_active less that.  It also backs off whenever
+    tasks spend more than cpu_stall of their time waiting for a CPU or more
+    than mem_stall waiting for memory.
+    """
+
+    def __init__(self, max_active, interval=1.0, cpu_stall=0.4, mem_stall=0.1):
+        self.max_active = max_active
+        self.interval = interval
+        self.cpu_stall = cpu_stall
+        self.mem_stall = mem_stall
+        self.active = self._target(0)
+        self._last_time = time.time()
+        self._last_stalls = self._stalls()
+
+    def _stalls(self):
+        return (_read_pressure('cpu'), _read_pressure('memory'))
+
+    def _target(self, nbusy):
+        """Return max_active less the load from processes other than the
+        nbusy running tests, but at least 1.
+        """
+        try:
+            other_load = max(0., os.getloadavg()[0] - nbusy)
+        except (AttributeError, OSError):  # not available on windows
+            other_load = 0.
+        return max(1, self.max_active - int(round(other_load)))
+
+    def _pressure(self, new, old, elapsed):
+        """Return the fraction of the elapsed time that tasks were stalled."""
+        if new is None or old is None or elapsed <= 0.:
+            return 0.
+        return (new - old) / (elapsed * 1e6)
+
+    def limit(self, nbusy):
+        """Return the number of tests that should be running, given that
+        nbusy are running now.
+        """
+        now = time.time()
+        elapsed = now - self._last_time
+        if elapsed < self.interval:
+            return self.active
+
+        stalls = self._stalls()
+        cpu = self._pressure(stalls[0], self._last_stalls[0], elapsed)
+        mem = self._pressure(stalls[1], self._last_stalls[1], elapsed)
+        self._last_time = now
+        self._last_stalls = stalls
+
+        target = self._target(nbusy)
+
+        if mem > self.mem_stall or cpu > self.cpu_stall:
+            self.active -= 1
+        elif target > self.active:
+            self.active += 1
+        elif target < self.active:
+            self.active -= 1
+
+        self.active = max(1, min(self.active, self.max_active))
+        return self.active
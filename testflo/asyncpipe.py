@@ -0,0 +1,148 @@
+"""
+A threaded alternative to main.run_pipeline.
+
+The producer stages of the pipeline (discovery and the test runner) run in
+the calling thread, and the consumer stages (printers, summaries, report
+writers, filters) run after them, each in its own thread.  Results are
+handed from one stage to the next through unbounded queues, so a slow
+consumer never holds up the dispatching of tests or the collection of
+results from workers.
+
+The queues between the stages are connected by an asyncio event loop on
+another thread.  A consumer stage can run as a coroutine in that loop,
+instead of in a thread, by making its get_iter an async generator function
+that takes an async iterator of Test objects, but none of testflo's own
+stages do that, since all of their work is blocking I/O.
+"""
+
+import sys
+import asyncio
+import inspect
+import threading
+
+from six.moves import queue
+
+from testflo.util import is_failure
+
+
+# marks the end of a stream of results
+_END = object()
+
+
+async def _queue_aiter(q):
+    """Yield items from an asyncio.Queue until _END is found."""
+    while True:
+        item = await q.get()
+        if item is _END:
+            return
+        yield item
+
+
+async def _sync_stage(stage, input_aiter):
+    """Run a sync pipeline stage in its own thread, feeding it the items from
+    input_aiter and yielding the items it produces.
+    """
+    loop = asyncio.get_event_loop()
+    inq = queue.Queue()
+    outq = asyncio.Queue()
+
+    def run():
+        try:
+            for result in stage(iter(inq.get, _END)):
+                loop.call_soon_threadsafe(outq.put_nowait, (result, None))
+        except BaseException as err:
+            loop.call_soon_threadsafe(outq.put_nowait, (_END, err))
+        else:
+            loop.call_soon_threadsafe(outq.put_nowait, (_END, None))
+
+    async def feed():
+        async for result in input_aiter:
+            inq.put(result)
+        inq.put(_END)
+
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
+    feeder = asyncio.ensure_future(feed())
+
+    while True:
+        result, err = await outq.get()
+        if result is _END:
+            break
+        yield result
+
+    if err is not None:
+        feeder.cancel()
+        raise err
+
+    await feeder
+
+
+def _stage_aiter(stage, input_aiter):
+    if inspect.isasyncgenfunction(stage):
+        return stage(input_aiter)
+    return _sync_stage(stage, input_aiter)
+
+
+def run_async_pipeline(source, producers, consumers):
+    """Run a pipeline of test iteration objects, with the producers running
+    in this thread and the consumers running in an event loop.
+
+    Returns 1 if any test failed unexpectedly, else 0.
+    """
+    loop = asyncio.new_event_loop()
+    ready = threading.Event()
+    state = {}
+
+    async def consume():
+        inq = asyncio.Queue()
+        state['put'] = inq.put_nowait
+        ready.set()
+
+        aiter = _queue_aiter(inq)
+        for stage in consumers:
+            aiter = _stage_aiter(stage, aiter)
+
+        retval = 0
+        async for result in aiter:
+            if is_failure(result):
+                retval = 1
+        return retval
+
+    def run_loop():
+        asyncio.set_event_loop(loop)
+        try:
+            state['retval'] = loop.run_until_complete(consume())
+        except BaseException:
+            state['error'] = sys.exc_info()
+        finally:
+            loop.close()
+            ready.set()
+
+    thread = threading.Thread(target=run_loop)
+    thread.daemon = True
+    thread.start()
+    ready.wait()
+
+    iters = [source]
+    for p in producers:
+        iters.append(p(iters[-1]))
+
+    try:
+        for result in iters[-1]:
+            try:
+                loop.call_soon_threadsafe(state['put'], result)
+            except (RuntimeError, KeyError):
+                break  # the event loop died, so stop producing
+    finally:
+        try:
+            loop.call_soon_threadsafe(state['put'], _END)
+        except (RuntimeError, KeyError):
+            pass
+        thread.join()
+
+    if 'error' in state:
+        exc_type, exc, tb = state['error']
+        raise exc.with_traceback(tb)
+
+    return state['retval']
@@ -6,14 +6,19 @@ class BenchmarkWriter(object):
        Data is written as comma separated values (CSV)
     """
 
-    def __init__(self, stream=sys.stdout):
+    def __init__(self, stream=sys.stdout, flush_interval=0.1):
         self.timestamp = time.time()
         self.stream = stream
+        self.flush_interval = flush_interval
+        self._last_flush = 0.
 
     def get_iter(self, input_iter):
-        for result in input_iter:
-            self._write_data(result)
-            yield result
+        try:
+            for result in input_iter:
+                self._write_data(result)
+                yield result
+        finally:
+            self.stream.flush()
 
     def _write_data(self, result):
         stream = self.stream
@@ -27,4 +32,8 @@ class BenchmarkWriter(object):
             result.load5m,
             result.load15m
         ))
-        stream.flush()
+
+        now = time.time()
+        if now - self._last_flush >= self.flush_interval:
+            stream.flush()
+            self._last_flush = now
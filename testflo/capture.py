@@ -0,0 +1,236 @@
+"""
+Support for limiting the size of captured test output, for removing
+output that is repeated from one test to the next, and for capturing
+the output of tests running in threads.
+"""
+
+import os
+import re
+import sys
+import hashlib
+import threading
+
+
+def _spill_name(spec):
+    """Return a file name for the output of the given testspec.  It's made of
+    the module's basename and the rest of the spec, plus a hash of the full
+    spec so that tests in modules with the same name don't share a file.
+    """
+    fname, sep, rest = spec.partition(':')
+    if fname.endswith('.py'):
+        fname = os.path.abspath(fname)
+    digest = hashlib.md5((fname + sep + rest).encode('utf-8')).hexdigest()[:10]
+    short = os.path.basename(fname) + sep + rest
+    return '%s-%s' % (re.sub(r'[^\w.-]', '_', short), digest)
+
+
+class CaptureStream(object):
+    """A stream that captures text written to it, keeping only the first and
+    last max_size/2 characters.  If spill_dir is given and the output gets
+    truncated, the full output is written to a file in spill_dir, named from
+    the testspec given as name plus the given suffix.
+    """
+
+    def __init__(self, max_size, spill_dir=None, name='test', suffix='.err'):
+        self.max_size = max_size
+        self.spill_dir = spill_dir
+        self.name = name
+        self.suffix = suffix
+        self._half = max(max_size // 2, 1)
+        self._head = []
+        self._headlen = 0
+        self._tail = []
+        self._taillen = 0
+        self._total = 0
+        self._spill = None
+        self.spill_path = None
+
+    def write(self, s):
+        self._total += len(s)
+
+        if self._spill is not None:
+            self._spill.write(s)
+
+        if self._headlen < self._half:
+            n = self._half - self._headlen
+            self._head.append(s[:n])
+            self._headlen += len(s[:n])
+            s = s[n:]
+            if not s:
+                return
+
+        self._tail.append(s)
+        self._taillen += len(s)
+
+        if self._taillen > self._half:
+            if self._spill is None and self.spill_dir:
+                self._start_spill()
+
+            # only trim occasionally so we're not constantly joining strings
+            if self._taillen > 2 * self._half:
+                tail = ''.join(self._tail)[-self._half:]
+                self._tail = [tail]
+                self._taillen = len(tail)
+
+    def _start_spill(self):
+        """Start writing the full output to a file, beginning with everything
+        we've seen so far (none of which has been dropped yet).
+        """
+        try:
+            if not os.path.isdir(self.spill_dir):
+                os.makedirs(self.spill_dir)
+        except OSError:
+            pass  # another process may have just created it
+
+        self.spill_path = os.path.abspath(os.path.join(self.spill_dir,
+                                                       _spill_name(self.name) + self.suffix))
+        try:
+            self._spill = open(self.spill_path, 'w')
+        except (IOError, OSError):
+            self.spill_dir = self.spill_path = None
+            return
+
+        self._spill.write(''.join(self._head))
+        self._spill.write(''.join(self._tail))
+
+    def writelines(self, iterable):
+        for s in iterable:
+            self.write(s)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+    def getvalue(self):
+        head = ''.join(self._head)
+        tail = ''.join(self._tail)
+        if self._total <= self._headlen + self._half:
+            return head + tail
+
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
+
+        tail = tail[-self._half:]
+        omitted = self._total - len(head) - len(tail)
+        if self.spill_path:
+            where = 'full output is in %s' % self.spill_path
+        else:
+            where = 'use --err-dir to save the full output'
+
+        return "%s\n... [%d of %d characters omitted, %s] ...\n%s" % (
+                    head, omitted, self._total, where, tail)
+
+
+# a line that starts a new block of output
+_block_start = re.compile(r'(Traceback \(most recent call last\):|\S.*:\d+: \w*Warning: )')
+
+
+class ErrDeduplicator(object):
+    """Replaces each block of a test's error output (a traceback, a warning,
+    or other lines) that is identical to a block already seen in an earlier
+    test's output with a short note naming that test.
+    """
+
+    def __init__(self, min_size=80):
+        self.min_size = min_size
+        self._seen = {}
+
+    def get_iter(self, input_iter):
+        for test in input_iter:
+            if test.err_msg:
+                test.err_msg = self._dedup(test)
+            yield test
+
+    def _blocks(self, msg):
+        block = []
+        for line in msg.splitlines(True):
+            if block and _block_start.match(line):
+                yield ''.join(block)
+                block = []
+            block.append(line)
+        if block:
+            yield ''.join(block)
+
+    def _dedup(self, test):
+        parts = []
+        for block in self._blocks(test.err_msg):
+            if len(block) < self.min_size:
+                parts.append(block)
+                continue
+
+            key = hashlib.md5(block.encode('utf-8', 'replace')).digest()
+            if key in self._seen:
+                parts.append("[%d characters of output identical to output of %s]\n" %
+                             (len(block), self._seen[key]))
+            else:
+                self._seen[key] = test.short_name()
+                parts.append(block)
+
+        return ''.join(parts)
+
+
+class ThreadLocalStream(object):
+    """Stands in for sys.stdout or sys.stderr and sends whatever is written
+    to it to the stream set for the current thread, or to the default stream
+    if none is set.
+    """
+
+    def __init__(self, default):
+        self.default = default
+        self._local = threading.local()
+
+    def get_target(self):
+        return getattr(self._local, 'target', None)
+
+    def set_target(self, stream):
+        # passing ourself (e.g. the current sys.stdout with --nocapture)
+        # just means use the default
+        self._local.target = None if stream is self else stream
+
+    def _stream(self):
+        target = getattr(self._local, 'target', None)
+        return self.default if target is None else target
+
+    def write(self, s):
+        return self._stream().write(s)
+
+    def writelines(self, iterable):
+        return self._stream().writelines(iterable)
+
+    def flush(self):
+        return self._stream().flush()
+
+    def __getattr__(self, name):
+        return getattr(self._stream(), name)
+
+
+def install_thread_streams():
+    """Replace sys.stdout and sys.stderr with ThreadLocalStreams."""
+    if not isinstance(sys.stdout, ThreadLocalStream):
+        sys.stdout = ThreadLocalStream(sys.stdout)
+    if not isinstance(sys.stderr, ThreadLocalStream):
+        sys.stderr = ThreadLocalStream(sys.stderr)
+
+
+def uninstall_thread_streams():
+    """Put back the streams replaced by install_thread_streams."""
+    if isinstance(sys.stdout, ThreadLocalStream):
+        sys.stdout = sys.stdout.default
+    if isinstance(sys.stderr, ThreadLocalStream):
+        sys.stderr = sys.stderr.default
+
+
+def set_thread_streams(out, err):
+    """Send the current thread's output to the given streams and return the
+    streams it was using before, or None if thread streams aren't installed.
+    """
+    if not (isinstance(sys.stdout, ThreadLocalStream) and
+            isinstance(sys.stderr, ThreadLocalStream)):
+        return None
+    old = (sys.stdout.get_target(), sys.stderr.get_target())
+    sys.stdout.set_target(out)
+    sys.stderr.set_target(err)
+    return old
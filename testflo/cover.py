@@ -4,12 +4,6 @@ Methods to provide code coverage using coverage.py.
 
 import os
 import sys
-import webbrowser
-
-try:
-    from coverage import coverage
-except ImportError:
-    coverage = None
 
 
 # use to hold a global coverage obj
@@ -18,7 +12,9 @@ _coverobj = None
 def setup_coverage(options):
     global _coverobj
     if _coverobj is None and (options.coverage or options.coveragehtml):
-        if not coverage:
+        try:
+            from coverage import coverage
+        except ImportError:
             raise RuntimeError("coverage has not been installed.")
         if not options.coverpkgs:
             raise RuntimeError("No packages specified for coverage. "
@@ -80,4 +76,5 @@ def finalize_coverage(options):
                 if sys.platform == 'darwin':
                     os.system('open %s' % outfile)
                 else:
+                    import webbrowser
                     webbrowser.get().open(outfile)
@@ -0,0 +1,347 @@
+"""
+A daemon that runs tests for testflo clients over a Unix socket, so that
+repeated runs don't pay for interpreter startup, importing testflo and any
+--preload-module modules, starting the SyncManager needed for isolated and
+MPI tests, or searching unchanged directories for test modules.
+
+Each job is run in a new process forked from the daemon, which then forks
+its own workers, so nothing a job imports or changes can affect later jobs.
+There's no pool of workers kept between jobs, but since they're forked from
+a process that has already done the imports, they start quickly.  Jobs from
+different clients run at the same time, each with its own queue for
+isolated and MPI test results.  Each user should run their own daemon,
+since tests run with its permissions.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import tempfile
+import traceback
+import warnings
+import threading
+import multiprocessing
+
+from multiprocessing.connection import Listener, Client
+
+from testflo.options import get_options
+from testflo.util import revalidate_module_cache, get_module_cache, set_module_cache
+
+
+def _is_private(path):
+    """Return True if path is owned by the current user and can't be read
+    or written by anyone else.  It's always True where there are no uids.
+    """
+    if not hasattr(os, 'getuid'):
+        return True
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return False
+    return st.st_uid == os.getuid() and not (st.st_mode & 0o077)
+
+
+def _private_dir():
+    """Return the current user's directory for the daemon socket and key,
+    creating it if necessary.  It's in $XDG_RUNTIME_DIR if that's set, else
+    in the temp directory, and only the current user may use it.  Raises a
+    RuntimeError if someone else owns it or can get into it.
+    """
+    if hasattr(os, 'getuid'):
+        user = os.getuid()
+    else:
+        user = os.environ.get('USERNAME', 'user')
+    base = os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir()
+    dname = os.path.join(base, 'testflo-%s' % user)
+    try:
+        os.mkdir(dname, 0o700)
+    except OSError:
+        pass  # it already exists, so check it below
+    if not (os.path.isdir(dname) and _is_private(dname)):
+        raise RuntimeError("%s isn't a private directory owned by the current user" %
+                           dname)
+    return dname
+
+
+def default_address():
+    """Return the path of the current user's daemon socket."""
+    return os.path.join(_private_dir(), 'testflo.sock')
+
+
+def _read_key(address):
+    """Return the daemon's authentication key, making sure that nobody but
+    the current user could have made the socket or the key.
+    """
+    keyfile = address + '.key'
+    if not (_is_private(address) and _is_private(keyfile)):
+        raise RuntimeError("the testflo daemon socket %s or its key isn't private "
+                           "to the current user" % address)
+    with open(keyfile, 'rb') as f:
+        return f.read()
+
+
+def connect(address=None):
+    """Return a connection to the daemon, or None if it isn't running or
+    isn't owned by the current user.
+    """
+    try:
+        address = address or default_address()
+        return Client(address, family='AF_UNIX', authkey=_read_key(address))
+    except Exception:
+        return None
+
+
+def _run_job(conn, cache_conn, queue, job_options, tests, cwd, env, path, argv):
+    """Run the tests for a job in a process forked from the daemon, sending
+    each result to the client over conn.
+    """
+    from testflo.main import get_discoverer, get_priority_order
+    from testflo.runner import ConcurrentTestRunner
+
+    options = get_options()
+    vars(options).update(vars(job_options))
+    os.environ.clear()
+    os.environ.update(env)
+    os.chdir(cwd)
+    sys.path[:] = path
+    sys.argv[:] = argv  # some args are passed on to isolated and MPI subprocesses
+
+    runner = None
+    try:
+        revalidate_module_cache()
+        runner = ConcurrentTestRunner(options, queue)
+        input_iter = get_discoverer(options).get_iter(tests)
+        order = get_priority_order(options)
+        if order is not None:
+            input_iter = order.get_iter(input_iter)
+        for result in runner.get_iter(input_iter):
+            conn.send(result)
+    except (IOError, OSError, EOFError):
+        # the client went away, so don't wait for any running tests
+        if runner is not None:
+            runner.close(kill=True)
+    except Exception:
+        if runner is not None:
+            runner.close(kill=True)
+        try:
+            conn.send(('ERROR', traceback.format_exc()))
+        except (IOError, OSError):
+            pass
+    else:
+        conn.send('DONE')
+
+    cache_conn.send(get_module_cache())
+
+
+class TestDaemon(object):
+    """Listens on a Unix socket and runs each job sent by a DaemonClient."""
+
+    def __init__(self, options, address=None):
+        self.options = options
+        self.address = address or default_address()
+        self._manager = None
+        self._jobs = []  # threads waiting for running jobs to finish
+        # held while forking a job and while updating the module cache, so
+        # a job is never forked in the middle of an update
+        self._lock = threading.Lock()
+
+        try:
+            self._ctx = multiprocessing.get_context('fork')
+        except AttributeError:
+            self._ctx = multiprocessing  # python 2 always forks on posix
+
+    def _get_queue(self, options):
+        """Return a new queue for a job's isolated and MPI tests, if it needs
+        one, starting the manager that holds the queues the first time.
+        Each job gets its own queue so that jobs running at the same time
+        can't get each other's results.
+        """
+        from testflo.test import mpi_available
+        if options.isolated == 'subprocess' or (not options.nompi and mpi_available()):
+            if self._manager is None:
+                from testflo.qman import get_server_queue
+                self._manager, queue = get_server_queue()
+                return queue
+            return self._manager.Queue()
+        return None
+
+    def _finish_job(self, proc, cache_conn, queue):
+        """Wait for a job to send its module cache, and join its process.
+        This runs in its own thread, so a finished job never waits for the
+        daemon to get around to it.
+        """
+        try:
+            cache = cache_conn.recv()
+        except (IOError, OSError, EOFError):
+            cache = None
+        cache_conn.close()
+        proc.join()
+
+        # keep what the job learned about the filesystem for the next one
+        if cache is not None:
+            with self._lock:
+                set_module_cache(cache)
+
+    def _reap_jobs(self, block=False):
+        """Forget the threads of finished jobs.  If block is True, wait for
+        all of the jobs to finish.
+        """
+        if block:
+            for thread in self._jobs:
+                thread.join()
+        self._jobs = [t for t in self._jobs if t.is_alive()]
+
+    def _listen(self):
+        if os.path.exists(self.address):
+            conn = connect(self.address)
+            if conn is not None:
+                conn.close()
+                raise RuntimeError("a testflo daemon is already listening on %s" %
+                                   self.address)
+            os.remove(self.address)  # left over from a daemon that died
+
+        key = os.urandom(32)
+        keyfile = self.address + '.key'
+        try:
+            os.remove(keyfile)  # left over from a daemon that died
+        except OSError:
+            pass
+
+        old_umask = os.umask(0o077)  # only this user can connect
+        try:
+            listener = Listener(self.address, family='AF_UNIX', authkey=key)
+            # O_EXCL makes sure we don't write our key into a file that
+            # someone else made and can read
+            try:
+                fd = os.open(keyfile, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o600)
+            except OSError:
+                listener.close()
+                raise
+            with os.fdopen(fd, 'wb') as f:
+                f.write(key)
+        finally:
+            os.umask(old_umask)
+        return listener
+
+    def serve(self):
+        """Run jobs until stopped by a client or interrupted."""
+        for modname in self.options.preload_modules or ():
+            try:
+                __import__(modname)
+            except Exception:
+                warnings.warn("Couldn't preload module '%s':\n%s" %
+                              (modname, traceback.format_exc()))
+
+        listener = self._listen()
+        print("testflo daemon listening on %s" % self.address)
+        sys.stdout.flush()
+
+        try:
+            while True:
+                try:
+                    conn = listener.accept()
+                except Exception:
+                    continue  # failed authentication or a dropped connection
+                try:
+                    self._reap_jobs()
+                    if not self._handle(conn):
+                        break
+                finally:
+                    conn.close()
+            self._reap_jobs(block=True)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            listener.close()
+            try:
+                os.remove(self.address + '.key')
+            except OSError:
+                pass
+            if self._manager is not None:
+                self._manager.shutdown()
+
+        return 0
+
+    def _handle(self, conn):
+        """Handle a request from a client.  Returns False if we should stop."""
+        try:
+            msg = conn.recv()
+        except (IOError, OSError, EOFError):
+            return True
+
+        if msg[0] == 'STOP':
+            conn.send('DONE')
+            return False
+
+        if msg[0] == 'RUN':
+            job_options, tests, cwd, env, path, argv = msg[1:]
+            queue = self._get_queue(job_options)
+            cache_conn, child_cache_conn = self._ctx.Pipe(duplex=False)
+            proc = self._ctx.Process(target=_run_job,
+                                     args=(conn, child_cache_conn, queue,
+                                           job_options, tests, cwd, env, path,
+                                           argv))
+            with self._lock:
+                proc.start()
+            child_cache_conn.close()
+
+            # the job talks to the client from here on, and a thread waits
+            # for it to finish, so we can accept the next client.
+            thread = threading.Thread(target=self._finish_job,
+                                      args=(proc, cache_conn, queue))
+            thread.daemon = True
+            thread.start()
+            self._jobs.append(thread)
+
+        return True
+
+
+class DaemonClient(object):
+    """The first stage of a pipeline that has the daemon discover and run
+    the tests, and yields the finished Test objects it sends back.
+    """
+
+    def __init__(self, options, address=None):
+        self.options = options
+        self.address = address
+
+    def available(self):
+        """Return True if the current user's daemon is running."""
+        if self.address is None:
+            try:
+                self.address = default_address()
+            except RuntimeError:
+                return False
+        return _is_private(self.address) and _is_private(self.address + '.key')
+
+    def get_iter(self, input_iter):
+        conn = connect(self.address)
+        if conn is None:
+            raise RuntimeError("can't connect to the testflo daemon at %s" %
+                               self.address)
+        try:
+            conn.send(('RUN', self.options, list(input_iter), os.getcwd(),
+                       dict(os.environ), sys.path, sys.argv))
+            while True:
+                msg = conn.recv()
+                if msg == 'DONE':
+                    break
+                if isinstance(msg, tuple):
+                    raise RuntimeError("testflo daemon failed:\n%s" % msg[1])
+                yield msg
+        finally:
+            conn.close()
+
+
+def stop_daemon(address=None):
+    """Tell the daemon to stop.  Returns False if it wasn't running."""
+    conn = connect(address)
+    if conn is None:
+        return False
+    try:
+        conn.send(('STOP',))
+        conn.recv()
+    finally:
+        conn.close()
+    return True
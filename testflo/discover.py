@@ -1,5 +1,6 @@
 
 import traceback
+from fnmatch import fnmatchcase
 from inspect import getmembers, isclass, isfunction
 from unittest import TestCase
 import six
@@ -19,14 +20,21 @@ def _has_class_fixture(tcase):
     return False
 
 
+def _test_file(test):
+    """Return the module part of the given test's spec."""
+    return test.spec.split(':', 1)[0]
+
+
 class TestDiscoverer(object):
 
     def __init__(self, module_pattern=six.text_type('test*.py'),
                        func_match=lambda f: fnmatchcase(f, 'test*'),
-                       dir_exclude=None):
+                       dir_exclude=None, ignorefile=None, walk_threads=0):
         self.module_pattern = module_pattern
         self.func_match = func_match
         self.dir_exclude = dir_exclude
+        self.ignorefile = ignorefile
+        self.walk_threads = walk_threads
 
         # to support module and class fixtures, we need to be able to
         # process all tests in a module or TestCase in the same process,
@@ -47,19 +55,36 @@ class TestDiscoverer(object):
                 itr = self._testspec_iter
 
             for result in itr(tests):
-                if result.spec not in seen:
+                if isinstance(result, list):
+                    # a fixture group from a module that has been fully scanned
+                    yield result
+                elif result.spec not in seen:
                     seen.add(result.spec)
                     result = self._filter(result)
                     if result is not None:
                         yield result
 
-        # Every test left has been group together either by module or
+        # yield any fixture groups that are still left, i.e., those made up
+        # of individually specified tests
+        for tests in self._fixture_groups():
+            yield tests
+
+    def _fixture_groups(self, fname=None):
+        """Yield each group of tests that must run in the same process due to
+        module or TestCase fixtures, and forget about them.  If fname is not
+        None, only the groups for tests from that module file are yielded.
+        """
+        # Every test in these groups has been grouped together either by module or
         # TestCase or both, due to the presense of module or testcase class level
         # setup/teardown, and we need to run each group on the same
         # process so that we can execute the module or class level setup/teardown
         # only once while impacting all of the tests in that group.
         new_tcase_groups = []
-        for tcase, tests in self._tcase_fixture_groups.items():
+        for tcase, tests in list(self._tcase_fixture_groups.items()):
+            if fname is not None and _test_file(tests[0]) != fname:
+                continue
+
+            del self._tcase_fixture_groups[tcase]
             tests = sorted(tests, key=lambda t: t.spec)
 
             # mark the first and last tests so that we know when to
@@ -76,7 +101,11 @@ class TestDiscoverer(object):
             new_tcase_groups.append(tests)
 
         # yield any tests that are grouped because of a module level fixture.
-        for tests in self._mod_fixture_groups.values():
+        for m, tests in list(self._mod_fixture_groups.items()):
+            if fname is not None and _test_file(tests[0]) != fname:
+                continue
+
+            del self._mod_fixture_groups[m]
             tests = sorted(tests, key=lambda t: t.spec)
 
             # mark the first and last tests so that we know when to
@@ -115,7 +144,9 @@ class TestDiscoverer(object):
         of Test objects.
         """
         for f in find_files(dname, match=self.module_pattern,
-                                   direxclude=self.dir_exclude):
+                                   direxclude=self.dir_exclude,
+                                   ignorefile=self.ignorefile,
+                                   nthreads=self.walk_threads):
             if not basename(f).startswith(six.text_type('__init__.')):
                 for result in self._module_iter(f):
                     yield result
@@ -142,6 +173,14 @@ class TestDiscoverer(object):
                     elif isfunction(obj) and self.func_match(name):
                         yield Test(':'.join((filename, obj.__name__)))
 
+                # now that the whole module has been scanned, its fixture
+                # groups are complete, so they can run without waiting for
+                # the rest of discovery.  Groups are matched by file rather
+                # than by module object, since modules that aren't importable
+                # from sys.path get a new module object for every test.
+                for tests in self._fixture_groups(filename):
+                    yield tests
+
     def _testcase_iter(self, fname, testcase):
         """Returns an iterator of Test objects coming from a given
         TestCase class.
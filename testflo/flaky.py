@@ -0,0 +1,218 @@
+"""
+Support for rerunning failed tests in isolated processes to find out
+whether they're flaky, and for keeping track of flaky tests across runs.
+"""
+
+import time
+import threading
+import traceback
+
+from six.moves import queue as _queue
+
+from testflo.util import load_json, save_json
+from testflo.ordering import _spec_key
+
+
+def _is_failure(result):
+    """Return True if the given result is a failure that may be flaky.
+    Unlike util.is_failure, tests stopped by a resource limit aren't rerun.
+    """
+    return result.status == 'FAIL' and not result.expected_fail
+
+
+class FlakeDB(object):
+    """A JSON file of how often each test that has ever failed has run,
+    failed, and turned out to be flaky.
+    """
+
+    def __init__(self, fname='testflo_flakes.json'):
+        self.fname = fname
+        self._data = load_json(fname)
+
+    def record(self, spec, failed, flaky=False):
+        """Record a run of the given test.  Nothing is kept for tests that
+        have never failed.  Tests are recorded by a form of their spec that
+        doesn't depend on the current dir.
+        """
+        spec = _spec_key(spec)
+        rec = self._data.get(spec)
+        if rec is None:
+            if not failed:
+                return
+            rec = self._data[spec] = {'runs': 0, 'fails': 0, 'flakes': 0}
+        rec['runs'] += 1
+        if failed:
+            rec['fails'] += 1
+        if flaky:
+            rec['flakes'] += 1
+        rec['last_run'] = time.time()
+
+    def get(self, spec):
+        return self._data.get(_spec_key(spec))
+
+    def flaky_specs(self):
+        """Return the set of specs of tests that have been flaky before."""
+        return set(spec for spec, rec in self._data.items() if rec['flakes'])
+
+    def save(self):
+        save_json(self.fname, self._data)
+
+
+class FlakyRerunner(object):
+    """Holds back each failed test and reruns it up to 'reruns' times in
+    isolated processes.  If it passes, its status becomes FLAKY, else it
+    stays FAIL.
+
+    If background is True, reruns start as soon as a test fails and run in
+    a thread while the rest of the tests are running (which is only safe
+    when the tests are running in worker processes), and each failed test
+    is passed on as soon as its reruns are done.  Otherwise they all run
+    after the other tests are done.
+    """
+
+    def __init__(self, reruns, flakedb=None, background=False):
+        self.reruns = reruns
+        self.flakedb = flakedb
+        self.background = background
+        self._manager = None
+        self._queue = None
+
+    def _get_queue(self):
+        """Return a queue for the results of our isolated reruns.  It isn't
+        shared with the test runner, so results can't get mixed up.
+        """
+        if self._queue is None:
+            from testflo.qman import get_server_queue
+            self._manager, self._queue = get_server_queue()
+        return self._queue
+
+    def _new_tests(self, result):
+        """Return new Test objects for each rerun of a failed test."""
+        from testflo.test import Test
+
+        tests = []
+        for i in range(self.reruns):
+            test = Test(result.spec)
+            test.isolated = 'subprocess'
+            test.run_fixtures = True
+            tests.append(test)
+        return tests
+
+    def _rerun(self, result, tests):
+        """Run tests (new copies of a failed test) until one passes, then
+        return the result updated to show whether it was flaky.
+        """
+        q = self._get_queue()
+        for i, test in enumerate(tests):
+            rerun = test.run(q)
+            if rerun.status == 'OK' and not rerun.expected_fail:
+                result.status = 'FLAKY'
+                result.err_msg = ("Passed on isolated rerun %d of %d after failing:\n%s" %
+                                  (i + 1, len(tests), result.err_msg))
+                break
+        else:
+            if tests:
+                result.err_msg += ("\nFailed again in %d isolated rerun%s.\n" %
+                                   (len(tests), '' if len(tests) == 1 else 's'))
+        return result
+
+    def _record(self, result, failed):
+        if self.flakedb is not None:
+            flaky = result.status == 'FLAKY'
+            self.flakedb.record(result.spec, failed, flaky)
+            rec = self.flakedb.get(result.spec)
+            if flaky and rec is not None:
+                result.err_msg += ("\nThis test has been flaky in %d of %d recorded runs.\n" %
+                                   (rec['flakes'], rec['runs']))
+
+    def get_iter(self, input_iter):
+        if self.background:
+            it = self._background_iter(input_iter)
+        else:
+            it = self._held_iter(input_iter)
+
+        try:
+            for result in it:
+                yield result
+        finally:
+            # if the run was interrupted, this records any reruns that
+            # finished but weren't reported yet
+            it.close()
+
+            if self.flakedb is not None:
+                self.flakedb.save()
+
+            if self._manager is not None:
+                self._manager.shutdown()
+
+    def _should_rerun(self, result):
+        # don't rerun tests that couldn't even be found or imported
+        return _is_failure(result) and ':' in result.spec
+
+    def _held_iter(self, input_iter):
+        """Hold back the failed tests and rerun them after the others."""
+        held = []
+        for result in input_iter:
+            if self._should_rerun(result):
+                held.append((result, self._new_tests(result)))
+            else:
+                self._record(result, _is_failure(result))
+                yield result
+
+        for result, tests in held:
+            self._rerun(result, tests)
+            self._record(result, True)
+            yield result
+
+    def _background_iter(self, input_iter):
+        """Rerun the failed tests in a thread, and pass each one on as soon
+        as its reruns are done.
+        """
+        jobs = _queue.Queue()
+        done = _queue.Queue()
+        thread = threading.Thread(target=self._rerun_jobs, args=(jobs, done))
+        thread.daemon = True
+        thread.start()
+
+        pending = 0
+        try:
+            for result in input_iter:
+                if self._should_rerun(result):
+                    jobs.put((result, self._new_tests(result)))
+                    pending += 1
+                else:
+                    self._record(result, _is_failure(result))
+                    yield result
+
+                while pending:
+                    try:
+                        result = done.get_nowait()
+                    except _queue.Empty:
+                        break
+                    pending -= 1
+                    self._record(result, True)
+                    yield result
+
+            jobs.put(None)
+            while pending:
+                result = done.get()
+                pending -= 1
+                self._record(result, True)
+                yield result
+        finally:
+            jobs.put(None)
+            while pending:
+                try:
+                    result = done.get_nowait()
+                except _queue.Empty:
+                    break
+                pending -= 1
+                self._record(result, True)
+
+    def _rerun_jobs(self, jobs, done):
+        for result, tests in iter(jobs.get, None):
+            try:
+                self._rerun(result, tests)
+            except Exception:
+                result.err_msg += "\nRerun failed:\n%s" % traceback.format_exc()
+            done.put(result)
@@ -12,6 +12,7 @@ if __name__ == '__main__':
     from testflo.test import Test
     from testflo.cover import save_coverage
     from testflo.qman import get_client_queue
+    from testflo.options import get_options
 
     queue = get_client_queue()
     os.environ['TESTFLO_QUEUE'] = ''
@@ -20,6 +21,9 @@ if __name__ == '__main__':
         try:
             test = Test(sys.argv[1])
             test.nocapture = True # so we don't lose stdout
+            if get_options().run_fixtures:
+                test._mod_fixture_first = test._mod_fixture_last = True
+                test._tcase_fixture_first = test._tcase_fixture_last = True
             test.run()
         except:
             print(traceback.format_exc())
@@ -0,0 +1,343 @@
+"""
+Support for limiting the resources a test can use, so that a runaway test
+can't take down the machine.  ResourceLimits sets per-test limits with
+setrlimit in whichever process runs the test, and CgroupLimits puts each
+worker process in its own cgroup v2 group where the controllers have been
+delegated to us.  Tests that exceed a limit get a status of LIMIT.
+"""
+
+import os
+import re
+import math
+import signal
+
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+
+from testflo.util import reset_peak_memory, get_peak_memory
+
+
+class ResourceLimitError(Exception):
+    """Raised in the main thread when a test uses up its CPU time."""
+    pass
+
+
+# the errors a test gets when it runs into its address space or open
+# files (EMFILE) limit
+_memory_rgx = re.compile(r'^MemoryError\b', re.M)
+_files_rgx = re.compile(r'^\w+Error: \[Errno 24\]', re.M)
+
+
+def _cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _open_files():
+    try:
+        return len(os.listdir('/proc/self/fd')) - 1  # not counting listdir's own
+    except OSError:
+        return None
+
+
+class ResourceLimits(object):
+    """Sets soft resource limits for one test in the current process, and
+    puts the old limits back when it's done.  memory is the address space
+    limit in MB, cpu is the CPU time in seconds the test may use, and files
+    is the maximum number of open files.  Like TimeoutAlarm, the CPU time
+    limit only works in the main thread.
+    """
+
+    def __init__(self, memory=0, cpu=0, files=0):
+        self.memory = memory
+        self.cpu = cpu
+        self.files = files
+        self.exceeded = None  # description of the limit the test exceeded
+        self._old = []
+        self._old_handler = None
+        self._start_cpu = 0.
+        self._start_memory = None
+
+    def _set(self, res, value):
+        soft, hard = resource.getrlimit(res)
+        if hard != resource.RLIM_INFINITY:
+            value = min(value, hard)
+        try:
+            resource.setrlimit(res, (value, hard))
+        except (ValueError, OSError):
+            return
+        self._old.append((res, soft, hard))
+
+    def _restore(self):
+        for res, soft, hard in reversed(self._old):
+            try:
+                resource.setrlimit(res, (soft, hard))
+            except (ValueError, OSError):
+                pass
+        self._old = []
+
+    def start(self):
+        if resource is None:
+            return
+
+        self._start_cpu = _cpu_time()
+        self._start_memory = reset_peak_memory()
+
+        if self.memory > 0:
+            self._set(resource.RLIMIT_AS, int(self.memory * 1024 * 1024))
+        if self.files > 0:
+            self._set(resource.RLIMIT_NOFILE, int(self.files))
+        if self.cpu > 0 and hasattr(signal, 'SIGXCPU'):
+            try:
+                self._old_handler = signal.signal(signal.SIGXCPU, self._handler)
+            except ValueError:
+                return  # not in the main thread
+            # RLIMIT_CPU counts all of the CPU time used by the process
+            self._set(resource.RLIMIT_CPU, int(math.ceil(self._start_cpu + self.cpu)))
+
+    def _handler(self, signum, frame):
+        # put back the old limits now, so the kernel stops sending SIGXCPU
+        self._restore()
+        self.exceeded = "CPU time limit of %s sec exceeded" % self.cpu
+        raise ResourceLimitError(self.exceeded)
+
+    def _usage(self):
+        parts = ["used %.2f sec of CPU time" % (_cpu_time() - self._start_cpu)]
+        if self._start_memory is not None:
+            parts.append("%.0f MB of memory" % max(0., get_peak_memory() - self._start_memory))
+        nfiles = _open_files()
+        if nfiles is not None:
+            parts.append("%d open files at the end" % nfiles)
+        return ', '.join(parts)
+
+    def disarm(self):
+        """Put back the old limits and SIGXCPU handler."""
+        if resource is None:
+            return
+
+        self._restore()
+        if self._old_handler is not None:
+            signal.signal(signal.SIGXCPU, self._old_handler)
+            self._old_handler = None
+
+    def stop(self, test):
+        """Put back the old limits if disarm hasn't already.  If the test
+        exceeded a limit, set its status to LIMIT and add what it used to
+        its err_msg.
+        """
+        if resource is None:
+            return
+
+        self.disarm()
+
+        # RLIMIT_CPU only works in whole seconds, so a test can use up to a
+        # second more than its limit without being stopped
+        if self.exceeded is None and self.cpu > 0 and \
+           _cpu_time() - self._start_cpu > self.cpu:
+            self.exceeded = "CPU time limit of %s sec exceeded" % self.cpu
+
+        if self.exceeded is None and test.status == 'FAIL':
+            if self.memory > 0 and _memory_rgx.search(test.err_msg):
+                self.exceeded = "Address space limit of %s MB exceeded" % self.memory
+            elif self.files > 0 and _files_rgx.search(test.err_msg):
+                self.exceeded = "Open files limit of %s exceeded" % self.files
+
+        if self.exceeded is not None:
+            test.status = 'LIMIT'
+            test.err_msg = "%s (%s).\n%s" % (self.exceeded, self._usage(), test.err_msg)
+
+
+def _read(path):
+    with open(path) as f:
+        return f.read()
+
+
+def _write(path, value):
+    with open(path, 'w') as f:
+        f.write(value)
+
+
+def _cgroup2_mount():
+    """Return where the cgroup v2 hierarchy is mounted, or None."""
+    try:
+        with open('/proc/self/mounts') as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) > 2 and fields[2] == 'cgroup2':
+                    return fields[1]
+    except (IOError, OSError):
+        pass
+    return None
+
+
+def _own_cgroup():
+    """Return the path of our cgroup v2 group within the hierarchy, or None."""
+    try:
+        with open('/proc/self/cgroup') as f:
+            for line in f:
+                if line.startswith('0::'):
+                    return line[3:].strip()
+    except (IOError, OSError):
+        pass
+    return None
+
+
+def _events(path):
+    """Return the counts in a cgroup .events file as a dict."""
+    try:
+        return dict((k, int(v)) for k, v in (l.split() for l in _read(path).splitlines()))
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+class CgroupLimits(object):
+    """Puts each worker process in its own cgroup v2 group with the given
+    memory.max (in MB), cpu.max (in CPUs) and pids.max limits, which also
+    cover any processes its tests start.
+
+    The controllers must have been delegated to the group testflo is running
+    in, e.g., by running it under systemd-run --user --scope -p Delegate=yes.
+    Raises OSError if they haven't.
+    """
+
+    def __init__(self, memory=0, cpus=0, pids=0):
+        self.memory = memory
+        self.cpus = cpus
+        self.pids = pids
+
+        mount = _cgroup2_mount()
+        path = _own_cgroup()
+        if mount is None or path is None:
+            raise OSError("cgroup v2 isn't available")
+        self.parent = os.path.join(mount, path.lstrip('/'))
+
+        wanted = []
+        if memory > 0:
+            wanted.append('memory')
+        if cpus > 0:
+            wanted.append('cpu')
+        if pids > 0:
+            wanted.append('pids')
+
+        available = _read(os.path.join(self.parent, 'cgroup.controllers')).split()
+        missing = [c for c in wanted if c not in available]
+        if missing:
+            raise OSError("the %s cgroup controllers haven't been delegated to %s" %
+                          (', '.join(missing), self.parent))
+
+        self._enabled = []
+        self._leaf = None
+        self._groups = {}
+        self._seen = {}
+
+        enabled = _read(os.path.join(self.parent, 'cgroup.subtree_control')).split()
+        wanted = [c for c in wanted if c not in enabled]
+        if wanted:
+            self._enable(wanted)
+
+    def _enable(self, controllers):
+        """Enable the given controllers for the children of our group.  A group
+        with processes in it can't do that, so first move its processes, which
+        must all be ours, into a child group.
+        """
+        from testflo.runner import _descendants
+
+        procs = os.path.join(self.parent, 'cgroup.procs')
+        pids = [int(p) for p in _read(procs).split()]
+        ours = set([os.getpid()] + _descendants(os.getpid()))
+        if not set(pids).issubset(ours):
+            raise OSError("%s has processes in it that aren't testflo's" % self.parent)
+
+        leaf = os.path.join(self.parent, 'testflo-main')
+        if not os.path.isdir(leaf):
+            os.mkdir(leaf)
+        self._leaf = leaf
+        for pid in pids:
+            _write(os.path.join(leaf, 'cgroup.procs'), str(pid))
+
+        _write(os.path.join(self.parent, 'cgroup.subtree_control'),
+               ' '.join('+' + c for c in controllers))
+        self._enabled = controllers
+
+    def add(self, name, pid):
+        """Put the process with the given pid into a new group with our limits."""
+        path = os.path.join(self.parent, 'testflo-%s' % name)
+        os.mkdir(path)
+        self._groups[name] = path
+
+        if self.memory > 0:
+            _write(os.path.join(path, 'memory.max'), str(int(self.memory * 1024 * 1024)))
+            try:
+                # otherwise hitting memory.max just means swapping
+                _write(os.path.join(path, 'memory.swap.max'), '0')
+            except (IOError, OSError):
+                pass
+        if self.cpus > 0:
+            period = 100000
+            _write(os.path.join(path, 'cpu.max'), '%d %d' % (int(self.cpus * period), period))
+        if self.pids > 0:
+            _write(os.path.join(path, 'pids.max'), str(int(self.pids)))
+
+        _write(os.path.join(path, 'cgroup.procs'), str(pid))
+
+    def exceeded(self, name):
+        """Return a description of any limits the group for the given worker
+        has run into since the last call, or None.
+        """
+        path = self._groups.get(name)
+        if path is None:
+            return None
+
+        counts = (_events(os.path.join(path, 'memory.events')).get('oom_kill', 0),
+                  _events(os.path.join(path, 'pids.events')).get('max', 0))
+        old = self._seen.get(name, (0, 0))
+        self._seen[name] = counts
+
+        msgs = []
+        if counts[0] > old[0]:
+            msg = "cgroup memory.max of %s MB exceeded, so the OOM killer ran" % self.memory
+            try:
+                peak = int(_read(os.path.join(path, 'memory.peak'))) / (1024. * 1024.)
+                msg += " (peak memory %.0f MB)" % peak
+            except (IOError, OSError, ValueError):
+                pass
+            msgs.append(msg + '.')
+        if counts[1] > old[1]:
+            msgs.append("cgroup pids.max of %s reached, so a fork failed." % self.pids)
+
+        return '\n'.join(msgs) + '\n' if msgs else None
+
+    def remove_all(self):
+        """Remove the groups of all of the workers, which must have stopped."""
+        for path in self._groups.values():
+            try:
+                os.rmdir(path)
+            except OSError:
+                pass
+        self._groups = {}
+        self._seen = {}
+
+    def close(self):
+        """Remove the groups of all of the workers, and undo what _enable did,
+        moving our processes back into the group they started in.
+        """
+        self.remove_all()
+
+        if self._enabled:
+            try:
+                _write(os.path.join(self.parent, 'cgroup.subtree_control'),
+                       ' '.join('-' + c for c in self._enabled))
+            except (IOError, OSError):
+                pass
+            self._enabled = []
+
+        if self._leaf is not None:
+            try:
+                for pid in _read(os.path.join(self._leaf, 'cgroup.procs')).split():
+                    _write(os.path.join(self.parent, 'cgroup.procs'), pid)
+                os.rmdir(self._leaf)
+            except (IOError, OSError):
+                pass
+            self._leaf = None
@@ -28,20 +28,21 @@ import os
 import sys
 import six
 import time
+import warnings
 
-from fnmatch import fnmatch, fnmatchcase
+from fnmatch import fnmatchcase
 
-from testflo.runner import ConcurrentTestRunner
+from testflo.runner import ConcurrentTestRunner, ThreadTestRunner
 from testflo.printer import ResultPrinter
 from testflo.benchmark import BenchmarkWriter
 from testflo.summary import ResultSummary
 from testflo.discover import TestDiscoverer
 from testflo.filters import TimeFilter, FailFilter
 
-from testflo.util import read_config_file, read_test_file
+from testflo.util import read_config_file, read_test_file, is_failure
 from testflo.cover import setup_coverage, finalize_coverage
 from testflo.options import get_options
-from testflo.qman import get_server_queue
+from testflo.test import mpi_available
 
 options = get_options()
 
@@ -74,12 +75,63 @@ def run_pipeline(source, pipe):
 
     # iterate over the last iter in the pipline and we're done
     for result in iters[-1]:
-        if result.status == 'FAIL' and not result.expected_fail:
+        if is_failure(result):
             return_code = 1
 
     return return_code
 
 
+def get_discoverer(options):
+    """Return a TestDiscoverer set up according to the given options."""
+    # glob patterns, compiled once by find_files and checked against each
+    # directory name before the directory is read
+    dir_exclude = options.skip_dirs
+    ignorefile = '.gitignore' if options.gitignore else None
+
+    if options.benchmark:
+        return TestDiscoverer(module_pattern=six.text_type('benchmark*.py'),
+                              func_match=lambda f: fnmatchcase(f, 'benchmark*'),
+                              dir_exclude=dir_exclude,
+                              ignorefile=ignorefile,
+                              walk_threads=options.walk_threads)
+
+    def func_matcher(funcname):
+        for pattern in options.test_glob:
+            if fnmatchcase(funcname, pattern):
+                return True
+        return False
+
+    return TestDiscoverer(dir_exclude=dir_exclude,
+                          func_match=func_matcher,
+                          ignorefile=ignorefile,
+                          walk_threads=options.walk_threads)
+
+
+def get_priority_order(options):
+    """Return a PriorityOrder that puts the tests chosen by the ordering
+    options first, or None if there aren't any.
+    """
+    from testflo.ordering import PriorityOrder, FailedFirst, FlakyFirst, ChangedFirst
+
+    priorities = []
+    if options.failed_first:
+        priorities.append(FailedFirst())
+
+    if options.flaky_first:
+        priorities.append(FlakyFirst(options.flaky_file))
+
+    if options.changed_first:
+        # failtests.in is written at the end of each run with this option
+        try:
+            last_run = os.path.getmtime('failtests.in')
+        except OSError:
+            last_run = 0.
+        priorities.append(ChangedFirst(last_run))
+
+    if priorities:
+        return PriorityOrder(*priorities)
+
+
 def main(args=None):
     if args is None:
         args = sys.argv[1:]
@@ -111,11 +163,25 @@ skip_dirs=site-packages,
     if not tests:
         tests = [os.getcwd()]
 
-    def dir_exclude(d):
-        for skip in options.skip_dirs:
-            if fnmatch(os.path.basename(d), skip):
-                return True
-        return False
+    if options.daemon or options.stop_daemon:
+        from testflo.daemon import TestDaemon, stop_daemon
+        if options.stop_daemon:
+            if not stop_daemon(options.daemon_socket):
+                print("The testflo daemon isn't running.", file=sys.stderr)
+                return 1
+            return 0
+        return TestDaemon(options, options.daemon_socket).serve()
+
+    # the daemon can't collect coverage or watch for changes for us
+    client = None
+    if options.use_daemon and not (options.dryrun or options.watch or
+                                   options.coverage or options.coveragehtml):
+        from testflo.daemon import DaemonClient
+        client = DaemonClient(options, options.daemon_socket)
+        if not client.available():
+            print("The testflo daemon isn't running, so running tests here.",
+                  file=sys.stderr)
+            client = None
 
     setup_coverage(options)
 
@@ -127,73 +193,155 @@ skip_dirs=site-packages,
     if not options.test_glob:
         options.test_glob = ['test*']
 
-    def func_matcher(funcname):
-        for pattern in options.test_glob:
-            if fnmatchcase(funcname, pattern):
-                return True
-        return False
-
     if options.benchmark:
         options.num_procs = 1
-        options.isolated = True
-        discoverer = TestDiscoverer(module_pattern=six.text_type('benchmark*.py'),
-                                    func_match=lambda f: fnmatchcase(f, 'benchmark*'),
-                                    dir_exclude=dir_exclude)
+        options.isolated = 'subprocess'
         benchmark_file = open(options.benchmarkfile, 'a')
     else:
-        discoverer = TestDiscoverer(dir_exclude=dir_exclude,
-                                    func_match=func_matcher)
         benchmark_file = open(os.devnull, 'a')
 
+    if options.isolated == 'subinterp':
+        from testflo.subinterp import available
+        if not available():
+            warnings.warn("Subinterpreters aren't available in this version of "
+                          "python, so isolated tests will run in subprocesses.")
+            options.isolated = 'subprocess'
+
+    discoverer = get_discoverer(options)
+
     retval = 0
 
-    if options.isolated or not options.nompi:
+    # the queue is only needed to get results back from isolated or MPI
+    # subprocesses, so don't start a server process for it otherwise
+    # (tests in subinterpreters only start one if they need a subprocess)
+    if client is None and not options.dryrun and \
+       (options.isolated == 'subprocess' or (not options.nompi and mpi_available())):
         # create a distributed queue and get a proxy to it
+        from testflo.qman import get_server_queue
         manager, queue = get_server_queue()
     else:
         manager, queue = (None, None)
 
     with report_file as report, benchmark_file as bdata:
-        pipeline = [
-            discoverer.get_iter,
-        ]
-
-        if options.dryrun:
-            pipeline.append(dryrun)
+        if options.dryrun or client is not None:
+            runner = None
         else:
             if options.pre_announce:
                 options.num_procs = 1
 
-            runner = ConcurrentTestRunner(options, queue)
-
-            pipeline.append(runner.get_iter)
-
-            if options.benchmark:
-                pipeline.append(BenchmarkWriter(stream=bdata).get_iter)
-
-            if options.compact:
-                verbose = -1
+            if options.threads > 0:
+                if options.profile:
+                    raise RuntimeError("--threads can't be used with --profile")
+                runner = ThreadTestRunner(options, queue)
+            else:
+                runner = ConcurrentTestRunner(options, queue)
+
+        def run(tests, extra_stages=()):
+            """Run the given tests through the pipeline and return 1 if
+            any failed unexpectedly, else 0.
+            """
+            if client is not None:
+                # the daemon discovers and runs the tests
+                pipeline = [client.get_iter]
             else:
-                verbose = int(options.verbose)
-
-            pipeline.extend([
-                ResultPrinter(verbose=verbose).get_iter,
-                ResultSummary(options).get_iter,
-            ])
-            if not options.noreport:
-                # print verbose results and summary to a report file
+                pipeline = [
+                    discoverer.get_iter,
+                    dryrun if options.dryrun else runner.get_iter,
+                ]
+            if client is None:
+                order = get_priority_order(options)
+                if order is not None:
+                    pipeline.insert(1, order.get_iter)
+
+            if options.rerun_failures > 0 and not options.dryrun:
+                from testflo.flaky import FlakeDB, FlakyRerunner
+                # reruns can overlap the rest of the run if it's in workers
+                background = client is not None or options.num_procs > 1 or \
+                             options.threads > 0
+                pipeline.append(FlakyRerunner(options.rerun_failures,
+                                              FlakeDB(options.flaky_file),
+                                              background=background).get_iter)
+
+            if options.memory_aware and not options.dryrun:
+                from testflo.memory import MemoryHistory
+                pipeline.append(MemoryHistory(options.memory_file).get_iter)
+
+            pipeline.extend(extra_stages)
+
+            # discovery and test running are the producers in the pipeline, and
+            # everything after them just consumes the results.
+            nproducers = len(pipeline)
+
+            if not options.dryrun:
+                if options.benchmark:
+                    pipeline.append(BenchmarkWriter(stream=bdata).get_iter)
+
+                if options.compact:
+                    verbose = -1
+                else:
+                    verbose = int(options.verbose)
+
+                if options.dedup_err:
+                    from testflo.capture import ErrDeduplicator
+                    pipeline.append(ErrDeduplicator().get_iter)
+
+                printer = ResultPrinter(verbose=verbose)
+                summary = ResultSummary(options)
+                if not options.noreport:
+                    # print verbose results and summary to a report file
+                    printer.add_stream(report, verbose=1)
+                    summary.add_stream(report)
+
                 pipeline.extend([
-                    ResultPrinter(report, verbose=1).get_iter,
-                    ResultSummary(options, stream=report).get_iter,
+                    printer.get_iter,
+                    summary.get_iter,
                 ])
 
-        if options.maxtime > 0:
-            pipeline.append(TimeFilter(options.maxtime).get_iter)
+                if options.profile:
+                    from testflo.profiler import ProfileReport
+                    pipeline.append(ProfileReport(options.profile_file,
+                                                  options.profile_top).get_iter)
+
+                if options.stack_samples:
+                    from testflo.watchdog import StackSampleWriter
+                    pipeline.append(StackSampleWriter(options.stack_samples).get_iter)
 
-        if options.save_fails:
-            pipeline.append(FailFilter().get_iter)
+                if options.junit_xml:
+                    from testflo.reports import JUnitXMLWriter
+                    pipeline.append(JUnitXMLWriter(options.junit_xml).get_iter)
 
-        retval = run_pipeline(tests, pipeline)
+                if options.jsonl:
+                    from testflo.reports import JSONLinesWriter
+                    pipeline.append(JSONLinesWriter(options.jsonl).get_iter)
+
+            if options.maxtime > 0:
+                pipeline.append(TimeFilter(options.maxtime).get_iter)
+
+            # --failed-first and --changed-first need to know about this run
+            if options.save_fails or options.failed_first or options.changed_first:
+                pipeline.append(FailFilter().get_iter)
+
+            if options.async_pipeline:
+                if six.PY2:
+                    raise RuntimeError("--async-pipeline requires python 3.")
+                from testflo.asyncpipe import run_async_pipeline
+                retval = run_async_pipeline(tests, pipeline[:nproducers],
+                                            pipeline[nproducers:])
+            else:
+                retval = run_pipeline(tests, pipeline)
+
+            return retval
+
+        if options.watch and not options.dryrun:
+            from testflo.watch import TestWatcher
+            watcher = TestWatcher(options, tests, run, runner,
+                                  module_pattern=discoverer.module_pattern)
+            try:
+                retval = watcher.watch()
+            finally:
+                runner.close()
+        else:
+            retval = run(tests)
 
         finalize_coverage(options)
 
@@ -0,0 +1,137 @@
+"""
+Support for --memory-aware, which keeps track of the peak memory used by
+each test and only starts a test when its predicted peak memory fits in
+the memory that's left.
+"""
+
+from six import advance_iterator
+
+from testflo.util import available_memory, load_json, save_json
+
+
+class MemoryHistory(object):
+    """A JSON file of the peak memory (in MB) used by the last few runs of
+    each test.  It's also a pipeline stage that records the peak memory of
+    each finished test and saves the file when the tests are done.
+    """
+
+    def __init__(self, fname='testflo_memory.json', keep=5):
+        self.fname = fname
+        self.keep = keep
+        self._data = load_json(fname)
+
+    def record(self, spec, peak):
+        peaks = self._data.setdefault(spec, [])
+        peaks.append(round(peak, 1))
+        del peaks[:-self.keep]
+
+    def predict(self, spec):
+        """Return the largest recent peak memory of the given test, or None
+        if it hasn't been recorded.
+        """
+        peaks = self._data.get(spec)
+        return max(peaks) if peaks else None
+
+    def save(self):
+        save_json(self.fname, self._data)
+
+    def get_iter(self, input_iter):
+        for result in input_iter:
+            # skipped tests and tests that failed to load didn't really run
+            if result.status in ('OK', 'FAIL') and result.peak_memory > 0.:
+                self.record(result.spec, result.peak_memory)
+            yield result
+
+        self.save()
+
+
+def _declared_memory(test):
+    """Return the MEMORY_MB declared by the test's TestCase or module."""
+    for obj in (test.tcase, test.mod):
+        mem = getattr(obj, 'MEMORY_MB', None)
+        if mem is not None:
+            return float(mem)
+    return None
+
+
+class MemoryAdmission(object):
+    """Decides which group of tests a ConcurrentTestRunner should start next,
+    so that the predicted peak memory of all of the running groups stays
+    within budget MB.  Groups that don't fit are held back while later ones
+    that do are started, up to lookahead groups.  Once max_skips groups have
+    been started ahead of the oldest held group, nothing else is started
+    until it fits, so big tests aren't put off forever.
+
+    A group that's predicted to need more than the whole budget is started
+    when nothing else is running.  Tests with no declared or recorded peak
+    memory are assumed to need none.
+    """
+
+    def __init__(self, history, budget=0, max_skips=8, lookahead=1000):
+        self.history = history
+        self.max_skips = max_skips
+        self.lookahead = lookahead
+        if budget > 0:
+            self.budget = budget
+        else:
+            avail = available_memory()
+            self.budget = None if avail is None else 0.9 * avail
+        self._held = []
+        self._skips = 0
+
+    def predict(self, tests):
+        """Return the predicted peak memory of a group of tests, which run
+        one after another in the same worker.
+        """
+        need = 0.
+        # a Test object iterates over itself
+        for test in tests:
+            mem = _declared_memory(test)
+            if mem is None:
+                mem = self.history.predict(test.spec)
+            if mem is not None:
+                need = max(need, mem)
+        return need
+
+    def _fits(self, need, running):
+        """Return True if a group needing the given memory can start while
+        groups needing the running total are still running.
+        """
+        if self.budget is None:
+            return True
+        budget = self.budget
+        # other processes may have started using memory since we began
+        avail = available_memory()
+        if avail is not None:
+            budget = min(budget, avail + running)
+        return running + need <= budget
+
+    def next_group(self, input_iter, running, nbusy):
+        """Return the next group of tests to start and its predicted peak
+        memory, given the predicted total of the nbusy running groups.
+        Returns (None, 0.) if nothing should start now.
+        """
+        for i, (tests, need) in enumerate(self._held):
+            if nbusy == 0 or self._fits(need, running):
+                del self._held[i]
+                if i == 0:
+                    self._skips = 0
+                else:
+                    self._skips += 1
+                return tests, need
+            if i == 0 and self._skips >= self.max_skips:
+                return None, 0.
+
+        while len(self._held) < self.lookahead:
+            try:
+                tests = advance_iterator(input_iter)
+            except StopIteration:
+                break
+            need = self.predict(tests)
+            if nbusy == 0 or self._fits(need, running):
+                if self._held:
+                    self._skips += 1
+                return tests, need
+            self._held.append((tests, need))
+
+        return None, 0.
@@ -0,0 +1,101 @@
+"""
+Pipeline stages that change the order in which discovered tests are run.
+"""
+
+import os
+
+
+def _spec_key(spec):
+    """Return a version of a testspec that doesn't depend on the current dir."""
+    fname, sep, rest = spec.partition(':')
+    if fname.endswith('.py'):
+        fname = os.path.abspath(fname)
+    return fname + sep + rest
+
+
+class PriorityOrder(object):
+    """Passes on each group of discovered tests containing a test matching
+    the first of the given predicates as soon as it's found, and holds back
+    all other groups until discovery is finished.  Those are then passed on
+    in the order of the first predicate any of their tests match, followed by
+    those that match none.  Fixture groups are kept together.
+    """
+
+    def __init__(self, *predicates):
+        self.predicates = predicates
+
+    def _rank(self, tests):
+        rank = len(self.predicates)
+        # a Test object iterates over itself
+        for t in tests:
+            for i, pred in enumerate(self.predicates[:rank]):
+                if pred(t):
+                    rank = i
+                    break
+            if rank == 0:
+                break
+        return rank
+
+    def get_iter(self, input_iter):
+        held = [[] for p in self.predicates]
+        for tests in input_iter:
+            rank = self._rank(tests)
+            if rank == 0:
+                yield tests
+            else:
+                held[rank - 1].append(tests)
+
+        for groups in held:
+            for tests in groups:
+                yield tests
+
+
+class FailedFirst(object):
+    """A predicate that's True for tests listed in the file of failed tests
+    written by FailFilter in the last run.
+    """
+
+    def __init__(self, fname='failtests.in'):
+        from testflo.util import read_test_file
+        try:
+            self.failed = set(_spec_key(s) for s in read_test_file(fname))
+        except (IOError, OSError):
+            self.failed = set()
+
+    def __call__(self, test):
+        return _spec_key(test.spec) in self.failed
+
+
+class FlakyFirst(object):
+    """A predicate that's True for tests that have been flaky before,
+    according to the given flake file.
+    """
+
+    def __init__(self, fname='testflo_flakes.json'):
+        from testflo.flaky import FlakeDB
+        self.flaky = set(_spec_key(s) for s in FlakeDB(fname).flaky_specs())
+
+    def __call__(self, test):
+        return _spec_key(test.spec) in self.flaky
+
+
+class ChangedFirst(object):
+    """A predicate that's True for tests in modules that have changed since
+    the given time.
+    """
+
+    def __init__(self, since):
+        self.since = since
+        self._changed = {}
+
+    def __call__(self, test):
+        fname = test.spec.partition(':')[0]
+        try:
+            return self._changed[fname]
+        except KeyError:
+            try:
+                changed = os.path.getmtime(fname) > self.since
+            except OSError:
+                changed = False
+            self._changed[fname] = changed
+            return changed
@@ -1,5 +1,7 @@
 
 import sys
+import time
+import threading
 
 from testflo.util import elapsed_str
 from testflo.options import get_options
@@ -13,6 +15,11 @@ _result_map = {
     ('SKIP', True): 'S',
     ('OK', False): '.',
     ('OK', True): 'U',  # unexpected success
+    ('FLAKY', False): 'K',  # failed, then passed when rerun
+    ('CANCELLED', False): 'C',  # killed after another test failed
+    ('CANCELLED', True): 'C',
+    ('LIMIT', False): 'L',  # exceeded a resource limit
+    ('LIMIT', True): 'L',
 }
 
 class ResultPrinter(object):
@@ -20,50 +27,95 @@ class ResultPrinter(object):
     after its test has been run if verbose is True.  If verbose is False,
     it displays a dot for each successful test, but skips or failures are
     still displayed in verbose form.
+
+    Output can go to multiple streams, each with its own verbosity, and each
+    result is formatted only once no matter how many streams it goes to.
+    Streams are flushed at most every flush_interval seconds, except when a
+    test fails or the run ends.  Anything left unflushed is flushed by a timer
+    when the interval is up, so it doesn't wait for the next result.
     """
 
-    def __init__(self, stream=sys.stdout, verbose=0):
-        self.stream = stream
-        self.verbose = verbose
+    def __init__(self, stream=sys.stdout, verbose=0, flush_interval=0.1):
+        self.streams = [(stream, verbose)]
+        self.flush_interval = flush_interval
+        self._last_flush = 0.
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def add_stream(self, stream, verbose=0):
+        """Also print results to the given stream."""
+        self.streams.append((stream, verbose))
 
     def get_iter(self, input_iter):
-        for result in input_iter:
-            self._print_result(result)
-            yield result
+        try:
+            for result in input_iter:
+                self._print_result(result)
+                yield result
+        finally:
+            with self._lock:
+                self._flush()
 
-    def _print_result(self, result):
-        stream = self.stream
+    def _flush(self):
+        # the caller must hold self._lock
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        for stream, _ in self.streams:
+            stream.flush()
+        self._last_flush = time.time()
 
-        stats = elapsed_str(result.elapsed())
+    def _timed_flush(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer = None
+                self._flush()
 
+    def _print_result(self, result):
         if ((result.expected_fail and result.status != 'FAIL') or
-            (not result.expected_fail and result.status == 'FAIL')):
+            (not result.expected_fail and result.status in ('FAIL', 'FLAKY')) or
+            result.status == 'LIMIT'):
             show_msg = True
         else:
             show_msg = False
 
-        if (self.verbose == 0 and (result.err_msg and show_msg)) or self.verbose > 0:
-            if result.mpi and result.nprocs > 0:
-                run_type = '(mpi) '
-            elif result.isolated:
-                run_type = '(isolated) '
-            else:
-                run_type = ''
-
-            if result.err_msg:
-                stream.write("%s%s ... %s (%s, %d MB)\n%s\n" % (
-                                                     run_type,
-                                                     result.spec,
-                                                     result.status,
-                                                     stats, result.memory_usage,
-                                                     result.err_msg))
-            else:
-                stream.write("%s%s ... %s (%s, %d MB)\n" % (
-                                                    run_type,
-                                                    result.spec,
-                                                    result.status,
-                                                    stats, result.memory_usage))
+        with self._lock:
+            msg = None
+            for stream, verbose in self.streams:
+                if (verbose == 0 and (result.err_msg and show_msg)) or verbose > 0:
+                    if msg is None:
+                        msg = self._format_result(result)
+                    stream.write(msg)
+                else:
+                    stream.write(_result_map[(result.status, result.expected_fail)])
+
+            wait = self._last_flush + self.flush_interval - time.time()
+            if show_msg or wait <= 0.:
+                self._flush()
+            elif self._timer is None:
+                self._timer = threading.Timer(wait, self._timed_flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _format_result(self, result):
+        stats = elapsed_str(result.elapsed())
+
+        if result.mpi and result.nprocs > 0:
+            run_type = '(mpi) '
+        elif result.isolated:
+            run_type = '(isolated) '
         else:
-            stream.write(_result_map[(result.status, result.expected_fail)])
+            run_type = ''
 
-        stream.flush()
+        if result.err_msg:
+            return "%s%s ... %s (%s, %d MB)\n%s\n" % (
+                                                 run_type,
+                                                 result.spec,
+                                                 result.status,
+                                                 stats, result.memory_usage,
+                                                 result.err_msg)
+        else:
+            return "%s%s ... %s (%s, %d MB)\n" % (
+                                                run_type,
+                                                result.spec,
+                                                result.status,
+                                                stats, result.memory_usage)
@@ -0,0 +1,71 @@
+"""
+Support for profiling tests using cProfile and combining the results
+into a single suite-wide profile.
+"""
+
+import sys
+import pstats
+
+from cProfile import Profile
+
+
+class _StatsHolder(object):
+    """Wraps a raw stats dict so that it can be loaded into a
+    pstats.Stats object.
+    """
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+def profile_call(func, *args):
+    """Call func(*args) under cProfile and return a tuple of the form
+    (return value, raw stats dict).  The raw stats dict is picklable, so
+    it can be sent back from worker processes and subprocesses.
+    """
+    prof = Profile()
+    try:
+        retval = prof.runcall(func, *args)
+    finally:
+        prof.create_stats()
+
+    return retval, prof.stats
+
+
+class ProfileReport(object):
+    """Merges the profile stats from each Test into a single pstats file
+    and writes a report of the top N functions (by internal time) found
+    across all of the tests.
+    """
+
+    def __init__(self, outfile='testflo_profile.prof', top=20, stream=sys.stdout):
+        self.outfile = outfile
+        self.top = top
+        self.stream = stream
+
+    def get_iter(self, input_iter):
+        stats = None
+
+        for test in input_iter:
+            if test.profile_stats:
+                tstats = pstats.Stats(_StatsHolder(test.profile_stats),
+                                      stream=self.stream)
+                test.profile_stats = None  # don't hang on to the raw stats
+                if stats is None:
+                    stats = tstats
+                else:
+                    stats.add(tstats)
+            yield test
+
+        if stats is not None:
+            stats.dump_stats(self.outfile)
+            self.stream.write("\nProfile data for all tests saved to %s\n" %
+                              self.outfile)
+            if self.top > 0:
+                self.stream.write("Top %d functions by internal time:\n" %
+                                  self.top)
+                stats.sort_stats('tottime').print_stats(self.top)
+            self.stream.flush()
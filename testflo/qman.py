@@ -10,7 +10,7 @@ from multiprocessing.managers import SyncManager, RebuildProxy, AutoProxy, Token
 # for server and clients
 _testflo_authkey = b'foobarxxxx'
 
-def get_server_queue():
+def get_server_queue(ctx=None):
     #FIXME: some OSX users were getting "Can't assign requested address" errors
     # if we use socket.gethostname() for the address. Changing it to
     # 'localhost' seems to fix the issue, but I don't know why. We had to
@@ -22,7 +22,10 @@ def get_server_queue():
     else:
         addr = socket.gethostname()
 
-    manager = SyncManager(address=(addr, 0), authkey=_testflo_authkey)
+    if ctx is None:
+        manager = SyncManager(address=(addr, 0), authkey=_testflo_authkey)
+    else:
+        manager = SyncManager(address=(addr, 0), authkey=_testflo_authkey, ctx=ctx)
     manager.start()
     return manager, manager.Queue()
 
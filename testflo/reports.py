@@ -0,0 +1,157 @@
+"""
+Pipeline stages that write machine readable test results (JUnit XML and
+JSON Lines) incrementally as the results arrive.
+"""
+
+import io
+import re
+import time
+import json
+import socket
+
+from xml.sax.saxutils import escape, quoteattr
+
+
+# characters that aren't allowed in an XML document
+_bad_xml_chars = re.compile(u'[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+def _xml_text(s):
+    return escape(_bad_xml_chars.sub('?', s))
+
+
+def _xml_attr(s):
+    return quoteattr(_bad_xml_chars.sub('?', s))
+
+
+def test_record(test):
+    """Return a dict of data about the given finished test."""
+    return {
+        'spec': test.spec,
+        'status': test.status,
+        'expected_fail': test.expected_fail,
+        'start_time': test.start_time,
+        'end_time': test.end_time,
+        'elapsed': test.elapsed(),
+        'memory_usage': test.memory_usage,
+        'load1m': test.load1m,
+        'load5m': test.load5m,
+        'load15m': test.load15m,
+        'nprocs': test.nprocs,
+        'mpi': bool(test.mpi and test.nprocs > 0),
+        'isolated': test.isolated,
+        'pid': test.pid,
+        'worker_id': test.worker_id,
+        'err_msg': test.err_msg,
+    }
+
+
+class JSONLinesWriter(object):
+    """Writes a JSON object for each test, one per line, as tests finish."""
+
+    def __init__(self, outfile='testflo_report.jsonl', flush_interval=0.1):
+        self.outfile = outfile
+        self.flush_interval = flush_interval
+
+    def get_iter(self, input_iter):
+        last_flush = 0.
+        with open(self.outfile, 'w') as f:
+            for test in input_iter:
+                f.write(json.dumps(test_record(test)))
+                f.write('\n')
+
+                now = time.time()
+                if now - last_flush >= self.flush_interval:
+                    f.flush()
+                    last_flush = now
+
+                yield test
+
+
+class JUnitXMLWriter(object):
+    """Writes a JUnit XML file, adding a testcase element for each test as it
+    finishes.  The document is closed properly even if the run is interrupted
+    by an exception such as KeyboardInterrupt.
+    """
+
+    # width reserved in the testsuite element for its attributes that
+    # get filled in at the end of the run
+    _attrs_width = 100
+
+    def __init__(self, outfile='testflo_report.xml', flush_interval=0.1):
+        self.outfile = outfile
+        self.flush_interval = flush_interval
+
+    def _suite_attrs(self, counts, elapsed):
+        attrs = ' tests="%d" failures="%d" skipped="%d" time="%.3f"' % (
+                    tuple(counts) + (elapsed,))
+        return attrs.ljust(self._attrs_width)
+
+    def get_iter(self, input_iter):
+        start = time.time()
+        counts = [0, 0, 0]  # tests, failures, skips
+        last_flush = 0.
+
+        with io.open(self.outfile, 'w', encoding='utf-8', errors='replace') as f:
+            f.write('<?xml version="1.0" encoding="utf-8"?>\n<testsuites>\n')
+            f.write('<testsuite name="testflo" hostname=%s timestamp=%s' %
+                    (_xml_attr(socket.gethostname()),
+                     _xml_attr(time.strftime('%Y-%m-%dT%H:%M:%S',
+                                             time.localtime(start)))))
+            counts_pos = f.tell()
+            f.write(self._suite_attrs(counts, 0.))
+            f.write('>\n')
+
+            try:
+                for test in input_iter:
+                    f.write(self._testcase(test, counts))
+
+                    now = time.time()
+                    if now - last_flush >= self.flush_interval:
+                        f.flush()
+                        last_flush = now
+
+                    yield test
+            finally:
+                f.write('</testsuite>\n</testsuites>\n')
+                f.seek(counts_pos)
+                f.write(self._suite_attrs(counts, time.time() - start))
+
+    def _testcase(self, test, counts):
+        module, _, rest = test.spec.rpartition(':')
+        if not module:
+            module, rest = rest, ''
+        tcase, _, name = rest.rpartition('.')
+        classname = ':'.join((module, tcase)) if tcase else module
+
+        counts[0] += 1
+        parts = ['<testcase classname=%s name=%s time="%.3f">\n' %
+                 (_xml_attr(classname), _xml_attr(name or rest),
+                  test.elapsed())]
+
+        parts.append('<properties>')
+        for prop in ('memory_usage', 'load1m', 'load5m', 'load15m', 'pid', 'worker_id'):
+            val = getattr(test, prop)
+            parts.append('<property name="%s" value=%s/>' %
+                         (prop, _xml_attr('' if val is None else str(val))))
+        parts.append('</properties>\n')
+
+        failed = ((test.status == 'FAIL') != bool(test.expected_fail) or
+                  test.status == 'LIMIT')
+        if test.status in ('SKIP', 'CANCELLED'):
+            counts[2] += 1
+            parts.append('<skipped message=%s/>\n' % _xml_attr(test.err_msg.strip()))
+        elif failed:
+            counts[1] += 1
+            if test.status == 'OK':
+                msg = 'unexpected success'
+            else:
+                msg = test.err_msg.strip().split('\n')[-1]
+            parts.append('<failure message=%s>%s</failure>\n' %
+                         (_xml_attr(msg), _xml_text(test.err_msg)))
+        elif test.err_msg:
+            parts.append('<system-err>%s</system-err>\n' % _xml_text(test.err_msg))
+
+        parts.append('</testcase>\n')
+
+        return ''.join(parts)
@@ -3,42 +3,166 @@ Methods and class for running tests.
 """
 import sys
 import os
+import gc
+import time
+import signal
+import warnings
+import traceback
+import threading
+import multiprocessing
+from tempfile import mkstemp
 
 from six import advance_iterator
-from multiprocessing import Queue, Process
+from six.moves import queue as _queue
 
-from testflo.cover import save_coverage
+try:
+    from multiprocessing.connection import wait
+except ImportError:  # python 2
+    def wait(object_list, timeout=None):
+        """Return the connections in object_list that are ready to read."""
+        if timeout is not None:
+            end = time.time() + timeout
+        while True:
+            ready = [c for c in object_list if c.poll()]
+            if ready or (timeout is not None and time.time() >= end):
+                return ready
+            time.sleep(0.01)
+
+try:
+    import faulthandler
+except ImportError:
+    faulthandler = None
+
+from testflo.cover import save_coverage, start_coverage, stop_coverage
 from testflo.test import Test
 from testflo.options import get_options
-from testflo.qman import get_client_queue
+from testflo.util import get_memory_usage, remove_module_cache, is_failure, \
+                         set_module_cache_file
+
 
+# number of seconds a test in a worker process is given to stop after
+# its timeout before the worker is killed.
+_timeout_grace = 5.0
 
-def worker(test_queue, done_queue, subproc_queue, worker_id):
-    """This is used by concurrent test processes. It takes a test
-    off of the test_queue, runs it, then puts the Test object
-    on the done_queue.
+
+def worker(conn, subproc_queue, worker_id, stackfile=None, cachefile=None):
+    """This is used by concurrent test processes. It receives a group
+    of tests over conn, runs them, then sends each finished Test object
+    back over conn, along with the worker's memory usage if the parent
+    needs it.  If cachefile is given, it's where the module resolution
+    cache is saved for subprocesses, and the parent removes it.
     """
-    test_count = 0
-    for tests in iter(test_queue.get, 'STOP'):
+    if cachefile:
+        set_module_cache_file(cachefile)
 
-        done_tests = []
+    if stackfile and faulthandler is not None and hasattr(faulthandler, 'register'):
+        # allow the parent to get our stacks before killing us if we hang
+        stackf = open(stackfile, 'w')
+        faulthandler.register(signal.SIGUSR1, file=stackf, all_threads=True)
+
+    report_rss = get_options().max_worker_rss > 0
+
+    test_count = 0
+    for tests in iter(conn.recv, 'STOP'):
         for test in tests:
             try:
                 test_count += 1
-                done_tests.append(test.run(subproc_queue))
+                result = test.run(subproc_queue)
             except:
                 # we generally shouldn't get here, but just in case,
                 # handle it so that the main process doesn't hang at the
                 # end when it tries to join all of the concurrent processes.
-                done_tests.append(test)
+                test.status = 'FAIL'
+                test.err_msg = traceback.format_exc()
+                result = test
+
+            result.worker_id = worker_id
+            conn.send((result, get_memory_usage() if report_rss else 0.))
 
-        done_queue.put(done_tests)
+    # atexit handlers don't run in worker processes
+    remove_module_cache()
 
     # don't save anything unless we actually ran a test
     if test_count > 0:
         save_coverage()
 
 
+def _is_stop_result(result):
+    """Return True if the given result should stop the run when -x is active."""
+    return is_failure(result) or (result.status == 'OK' and result.expected_fail)
+
+
+def _restart_group(tests, idx):
+    """Return the tests following tests[idx] in the given group, with fixture
+    flags set so that any module or TestCase fixtures that were already set up
+    by a killed worker will be set up again.
+    """
+    remaining = tests[idx+1:]
+    if remaining:
+        remaining[0]._mod_fixture_first = tests[0]._mod_fixture_first
+        started = set(t.tcase for t in tests[:idx+1] if t.tcase is not None)
+        for t in remaining:
+            if t.tcase in started:
+                t._tcase_fixture_first = True
+                started.discard(t.tcase)
+    return remaining
+
+
+_SIGKILL = getattr(signal, 'SIGKILL', signal.SIGTERM)
+
+
+def _descendants(pid):
+    """Return the pids of all of the descendants of the given process that
+    we can find.
+    """
+    try:
+        import psutil
+    except ImportError:
+        pass
+    else:
+        try:
+            return [p.pid for p in psutil.Process(pid).children(recursive=True)]
+        except Exception:
+            return []
+
+    # without psutil, we can still find them on linux
+    try:
+        names = os.listdir('/proc')
+    except OSError:
+        return []
+
+    children = {}
+    for name in names:
+        if name.isdigit():
+            try:
+                with open('/proc/%s/stat' % name) as f:
+                    stat = f.read()
+                # the command name in parens may contain spaces
+                ppid = int(stat.rsplit(')', 1)[1].split()[1])
+            except (IOError, OSError, IndexError, ValueError):
+                continue
+            children.setdefault(ppid, []).append(int(name))
+
+    found = []
+    stack = [pid]
+    while stack:
+        for child in children.get(stack.pop(), ()):
+            found.append(child)
+            stack.append(child)
+    return found
+
+
+def _exit_str(exitcode):
+    """Return a description of a process exit code."""
+    if exitcode is not None and exitcode < 0:
+        try:
+            name = signal.Signals(-exitcode).name
+        except (AttributeError, ValueError):
+            name = 'signal %d' % -exitcode
+        return 'killed by %s' % name
+    return 'exit code %s' % exitcode
+
+
 class TestRunner(object):
 
     def __init__(self, options, subproc_queue):
@@ -57,16 +181,216 @@ class TestRunner(object):
                     sys.stdout.flush()
                 result = test.run(self._queue)
                 yield result
-                if self.stop:
-                    if (result.status == 'FAIL' and not result.expected_fail) or (
-                                  result.status == 'OK' and result.expected_fail):
-                          stop = True
-                          break
+                if self.stop and _is_stop_result(result):
+                    stop = True
+                    break
             if stop:
                 break
 
         save_coverage()
 
+    def recycle_workers(self, is_stale):
+        """Replace any worker processes for which is_stale(test_files)
+        returns True, where test_files are the files of the tests the
+        worker has run.
+        """
+        pass
+
+    def close(self, kill=False):
+        """Shut down any worker processes."""
+        pass
+
+
+class ThreadTestRunner(TestRunner):
+    """TestRunner that runs groups of tests concurrently in num_threads
+    threads of this process.  Each thread's output is captured separately
+    and test directories are added to sys.path rather than swapped in for
+    each test, but the tests themselves must be thread safe.
+
+    Tests can't be killed, so timeouts aren't enforced and with -x the tests
+    already running are allowed to finish.
+    """
+
+    def __init__(self, options, subproc_queue):
+        super(ThreadTestRunner, self).__init__(options, subproc_queue)
+        self.num_threads = options.threads
+        self._stopped = False
+
+    def _work(self, todo, done):
+        name = threading.current_thread().name
+        for tests in iter(todo.get, None):
+            for test in tests:
+                if self._stopped:
+                    break
+                try:
+                    result = test.run(self._queue)
+                except:
+                    test.status = 'FAIL'
+                    test.err_msg = traceback.format_exc()
+                    result = test
+                result.worker_id = name
+                done.put(result)
+            done.put(None)  # finished the group
+
+    def get_iter(self, input_iter):
+        """Run tests in threads."""
+        from testflo.test import use_thread_safe_context
+        from testflo.capture import install_thread_streams, uninstall_thread_streams
+
+        use_thread_safe_context()
+        install_thread_streams()
+        self._stopped = False
+
+        todo = _queue.Queue()
+        done = _queue.Queue()
+
+        # coverage traces threads started after it is
+        start_coverage()
+        threads = []
+        for i in range(self.num_threads):
+            t = threading.Thread(target=self._work, args=(todo, done),
+                                 name="%d_t%d" % (os.getpid(), i))
+            t.daemon = True
+            t.start()
+            threads.append(t)
+
+        it = iter(input_iter)
+        pending = 0
+        try:
+            while True:
+                # keep a few groups queued so threads don't wait for discovery
+                while not self._stopped and pending < 2 * self.num_threads:
+                    try:
+                        todo.put(advance_iterator(it))
+                    except StopIteration:
+                        break
+                    pending += 1
+
+                if pending == 0:
+                    break
+
+                result = done.get()
+                if result is None:
+                    pending -= 1
+                    continue
+
+                yield result
+                if self.stop and _is_stop_result(result) and not self._stopped:
+                    self._stopped = True
+                    # drop the groups that haven't been started
+                    try:
+                        while True:
+                            todo.get_nowait()
+                            pending -= 1
+                    except _queue.Empty:
+                        pass
+        finally:
+            self._stopped = True
+            for t in threads:
+                todo.put(None)
+            for t in threads:
+                t.join()
+            stop_coverage()
+            uninstall_thread_streams()
+            save_coverage()
+
+
+class WorkerProc(object):
+    """The parent's handle to a worker process.  It keeps track of the group
+    of tests the worker is running and how many of them have finished.
+    """
+
+    def __init__(self, subproc_queue, worker_id, timeout=-1.0, ctx=multiprocessing):
+        self.worker_id = worker_id
+        self.tests = None
+        self.ndone = 0
+        self.last_time = 0.
+        self.total_done = 0
+        self.rss = 0.
+        self.memory = 0.  # predicted peak memory of the current group
+        self.test_files = set()
+
+        if timeout > 0.:
+            fd, self.stackfile = mkstemp(prefix='testflo_stacks_')
+            os.close(fd)
+        else:
+            self.stackfile = None
+
+        # we pick the worker's module cache file so that we can remove it
+        # even if the worker is killed
+        fd, self.cachefile = mkstemp(prefix='testflo_modcache_', suffix='.pkl')
+        os.close(fd)
+
+        self.conn, child_conn = ctx.Pipe()
+        self.proc = ctx.Process(target=worker,
+                            args=(child_conn, subproc_queue, worker_id,
+                                      self.stackfile, self.cachefile))
+        self.proc.start()
+        child_conn.close()
+
+    def send(self, tests):
+        """Give a group of tests to the worker."""
+        self.tests = list(tests)
+        self.ndone = 0
+        self.last_time = time.time()
+        self.conn.send(self.tests)
+
+    def recv(self):
+        """Return the next finished test from the worker."""
+        result, self.rss = self.conn.recv()
+        self.test_files.add(result.spec.split(':', 1)[0])
+        self.ndone += 1
+        self.total_done += 1
+        self.last_time = time.time()
+        if self.ndone == len(self.tests):
+            self.tests = None
+        return result
+
+    def current_test(self):
+        return self.tests[self.ndone]
+
+    def get_stacks(self):
+        """Return the stacks of all threads in the worker, if possible."""
+        if self.stackfile is None or not hasattr(signal, 'SIGUSR1'):
+            return ''
+        try:
+            os.kill(self.proc.pid, signal.SIGUSR1)
+            time.sleep(0.5)
+            with open(self.stackfile, 'r') as f:
+                return f.read()
+        except Exception:
+            return ''
+
+    def stop(self):
+        self.conn.send('STOP')
+
+    def join(self):
+        self.proc.join()
+        self.cleanup()
+
+    def kill(self):
+        """Kill the worker and any processes it started, e.g., for isolated
+        or MPI tests.
+        """
+        pids = _descendants(self.proc.pid)
+        for pid in pids:
+            try:
+                os.kill(pid, _SIGKILL)
+            except OSError:
+                pass
+        self.proc.terminate()
+        self.proc.join()
+        self.cleanup()
+
+    def cleanup(self):
+        self.conn.close()
+        for fname in (self.stackfile, self.cachefile):
+            if fname is not None:
+                try:
+                    os.remove(fname)
+                except OSError:
+                    pass
+
 
 class ConcurrentTestRunner(TestRunner):
     """TestRunner that uses the multiprocessing package
@@ -76,66 +400,387 @@ class ConcurrentTestRunner(TestRunner):
     def __init__(self, options, subproc_queue):
         super(ConcurrentTestRunner, self).__init__(options, subproc_queue)
         self.num_procs = options.num_procs
+        self.timeout = options.timeout
+        self.max_tests = options.max_tests_per_worker
+        self.max_rss = options.max_worker_rss
+        self.preload_modules = options.preload_modules or []
+        self.preload = options.preload or bool(self.preload_modules)
+
+        # keep the workers running between calls to get_iter
+        self.persistent = options.watch
+
+        if self.preload and self.persistent:
+            # preloading waits for all of discovery, and workers started
+            # later for changed files wouldn't share the preloaded modules
+            warnings.warn("--preload and --preload-module are ignored with --watch.")
+            self.preload = False
+
+        # varies how many of the workers are given tests at once
+        self._monitor = None
+        if options.adaptive and self.num_procs > 1:
+            from testflo.adaptive import LoadMonitor
+            self._monitor = LoadMonitor(self.num_procs)
+
+        # puts each worker in a cgroup with its own limits
+        self._cgroups = None
+        if self.num_procs > 1 and (options.cgroup_memory > 0 or
+                                   options.cgroup_cpus > 0 or options.cgroup_pids > 0):
+            from testflo.limits import CgroupLimits
+            try:
+                self._cgroups = CgroupLimits(options.cgroup_memory, options.cgroup_cpus,
+                                             options.cgroup_pids)
+            except (IOError, OSError) as err:
+                warnings.warn("Can't use cgroup limits: %s" % err)
+
+        # keeps the predicted memory of the running tests within budget
+        self._admission = None
+        if options.memory_aware and self.num_procs > 1:
+            from testflo.memory import MemoryHistory, MemoryAdmission
+            self._admission = MemoryAdmission(MemoryHistory(options.memory_file),
+                                              options.mem_budget,
+                                              max_skips=2 * self.num_procs)
 
         # only do concurrent stuff if num_procs > 1
-        if self.num_procs > 1:
+        self._concurrent = self.num_procs > 1
+        if self._concurrent:
             self.get_iter = self.run_concurrent_tests
 
-            # Create queues
-            self.task_queue = Queue()
-            self.done_queue = Queue()
+            self._subproc_queue = subproc_queue
+            self._worker_count = 0
+            self._retired = []
+            self._ctx = multiprocessing
 
-            self.procs = []
+            if self.preload:
+                # workers are started after all test modules are imported
+                self.workers = []
+            else:
+                self._start_workers()
 
-            # Start worker processes
-            for i in range(self.num_procs):
-                worker_id = "%d_%d" % (os.getpid(), i)
-                self.procs.append(Process(target=worker,
-                                          args=(self.task_queue,
-                                                self.done_queue, subproc_queue,
-                                                worker_id)))
+    def _start_workers(self):
+        self.workers = [self._start_worker() for i in range(self.num_procs)]
 
-            for proc in self.procs:
-                proc.start()
+    def _start_worker(self):
+        worker_id = "%d_%d" % (os.getpid(), self._worker_count)
+        self._worker_count += 1
+        w = WorkerProc(self._subproc_queue, worker_id, self.timeout, self._ctx)
+        if self._cgroups is not None:
+            try:
+                self._cgroups.add(worker_id, w.proc.pid)
+            except (IOError, OSError) as err:
+                warnings.warn("Can't put worker %s in a cgroup: %s" % (worker_id, err))
+        return w
 
-    def run_concurrent_tests(self, input_iter):
-        """Run tests concurrently."""
+    def _preload(self, input_iter):
+        """Finish discovery (which imports all of the test modules), import
+        any requested preload modules, then fork the workers so that they
+        share all of the imported modules with this process via copy-on-write.
+        Returns a list of all of the discovered tests.
+        """
+        tests = list(input_iter)
+
+        for modname in self.preload_modules:
+            try:
+                __import__(modname)
+            except Exception:
+                warnings.warn("Couldn't preload module '%s':\n%s" %
+                              (modname, traceback.format_exc()))
 
-        it = iter(input_iter)
-        numtests = 0
         try:
-            for proc in self.procs:
-                self.task_queue.put(advance_iterator(it))
-                numtests += 1
-        except StopIteration:
+            self._ctx = multiprocessing.get_context('fork')
+        except (AttributeError, ValueError):
+            pass  # python 2 always forks on posix, and windows can't fork
+
+        # keep the garbage collector from touching (and so copying) the
+        # pages holding the imported modules in the workers.  Only the
+        # workers need that, so this process goes back to normal afterwards.
+        if hasattr(gc, 'freeze'):
+            gc.collect()
+            gc.freeze()
+            try:
+                self._start_workers()
+            finally:
+                gc.unfreeze()
+        else:
+            self._start_workers()
+
+        return tests
+
+    def _replace_worker(self, w):
+        """Kill the given worker and replace it with a new one."""
+        w.kill()
+        neww = self._start_worker()
+        self.workers[self.workers.index(w)] = neww
+        return neww
+
+    def _should_retire(self, w):
+        """Return True if the given idle worker has run too many tests or
+        grown too large and should be replaced by a fresh one.
+        """
+        return ((self.max_tests > 0 and w.total_done >= self.max_tests) or
+                (self.max_rss > 0 and w.rss > self.max_rss))
+
+    def _retire(self, w):
+        """Tell the given idle worker to stop, and replace it with a new one.
+        The retired worker is joined once it exits, so that we don't have to
+        wait for it to save its coverage data.
+        """
+        try:
+            w.stop()
+        except (IOError, OSError):
             pass
+        self._retired.append(w)
+        neww = self._start_worker()
+        self.workers[self.workers.index(w)] = neww
+        return neww
+
+    def _reap_retired(self):
+        """Join any retired workers that have exited, so that their pipes
+        and process handles don't pile up over a long run.
+        """
+        if self._retired:
+            alive = []
+            for w in self._retired:
+                if w.proc.is_alive():
+                    alive.append(w)
+                else:
+                    w.join()
+            self._retired = alive
+
+    def _fail_current(self, w, msg):
+        """Mark the current test of the given worker as failed, replace the
+        worker, and give any remaining tests in its group to the replacement.
+        """
+        test = w.current_test()
+        remaining = _restart_group(w.tests, w.ndone)
+        neww = self._replace_worker(w)
+
+        test.status = 'FAIL'
+        test.worker_id = w.worker_id
+        test.start_time = w.last_time
+        test.end_time = time.time()
+        test.err_msg = msg
+
+        if remaining:
+            self._send(neww, remaining, w.memory)
+
+        return test
+
+    def _cancel(self, w):
+        """Kill a busy worker, along with any subprocesses it started.  Yield
+        any results it has already sent, followed by the rest of the tests
+        in its group marked as CANCELLED.
+        """
+        while w.tests is not None and w.conn.poll():
+            try:
+                result = w.recv()
+            except EOFError:
+                break
+            if self._cgroups is not None:
+                self._check_limits(w, result)
+            yield result
+
+        if w.tests is None:
+            # it finished its group while we were looking
+            return
+
+        tests = w.tests[w.ndone:]
+        start = w.last_time
+        if self.persistent:
+            self._replace_worker(w)
         else:
+            w.kill()
+            self.workers.remove(w)
+
+        now = time.time()
+        for test in tests:
+            test.status = 'CANCELLED'
+            test.worker_id = w.worker_id
+            test.start_time = start
+            test.end_time = now
+            start = now  # the rest of the group never started
+            test.err_msg = 'Cancelled after another test failed.\n'
+            yield test
+
+    def _kill_hung(self, w):
+        """Kill a worker whose current test didn't stop after its timeout."""
+        msg = ('TIMEOUT after %s sec. The worker process was killed '
+               'because the test did not stop.\n' % self.timeout)
+        stacks = w.get_stacks()
+        if stacks:
+            msg += 'Thread stacks at timeout:\n%s' % stacks
+        return self._fail_current(w, msg)
+
+    def _crashed(self, w):
+        """Handle a worker that died while running a test."""
+        w.proc.join()
+        exceeded = self._limit_exceeded(w)
+        test = self._fail_current(w, 'The worker process running this test died '
+                                     '(%s).\n' % _exit_str(w.proc.exitcode))
+        if exceeded:
+            test.status = 'LIMIT'
+            test.err_msg = exceeded + test.err_msg
+        return test
+
+    def _limit_exceeded(self, w):
+        """Return a description of any cgroup limits the worker has run into
+        since we last checked, or None.
+        """
+        if self._cgroups is not None:
+            return self._cgroups.exceeded(w.worker_id)
+
+    def _check_limits(self, w, result):
+        """Mark a result from a worker as LIMIT if the worker ran into a
+        cgroup limit while running it.
+        """
+        exceeded = self._limit_exceeded(w)
+        if exceeded and result.status != 'LIMIT':
+            result.status = 'LIMIT'
+            result.err_msg = exceeded + result.err_msg
+        return result
+
+    def _send(self, w, tests, memory=0.):
+        """Send tests to a worker, replacing the worker if it has died."""
+        try:
+            w.send(tests)
+        except (IOError, OSError):
+            w = self._replace_worker(w)
+            w.send(tests)
+        w.memory = memory
+
+    def _next_tests(self, it, busy):
+        """Return the next group of tests to start and its predicted peak
+        memory, or (None, 0.) if none should start yet.
+        """
+        if self._admission is not None:
+            return self._admission.next_group(it, sum(w.memory for w in busy),
+                                              len(busy))
+        try:
+            return advance_iterator(it), 0.
+        except StopIteration:
+            return None, 0.
+
+    def _get_result(self, w):
+        """Return the next finished test from the given busy worker, or None
+        if it doesn't have one yet.  Workers that have died or hung are replaced.
+        """
+        if w.conn.poll():
             try:
-                while numtests:
-                    stop = False
-                    results = self.done_queue.get()
-                    for result in results:
-                        yield result
-                        if self.stop:
-                            if (result.status == 'FAIL' and not result.expected_fail) or (
-                                  result.status == 'OK' and result.expected_fail):
-                                stop = True
-                                break
-                    if stop:
+                result = w.recv()
+            except EOFError:
+                return self._crashed(w)
+            if self._cgroups is not None:
+                self._check_limits(w, result)
+            return result
+        elif not w.proc.is_alive():
+            return self._crashed(w)
+        elif self.timeout > 0. and \
+             time.time() - w.last_time > self.timeout + _timeout_grace:
+            return self._kill_hung(w)
+
+    def _wait_timeout(self, busy):
+        """Return how long to wait for results before checking for hung
+        workers, or None if there's no timeout.
+        """
+        if self.timeout > 0.:
+            now = time.time()
+            limit = self.timeout + _timeout_grace
+            return max(0., min(w.last_time + limit - now for w in busy))
+        return None
+
+    def run_concurrent_tests(self, input_iter):
+        """Run tests concurrently."""
+
+        if self.preload and not self.workers:
+            input_iter = self._preload(input_iter)
+
+        it = iter(input_iter)
+        stop = False
+
+        while True:
+            self._reap_retired()
+
+            # give more work to idle workers, including any that replaced
+            # workers that died.
+            if not stop:
+                busy = [w for w in self.workers if w.tests is not None]
+                if self._monitor is None:
+                    limit = len(self.workers)
+                else:
+                    limit = self._monitor.limit(len(busy))
+                for w in self.workers:
+                    if len(busy) >= limit:
                         break
-                    numtests -= 1
-                    self.task_queue.put(advance_iterator(it))
-                    numtests += 1
-            except StopIteration:
-                pass
+                    if w.tests is None:
+                        tests, memory = self._next_tests(it, busy)
+                        if tests is None:
+                            break
+                        if self._should_retire(w):
+                            w = self._retire(w)
+                        self._send(w, tests, memory)
+                        busy.append(w)
 
-        for proc in self.procs:
-            self.task_queue.put('STOP')
+            busy = [w for w in self.workers if w.tests is not None]
+            if not busy:
+                break
 
-        for i in range(numtests):
-            results = self.done_queue.get()
-            for result in results:
-                yield result
+            # a worker's sentinel becomes ready if the worker dies
+            waitlist = [w.conn for w in busy]
+            waitlist.extend(w.proc.sentinel for w in busy
+                            if hasattr(w.proc, 'sentinel'))
+            wait(waitlist, self._wait_timeout(busy))
+
+            for w in busy:
+                result = self._get_result(w)
+                if result is not None:
+                    yield result
+                    if self.stop and _is_stop_result(result):
+                        stop = True
+
+            if stop:
+                # don't wait for any tests that are still running
+                for w in [w for w in self.workers if w.tests is not None]:
+                    for result in self._cancel(w):
+                        yield result
+                break
+
+        if self.persistent:
+            for w in self._retired:
+                w.join()
+            self._retired = []
+        else:
+            self.close()
+
+    def recycle_workers(self, is_stale):
+        """Replace any worker processes for which is_stale(test_files)
+        returns True, where test_files are the files of the tests the
+        worker has run.
+        """
+        if self._concurrent:
+            for w in list(self.workers):
+                if w.tests is None and is_stale(w.test_files):
+                    self._retire(w)
+
+    def close(self, kill=False):
+        """Shut down the worker processes, killing them if kill is True
+        rather than waiting for their current tests to finish.
+        """
+        if self._concurrent:
+            if kill:
+                for w in self.workers + self._retired:
+                    w.kill()
+            else:
+                for w in self.workers:
+                    try:
+                        w.stop()
+                    except (IOError, OSError):
+                        pass
+
+                for w in self.workers + self._retired:
+                    w.join()
+
+            self.workers = []
+            self._retired = []
 
-        for proc in self.procs:
-            proc.join()
+            if self._cgroups is not None:
+                self._cgroups.close()
+                self._cgroups = None
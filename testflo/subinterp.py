@@ -0,0 +1,201 @@
+"""
+Support for --isolated=subinterp, which runs each test in a new
+subinterpreter of the current process instead of a new python process.
+Subinterpreters have their own copies of all modules, so tests can't see
+each other's module state, but they start much faster than processes and
+(on python 3.12 and later, where each one has its own GIL) tests in
+different threads run truly in parallel.
+
+Tests whose modules can't be imported into a subinterpreter, typically
+because they use extension modules that don't support them, are rerun in
+a subprocess.  This is experimental.
+"""
+
+import os
+import re
+import sys
+import pickle
+import threading
+import traceback
+
+
+# run in the new subinterpreter, with _spec, _path, _args, _run_fixtures and
+# _fd set in __main__.  It pickles the finished Test object and writes it to
+# the pipe _fd.
+_script = """
+import os
+import sys
+import pickle
+import traceback
+
+sys.path[:] = _path.split('\\0')
+sys.argv[:] = ['testflo'] + [a for a in _args.split('\\0') if a]
+
+from testflo.options import get_options
+from testflo.cover import setup_coverage, save_coverage
+from testflo.test import Test
+
+setup_coverage(get_options())
+
+test = None
+try:
+    test = Test(_spec)
+    if _run_fixtures:
+        test._mod_fixture_first = test._mod_fixture_last = True
+        test._tcase_fixture_first = test._tcase_fixture_last = True
+    test.run()
+    save_coverage()
+except:
+    if test is None:
+        test = Test(_spec, 'FAIL', traceback.format_exc())
+    else:
+        test.status = 'FAIL'
+        test.err_msg = traceback.format_exc()
+
+data = pickle.dumps(test, pickle.HIGHEST_PROTOCOL)
+while data:
+    data = data[os.write(_fd, data):]
+"""
+
+# errors raised when importing extension modules that don't support
+# subinterpreters (CPython's own message, and those from NumPy and PyO3)
+_unsafe_rgx = re.compile(r'(Import|Runtime)Error: .*(sub-?interpreter|more than once per process)',
+                         re.IGNORECASE)
+
+
+def _get_api():
+    """Return a function that runs a script in a new subinterpreter with the
+    given dict of shareable objects in its __main__, or None if this version
+    of python doesn't have subinterpreters.
+    """
+    try:
+        from concurrent import interpreters  # python 3.14+
+    except ImportError:
+        pass
+    else:
+        def run(script, shared):
+            interp = interpreters.create()
+            try:
+                interp.prepare_main(shared)
+                interp.exec(script)
+            finally:
+                interp.close()
+        return run
+
+    # the low level modules (_interpreters in 3.13, _xxsubinterpreters
+    # before that) report failures differently, but since our script
+    # catches its own errors, we only care whether it sent back a result.
+    for modname in ('_interpreters', '_xxsubinterpreters'):
+        try:
+            mod = __import__(modname)
+        except ImportError:
+            continue
+
+        def run(script, shared, mod=mod):
+            interp = mod.create()
+            try:
+                mod.run_string(interp, script, shared)
+            finally:
+                mod.destroy(interp)
+        return run
+
+    return None
+
+
+_run = _get_api()
+
+# test files whose tests have had to run in a subprocess
+_unsafe_files = set()
+_unsafe_lock = threading.Lock()
+
+_fallback_manager = None
+_fallback_queue = None
+
+
+def available():
+    """Return True if subinterpreters are available."""
+    return _run is not None
+
+
+def _read_all(fd, chunks):
+    while True:
+        data = os.read(fd, 65536)
+        if not data:
+            break
+        chunks.append(data)
+
+
+def _get_fallback_queue():
+    """Return a queue for subprocess results, starting a SyncManager the first
+    time it's needed.  The manager isn't forked, since other threads may be
+    running tests in subinterpreters.
+    """
+    global _fallback_manager, _fallback_queue
+    with _unsafe_lock:
+        if _fallback_queue is None:
+            import multiprocessing
+            from testflo.qman import get_server_queue
+            _fallback_manager, _fallback_queue = \
+                get_server_queue(multiprocessing.get_context('spawn'))
+    return _fallback_queue
+
+
+def _fallback(test, queue):
+    with _unsafe_lock:
+        _unsafe_files.add(test.spec.split(':', 1)[0])
+    if queue is None:
+        queue = _get_fallback_queue()
+    return test._run_isolated(queue)
+
+
+def run_test(test, queue=None):
+    """Run the given test in a new subinterpreter and return the finished
+    Test object.  If the test can't run in a subinterpreter, it's run with
+    _run_isolated instead, using queue if it isn't None.
+    """
+    from testflo.util import _get_testflo_subproc_args, save_module_cache
+
+    if test.spec.split(':', 1)[0] in _unsafe_files:
+        return _fallback(test, queue)
+
+    # let the subinterpreter reuse what we know about where modules are
+    save_module_cache()
+
+    rfd, wfd = os.pipe()
+    chunks = []
+    reader = threading.Thread(target=_read_all, args=(rfd, chunks))
+    reader.daemon = True
+    reader.start()
+
+    shared = {
+        '_spec': test.spec,
+        '_path': '\0'.join(sys.path),
+        '_args': '\0'.join(_get_testflo_subproc_args()),
+        '_run_fixtures': 1 if test.run_fixtures else 0,
+        '_fd': wfd,
+    }
+    err = ''
+    try:
+        try:
+            _run(_script, shared)
+        except Exception:
+            err = traceback.format_exc()
+    finally:
+        os.close(wfd)
+        reader.join()
+        os.close(rfd)
+
+    try:
+        result = pickle.loads(b''.join(chunks))
+    except Exception:
+        # the subinterpreter couldn't even run our script
+        return _fallback(test, queue)
+
+    if result.status == 'FAIL' and _unsafe_rgx.search(result.err_msg):
+        return _fallback(test, queue)
+
+    if err:
+        result.err_msg += err
+
+    result.isolated = 'subinterp'
+    return result
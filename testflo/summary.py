@@ -1,9 +1,58 @@
 
 import sys
 import time
+import heapq
+from tempfile import TemporaryFile
 
 from testflo.util import elapsed_str
 
+
+class SpillList(object):
+    """A list of test names that keeps its memory use bounded by writing its
+    contents out to a sorted temporary file whenever it holds more than
+    max_items names.  Iterating over it yields all of the names in sorted
+    order by merging the sorted files.
+    """
+
+    def __init__(self, max_items=50000):
+        self.max_items = max_items
+        self._items = []
+        self._files = []
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def append(self, item):
+        self._items.append(item)
+        self._count += 1
+        if len(self._items) >= self.max_items:
+            self._spill()
+
+    def _spill(self):
+        f = TemporaryFile('w+')
+        for item in sorted(self._items):
+            f.write(item)
+            f.write('\n')
+        self._files.append(f)
+        self._items = []
+
+    def _file_iter(self, f):
+        f.seek(0)
+        for line in f:
+            yield line[:-1]
+
+    def __iter__(self):
+        iters = [self._file_iter(f) for f in self._files]
+        iters.append(iter(sorted(self._items)))
+        return heapq.merge(*iters)
+
+    def close(self):
+        for f in self._files:
+            f.close()
+        self._files = []
+        self._items = []
+
 class ResultSummary(object):
     """Writes a test summary after all tests are run."""
 
@@ -11,6 +60,15 @@ class ResultSummary(object):
         self.stream = stream
         self.options = options
         self._start_time = time.time()
+        self._streams = [stream]
+
+    def add_stream(self, stream):
+        """Also write the summary to the given stream."""
+        self._streams.append(stream)
+
+    def _write(self, s):
+        for stream in self._streams:
+            stream.write(s)
 
     def get_test_name(self, test):
         if self.options.full_path:
@@ -21,11 +79,14 @@ class ResultSummary(object):
     def get_iter(self, input_iter):
         oks = 0
         total = 0
-        fails = []
-        skips = []
+        fails = SpillList()
+        skips = SpillList()
+        flakes = SpillList()
+        cancelled = 0
+        limits = SpillList()
         test_sum_time = 0.
 
-        write = self.stream.write
+        write = self._write
 
         for test in input_iter:
             total += 1
@@ -44,32 +105,73 @@ class ResultSummary(object):
                 test_sum_time += (test.end_time-test.start_time)
             elif test.status == 'SKIP':
                 skips.append(self.get_test_name(test))
+            elif test.status == 'CANCELLED':
+                cancelled += 1
+            elif test.status == 'LIMIT':
+                limits.append(self.get_test_name(test))
+                test_sum_time += (test.end_time-test.start_time)
+            elif test.status == 'FLAKY':
+                oks += 1
+                flakes.append(self.get_test_name(test))
+                test_sum_time += (test.end_time-test.start_time)
 
             yield test
 
         # now summarize the run
         if skips and self.options.verbose:  # only list skips in verbose mode
             write("\n\nThe following tests were skipped:\n")
-            for s in sorted(skips):
+            for s in skips:
                 write(s)
                 write('\n')
 
+        if limits:
+            write("\n\nThe following tests exceeded resource limits:\n")
+            for f in limits:
+                write(f)
+                write('\n')
+
         if fails:
             write("\n\nThe following tests failed:\n")
-            for f in sorted(fails):
+            for f in fails:
                 write(f)
                 write('\n')
-        else:
+        elif not limits:
             write("\n\nOK")
 
+        if cancelled:
+            s = "" if cancelled == 1 else "s"
+            write("\n\n%d test%s cancelled when the run stopped after a failure (-x).\n" %
+                  (cancelled, s))
+
+        if flakes:
+            write("\n\nThe following tests were flaky (they failed, then passed when rerun):\n")
+            for f in flakes:
+                write(f)
+                write('\n')
+
         write("\n\nPassed:  %d\nFailed:  %d\nSkipped: %d\n" %
                             (oks, len(fails), len(skips)))
+        if flakes:
+            write("Flaky:   %d\n" % len(flakes))
+        if cancelled:
+            write("Cancelled: %d\n" % cancelled)
+        if limits:
+            write("Limit:   %d\n" % len(limits))
+
+        fails.close()
+        skips.close()
+        flakes.close()
+        limits.close()
 
         wallclock = time.time() - self._start_time
 
         s = "" if total == 1 else "s"
-        if self.options.isolated:
+        if self.options.isolated == 'subinterp':
+            procstr = " in isolated subinterpreters"
+        elif self.options.isolated:
             procstr = " in isolated processes"
+        elif self.options.threads > 0:
+            procstr = " using %d threads" % self.options.threads
         else:
             procstr = " using %d processes" % self.options.num_procs
         write("\n\nRan %d test%s%s\nWall clock time:   %s\n\n" %
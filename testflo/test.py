@@ -3,6 +3,7 @@ from __future__ import print_function
 import os
 import sys
 import time
+import signal
 import traceback
 from inspect import isclass
 from subprocess import Popen, PIPE
@@ -21,33 +22,62 @@ else:
 from testflo.cover import start_coverage, stop_coverage
 
 from testflo.util import get_module, ismethod, get_memory_usage, \
-                         _get_testflo_subproc_args
+                         _get_testflo_subproc_args, module_available, \
+                         find_executable, save_module_cache, reset_peak_memory, \
+                         get_peak_memory, _path_lock
 from testflo.devnull import DevNull
 from testflo.options import get_options
 
-try:
-    from mpi4py import MPI
-except ImportError:
-    MPI = None
+# mpi4py and other optional or expensive modules are imported only when they
+# are actually needed, to keep startup of testflo and its subprocesses fast.
+_MPI = None
+
+def get_mpi():
+    """Return the mpi4py MPI module, or None if mpi4py isn't available."""
+    global _MPI
+    if _MPI is None:
+        try:
+            from mpi4py import MPI
+        except ImportError:
+            MPI = False
+        _MPI = MPI
+    return _MPI or None
 
-options = get_options()
 
+def mpi_available():
+    """Return True if mpi4py can be imported (without importing it)."""
+    if _MPI is None:
+        return module_available('mpi4py')
+    return _MPI is not False
+
+
+options = get_options()
 
-from distutils import spawn
-mpirun_exe = None
-if spawn.find_executable("mpirun") is not None:
-    mpirun_exe = "mpirun"
-elif spawn.find_executable("mpiexec") is not None:
-    mpirun_exe = "mpiexec"
 
+_mpirun_exe = None
 
-def add_queue_to_env(queue):
-    """Store enough info in the env to be able to create a proxy to
-    the queue in a subprocess.
+def get_mpirun_exe():
+    """Return the name of the mpirun or mpiexec executable, or None if neither
+    is found in the system path.
     """
+    global _mpirun_exe
+    if _mpirun_exe is None:
+        _mpirun_exe = False
+        for exe in ("mpirun", "mpiexec"):
+            if find_executable(exe) is not None:
+                _mpirun_exe = exe
+                break
+    return _mpirun_exe or None
+
+
+def add_queue_to_env(queue, env=None):
+    """Store enough info in the env (os.environ by default) to be able to
+    create a proxy to the queue in a subprocess.
+    """
+    if env is None:
+        env = os.environ
     addr = queue._token.address
-    os.environ['TESTFLO_QUEUE'] = "%s:%s:%s" % (addr[0], addr[1],
-                                                queue._token.id)
+    env['TESTFLO_QUEUE'] = "%s:%s:%s" % (addr[0], addr[1], queue._token.id)
 
 
 class FakeComm(object):
@@ -61,10 +91,27 @@ class FakeComm(object):
 # than constantly copying the whole sys.path
 _testing_path = ['.'] + sys.path
 
+# the most of a passing test's output that's kept when --max-err-size isn't given
+_max_ok_err_size = 100000
+
+
+# when tests run in threads, sys.path and the standard streams are shared,
+# so they can't be swapped for each test
+_thread_safe = False
+
+
+def use_thread_safe_context():
+    """Run tests in a way that's safe when they're run in multiple threads."""
+    global _thread_safe
+    _thread_safe = True
+
 
 class TestContext(object):
     """Supports using the 'with' statement in place of try-finally to
     set sys.path for a test.
+
+    In thread safe mode, the test's dir is just added to the front of
+    sys.path, where it stays, since other threads are using sys.path.
     """
 
     def __init__(self, test):
@@ -73,11 +120,79 @@ class TestContext(object):
 
     def __enter__(self):
         global _testing_path
+        if _thread_safe:
+            test_dir = self.test.test_dir
+            if test_dir not in sys.path:
+                with _path_lock:
+                    if test_dir not in sys.path:
+                        sys.path.insert(0, test_dir)
+            return
         _testing_path[0] = self.test.test_dir
         sys.path = _testing_path
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        sys.path = self.old_sys_path
+        if not _thread_safe:
+            sys.path = self.old_sys_path
+
+
+def _redirect_streams(out, err):
+    """Send stdout and stderr to the given streams, and return a function
+    that restores them.  In thread safe mode this only affects the current
+    thread.
+    """
+    if _thread_safe:
+        from testflo.capture import set_thread_streams
+        old = set_thread_streams(out, err)
+        if old is not None:
+            return lambda: set_thread_streams(*old)
+
+    old_out, old_err = sys.stdout, sys.stderr
+    sys.stdout = out
+    sys.stderr = err
+
+    def restore():
+        sys.stdout = old_out
+        sys.stderr = old_err
+
+    return restore
+
+
+class TestTimeoutError(Exception):
+    """Raised in the main thread when an in-process test times out."""
+    pass
+
+
+class TimeoutAlarm(object):
+    """Uses SIGALRM to raise a TestTimeoutError in the main thread if a
+    test runs longer than timeout seconds.  This does nothing on platforms
+    without SIGALRM or when not called from the main thread.
+    """
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self.fired = False
+        self.stacks = ''
+        self._old_handler = None
+
+    def start(self):
+        try:
+            self._old_handler = signal.signal(signal.SIGALRM, self._handler)
+        except (AttributeError, ValueError):
+            # no SIGALRM (windows) or we're not in the main thread
+            return
+        signal.setitimer(signal.ITIMER_REAL, self.timeout)
+
+    def stop(self):
+        if self._old_handler is not None:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, self._old_handler)
+            self._old_handler = None
+
+    def _handler(self, signum, frame):
+        from testflo.watchdog import format_stacks
+        self.fired = True
+        self.stacks = format_stacks()
+        raise TestTimeoutError("TIMEOUT after %s sec." % self.timeout)
 
 
 class Test(object):
@@ -91,6 +206,7 @@ class Test(object):
         self.status = status
         self.err_msg = err_msg
         self.memory_usage = 0
+        self.peak_memory = 0.  # MB above the process's usage when the test started
         self.nprocs = 0
         self.start_time = 0
         self.end_time = 0
@@ -101,6 +217,13 @@ class Test(object):
         self.isolated = options.isolated
         self.mpi = not options.nompi
         self.timeout = options.timeout
+        self.profile = options.profile
+        self.profile_stats = None
+        self.watchdog = options.watchdog
+        self.stack_samples = None
+        self.pid = 0
+        self.worker_id = None
+        self.run_fixtures = False  # run all fixtures when isolated
         self.expected_fail = False
         self.test_dir = os.path.dirname(testspec.split(':',1)[0])
         self._mod_fixture_first = False
@@ -160,7 +283,11 @@ class Test(object):
         Run a command in a subprocess.
         """
         try:
-            add_queue_to_env(queue)
+            save_module_cache()
+            # use a copy of the env so tests running in other threads
+            # can't change it under us
+            env = os.environ.copy()
+            add_queue_to_env(queue, env)
 
             if self.nocapture:
                 out = sys.stdout
@@ -170,7 +297,7 @@ class Test(object):
             errfd, tmperr = mkstemp()
             err = os.fdopen(errfd, 'w')
 
-            p = Popen(cmd, stdout=out, stderr=err, env=os.environ,
+            p = Popen(cmd, stdout=out, stderr=err, env=env,
                       universal_newlines=True)  # text mode
             count = 0
             timedout = False
@@ -193,7 +320,14 @@ class Test(object):
                 errmsg = f.read()
             os.remove(tmperr)
 
-            os.environ['TESTFLO_QUEUE'] = ''
+            if options.max_err_size > 0 and len(errmsg) > options.max_err_size:
+                from testflo.capture import CaptureStream
+                # the subprocess may have spilled the test's own output
+                # already, so use a different file
+                capture = CaptureStream(options.max_err_size, options.err_dir,
+                                        self.spec, suffix='.stderr.err')
+                capture.write(errmsg)
+                errmsg = capture.getvalue()
 
             if timedout:
                 result = self
@@ -229,7 +363,9 @@ class Test(object):
 
         cmd = [sys.executable,
                os.path.join(os.path.dirname(__file__), 'isolatedrun.py'),
-               self.spec]
+               self.spec] + _get_testflo_subproc_args()
+        if self.run_fixtures:
+            cmd.append('--run-fixtures')
 
         try:
             result = self._run_sub(cmd, queue)
@@ -241,7 +377,7 @@ class Test(object):
             self.err_msg = traceback.format_exc()
             result = self
 
-        result.isolated = True
+        result.isolated = 'subprocess'
 
         return result
 
@@ -251,6 +387,7 @@ class Test(object):
         """
 
         try:
+            mpirun_exe = get_mpirun_exe()
             if mpirun_exe is None:
                 raise Exception("mpirun or mpiexec was not found in the system path.")
 
@@ -277,11 +414,13 @@ class Test(object):
             # premature failure occurred (or dry run), just return
             return self
 
-        if queue is not None:
-            if MPI is not None and self.mpi and self.nprocs > 0:
-                return self._run_mpi(queue)
-            elif self.isolated:
-                return self._run_isolated(queue)
+        if queue is not None and self.mpi and self.nprocs > 0 and mpi_available():
+            return self._run_mpi(queue)
+        elif self.isolated == 'subinterp':
+            from testflo.subinterp import run_test
+            return run_test(self, queue)
+        elif queue is not None and self.isolated:
+            return self._run_isolated(queue)
 
         with TestContext(self):
             if self.tcase is None:
@@ -306,7 +445,8 @@ class Test(object):
                 # if we get here an nprocs > 0, we need
                 # to set .comm in our TestCase instance.
                 if nprocs > 0:
-                    if MPI is not None and self.mpi:
+                    MPI = get_mpi() if self.mpi else None
+                    if MPI is not None:
                         parent.comm = MPI.COMM_WORLD
                     else:
                         parent.comm = FakeComm()
@@ -321,78 +461,167 @@ class Test(object):
                 outstream = sys.stdout
             else:
                 outstream = DevNull()
-            errstream = cStringIO()
+
+            if options.max_err_size > 0:
+                from testflo.capture import CaptureStream
+                errstream = CaptureStream(options.max_err_size, options.err_dir,
+                                          self.spec)
+            else:
+                errstream = cStringIO()
 
             done = False
             expected = expected2 = expected3 = False
 
-            try:
-                old_err = sys.stderr
-                old_out = sys.stdout
-                sys.stdout = outstream
-                sys.stderr = errstream
-
-                start_coverage()
-
-                self.start_time = time.time()
+            if self.watchdog > 0.:
+                from testflo.watchdog import StackWatchdog
+                watchdog = StackWatchdog(self.spec, self.watchdog,
+                                         options.watchdog_interval,
+                                         sample=bool(options.stack_samples))
+                watchdog.start()
+            else:
+                watchdog = None
 
-                # if there's a module setup, run it
-                if mod_setup:
-                    status, expected = _try_call(mod_setup)
-                    if status != 'OK':
-                        done = True
-                        mod_teardown = None # don't do teardown if setup failed
-
-                # handle @unittest.skip class decorator
-                if not done and hasattr(parent, '__unittest_skip__') and parent.__unittest_skip__:
-                    sys.stderr.write("%s\n" % parent.__unittest_skip_why__)
-                    status = 'SKIP'
-                    done = True
-                    tcase_setup = None
-                    tcase_teardown = None
-
-                if tcase_setup:
-                    status, expected = _try_call(tcase_setup)
-                    if status != 'OK':
-                        done = True
-                        tcase_teardown = None
+            if self.timeout > 0.:
+                alarm = TimeoutAlarm(self.timeout)
+            else:
+                alarm = None
 
-                # if there's a setUp method, run it
-                if not done and setup:
-                    status, expected = _try_call(setup)
-                    if status != 'OK':
-                        done = True
+            limits = None
 
-                if not done:
-                    status, expected2 = _try_call(getattr(parent, funcname))
+            try:
+                restore_streams = _redirect_streams(outstream, errstream)
 
-                if not done and teardown:
-                    tdstatus, expected3 = _try_call(teardown)
-                    if status == 'OK':
-                        status = tdstatus
+                # in thread safe mode, coverage is started for all threads
+                # by the runner
+                if not _thread_safe:
+                    start_coverage()
 
-                if tcase_teardown:
-                    _try_call(tcase_teardown)
+                # the process peak can't be attributed to a test in thread mode
+                if options.memory_aware and not _thread_safe:
+                    start_memory = reset_peak_memory()
+                else:
+                    start_memory = None
+
+                # rlimits apply to the whole process, so they can't be used
+                # for tests running in threads
+                if not _thread_safe and (options.limit_memory > 0 or
+                                         options.limit_cpu > 0 or
+                                         options.limit_files > 0):
+                    from testflo.limits import ResourceLimits
+                    limits = ResourceLimits(options.limit_memory, options.limit_cpu,
+                                            options.limit_files)
+                    limits.start()
+
+                try:
+                    if alarm is not None:
+                        alarm.start()
+
+                    self.start_time = time.time()
+                    self.pid = os.getpid()
+
+                    # if there's a module setup, run it
+                    if mod_setup:
+                        status, expected = _try_call(mod_setup)
+                        if status != 'OK':
+                            done = True
+                            mod_teardown = None # don't do teardown if setup failed
+
+                    # handle @unittest.skip class decorator
+                    if not done and hasattr(parent, '__unittest_skip__') and parent.__unittest_skip__:
+                        sys.stderr.write("%s\n" % parent.__unittest_skip_why__)
+                        status = 'SKIP'
+                        done = True
+                        tcase_setup = None
+                        tcase_teardown = None
 
-                if mod_teardown:
-                    _try_call(mod_teardown)
+                    if tcase_setup:
+                        status, expected = _try_call(tcase_setup)
+                        if status != 'OK':
+                            done = True
+                            tcase_teardown = None
+
+                    # if there's a setUp method, run it
+                    if not done and setup:
+                        status, expected = _try_call(setup)
+                        if status != 'OK':
+                            done = True
+
+                    if not done:
+                        if self.profile:
+                            from testflo.profiler import profile_call
+                            (status, expected2), self.profile_stats = \
+                                profile_call(_try_call, getattr(parent, funcname))
+                        else:
+                            status, expected2 = _try_call(getattr(parent, funcname))
+
+                    if not done and teardown:
+                        tdstatus, expected3 = _try_call(teardown)
+                        if status == 'OK':
+                            status = tdstatus
+
+                    if tcase_teardown:
+                        _try_call(tcase_teardown)
+
+                    if mod_teardown:
+                        _try_call(mod_teardown)
+                except Exception:
+                    # a timeout or CPU time limit can also fire between the
+                    # calls above rather than inside one of them
+                    if not ((alarm is not None and alarm.fired) or
+                            (limits is not None and limits.exceeded)):
+                        raise
+                    status = 'FAIL'
+                finally:
+                    # disarm the signals before the bookkeeping below, so
+                    # they can't interrupt it
+                    if alarm is not None:
+                        alarm.stop()
+                    if limits is not None:
+                        limits.disarm()
 
                 self.end_time = time.time()
                 self.status = status
                 self.err_msg = errstream.getvalue()
                 self.memory_usage = get_memory_usage()
+                if start_memory is not None:
+                    self.peak_memory = max(0., get_peak_memory() - start_memory)
                 self.expected_fail = expected or expected2 or expected3
 
+                # nobody needs all of a passing test's output, so keep very
+                # large results from piling up on their way to the printers
+                if (status == 'OK' and not self.expected_fail and
+                        options.max_err_size <= 0 and len(self.err_msg) > _max_ok_err_size):
+                    from testflo.capture import CaptureStream
+                    errstream = CaptureStream(_max_ok_err_size, options.err_dir, self.spec)
+                    errstream.write(self.err_msg)
+                    self.err_msg = errstream.getvalue()
+
                 if sys.platform == 'win32':
                     self.load1m, self.load5m, self.load15m = (0.0, 0.0, 0.0)
                 else:
                     self.load1m, self.load5m, self.load15m = os.getloadavg()
 
             finally:
-                stop_coverage()
-
-                sys.stderr = old_err
-                sys.stdout = old_out
+                if alarm is not None:
+                    alarm.stop()
+                    if alarm.fired:
+                        self.status = 'FAIL'
+                        self.err_msg = 'TIMEOUT after %s sec. %s\nThread stacks at timeout:\n%s' % (
+                                            self.timeout, self.err_msg, alarm.stacks)
+
+                if limits is not None:
+                    limits.stop(self)
+
+                if not _thread_safe:
+                    stop_coverage()
+
+                restore_streams()
+
+                if watchdog is not None:
+                    watchdog.stop()
+                    if watchdog.dumps:
+                        self.err_msg += ''.join(watchdog.dumps)
+                    self.stack_samples = watchdog.samples
 
         return self
 
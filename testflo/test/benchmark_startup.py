@@ -0,0 +1,22 @@
+"""
+Benchmarks for the startup time of testflo and of the subprocesses it runs
+isolated and MPI tests in.  Run using 'testflo -b'.
+"""
+import os
+import sys
+import subprocess
+
+
+def _run_import(stmt):
+    env = os.environ.copy()
+    pkgdir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    env['PYTHONPATH'] = os.pathsep.join([pkgdir, env.get('PYTHONPATH', '')])
+    subprocess.check_call([sys.executable, '-c', stmt], env=env)
+
+
+def benchmark_import_main():
+    _run_import("import testflo.main")
+
+
+def benchmark_import_subprocess():
+    _run_import("import testflo.test, testflo.cover, testflo.qman")
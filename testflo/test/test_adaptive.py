@@ -0,0 +1,93 @@
+import unittest
+
+from testflo import adaptive
+from testflo.adaptive import LoadMonitor
+
+
+class _Monitor(LoadMonitor):
+    """A LoadMonitor that sees the load average and stall times we give it
+    rather than the system's.
+    """
+
+    def __init__(self, max_active, load=0., **kwargs):
+        self.load = load
+        self.stalls = (None, None)
+        super(_Monitor, self).__init__(max_active, interval=1.0, **kwargs)
+
+    def _stalls(self):
+        return self.stalls
+
+    def _loadavg(self):
+        return (self.load, self.load, self.load)
+
+    def _target(self, nbusy):
+        getloadavg = getattr(adaptive.os, 'getloadavg', None)
+        adaptive.os.getloadavg = self._loadavg
+        try:
+            return super(_Monitor, self)._target(nbusy)
+        finally:
+            if getloadavg is None:
+                del adaptive.os.getloadavg
+            else:
+                adaptive.os.getloadavg = getloadavg
+
+    def step(self, nbusy, load=None, stalls=None):
+        """Return the limit after another interval has passed."""
+        if load is not None:
+            self.load = load
+        if stalls is not None:
+            self.stalls = stalls
+        self._last_time -= self.interval
+        return self.limit(nbusy)
+
+
+class LoadMonitorTestCase(unittest.TestCase):
+    def test_start(self):
+        self.assertEqual(_Monitor(8).active, 8)
+        self.assertEqual(_Monitor(8, load=3.).active, 5)
+        self.assertEqual(_Monitor(8, load=20.).active, 1)
+
+    def test_only_samples_every_interval(self):
+        mon = _Monitor(8)
+        mon.load = 20.
+        self.assertEqual(mon.limit(0), 8)
+        self.assertEqual(mon.step(0), 7)
+
+    def test_moves_one_step_at_a_time(self):
+        mon = _Monitor(8)
+        self.assertEqual([mon.step(0, load=5.) for i in range(6)], [7, 6, 5, 4, 3, 3])
+        self.assertEqual([mon.step(0, load=0.) for i in range(6)], [4, 5, 6, 7, 8, 8])
+
+    def test_own_load_ignored(self):
+        # our own running tests don't count against us
+        mon = _Monitor(8)
+        self.assertEqual([mon.step(6, load=6.5) for i in range(3)], [8, 8, 8])
+        self.assertEqual(mon.step(2, load=6.5), 7)
+
+    def test_never_below_one(self):
+        mon = _Monitor(2)
+        self.assertEqual([mon.step(0, load=50.) for i in range(3)], [1, 1, 1])
+
+    def test_pressure(self):
+        mon = _Monitor(4)
+        mon.stalls = (0, 0)
+        mon._last_stalls = mon.stalls
+
+        # stalled on the cpu for half of each second
+        self.assertEqual(mon.step(0, stalls=(500000, 0)), 3)
+        self.assertEqual(mon.step(0, stalls=(1000000, 0)), 2)
+        # a little cpu pressure is fine, but not memory pressure
+        self.assertEqual(mon.step(0, stalls=(1100000, 0)), 3)
+        self.assertEqual(mon.step(0, stalls=(1200000, 200000)), 2)
+        self.assertEqual(mon.step(0, stalls=(1200000, 200000)), 3)
+
+    def test_no_pressure_info(self):
+        mon = _Monitor(4)
+        self.assertEqual(mon._pressure(None, 10, 1.), 0.)
+        self.assertEqual(mon._pressure(10, None, 1.), 0.)
+        self.assertEqual(mon._pressure(10, 0, 0.), 0.)
+        self.assertEqual(mon._pressure(1500000, 500000, 2.), .5)
+
+
+if __name__ == '__main__':
+    unittest.main()
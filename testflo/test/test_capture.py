@@ -0,0 +1,136 @@
+import os
+import shutil
+import tempfile
+
+import unittest
+
+from testflo.options import get_options
+
+# testflo.test reads the options when it's imported, so make sure they
+# don't come from the command line of whatever is running these tests
+get_options([])
+
+from testflo.test import Test as _Test
+from testflo.capture import CaptureStream, ErrDeduplicator, _spill_name
+
+
+class CaptureStreamTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_small(self):
+        stream = CaptureStream(100)
+        stream.write('hello ')
+        stream.writelines(['there', '\n'])
+        self.assertEqual(stream.getvalue(), 'hello there\n')
+        self.assertIsNone(stream.spill_path)
+
+    def test_exact_size(self):
+        stream = CaptureStream(10)
+        stream.write('0123456789')
+        self.assertEqual(stream.getvalue(), '0123456789')
+
+    def _check_truncated(self, chunks, max_size):
+        full = ''.join(chunks)
+        stream = CaptureStream(max_size)
+        for chunk in chunks:
+            stream.write(chunk)
+
+        value = stream.getvalue()
+        head, note, tail = value.split('\n', 2)
+        self.assertEqual(head, full[:max_size // 2])
+        self.assertEqual(tail, full[-(max_size // 2):])
+        kept = 2 * (max_size // 2)
+        self.assertIn('%d of %d characters omitted' % (len(full) - kept, len(full)), note)
+        self.assertIn('use --err-dir', note)
+
+    def test_truncate_one_write(self):
+        self._check_truncated([''.join(chr(ord('a') + i % 26) for i in range(1000))], 100)
+
+    def test_truncate_many_writes(self):
+        self._check_truncated(['line %d|' % i for i in range(1000)], 101)
+
+    def test_spill(self):
+        full = ''.join('line %d\n' % i for i in range(1000))
+        stream = CaptureStream(100, self.tempdir, 'foo.py:test_a')
+        for line in full.splitlines(True):
+            stream.write(line)
+
+        value = stream.getvalue()
+        self.assertIn('full output is in %s' % stream.spill_path, value)
+        self.assertEqual(os.path.dirname(stream.spill_path), self.tempdir)
+        with open(stream.spill_path) as f:
+            self.assertEqual(f.read(), full)
+
+    def test_no_spill_when_not_truncated(self):
+        stream = CaptureStream(100, self.tempdir, 'foo.py:test_a')
+        stream.write('x' * 100)
+        self.assertEqual(stream.getvalue(), 'x' * 100)
+        self.assertEqual(os.listdir(self.tempdir), [])
+
+    def test_spill_names(self):
+        names = set([
+            _spill_name('a/test_foo.py:test_1'),
+            _spill_name('b/test_foo.py:test_1'),
+            _spill_name('a/test_foo.py:TestCase.test_1'),
+            _spill_name('a/test_foo.py:test_2'),
+        ])
+        self.assertEqual(len(names), 4)
+        for name in names:
+            self.assertTrue(name.startswith('test_foo.py_'), name)
+            self.assertNotIn(os.sep, name)
+
+        self.assertEqual(_spill_name('a/test_foo.py:test_1'),
+                         _spill_name(os.path.abspath('a/test_foo.py') + ':test_1'))
+
+
+_traceback = """Traceback (most recent call last):
+  File "foo.py", line 10, in test_a
+    assert x == y, "a fairly long message to go along with the failure"
+AssertionError: a fairly long message to go along with the failure
+"""
+
+_warning = "foo.py:3: DeprecationWarning: this function is going away soon, use the other one\n"
+
+
+def _result(spec, err_msg):
+    # giving Test an err_msg keeps it from importing the test
+    test = _Test(spec, 'FAIL', 'not run')
+    test.err_msg = err_msg
+    return test
+
+
+class ErrDeduplicatorTestCase(unittest.TestCase):
+    def test_dedup(self):
+        results = [
+            _result('foo.py:test_a', 'some output\n' + _warning + _traceback),
+            _result('foo.py:test_b', _traceback),
+            _result('bar.py:test_c', 'short\n' + _warning),
+            _result('bar.py:test_d', ''),
+        ]
+        first = results[0].err_msg
+
+        dedup = ErrDeduplicator()
+        self.assertEqual(list(dedup.get_iter(results)), results)
+
+        self.assertEqual(results[0].err_msg, first)
+        self.assertEqual(results[1].err_msg,
+                         "[%d characters of output identical to output of "
+                         "foo.py:test_a]\n" % len(_traceback))
+        self.assertEqual(results[2].err_msg,
+                         "short\n[%d characters of output identical to output of "
+                         "foo.py:test_a]\n" % len(_warning))
+        self.assertEqual(results[3].err_msg, '')
+
+    def test_min_size(self):
+        results = [_result('foo.py:test_a', _traceback),
+                   _result('foo.py:test_b', _traceback)]
+        list(ErrDeduplicator(min_size=len(_traceback) + 1).get_iter(results))
+        self.assertEqual(results[1].err_msg, _traceback)
+
+
+if __name__ == '__main__':
+    unittest.main()
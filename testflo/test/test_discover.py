@@ -0,0 +1,75 @@
+import os
+import shutil
+import tempfile
+
+import unittest
+
+from testflo.options import get_options
+
+# testflo.test reads the options when it's imported, so make sure they
+# don't come from the command line of whatever is running these tests
+get_options([])
+
+from testflo import discover
+
+
+_fixture_mod = """
+def setUpModule():
+    pass
+
+def test_1():
+    pass
+
+def test_2():
+    pass
+"""
+
+_plain_mod = """
+def test_1():
+    pass
+"""
+
+
+class DiscoveryOrderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def _check_order(self, package):
+        # use names that are unique to this test so that other imports of
+        # the same module names can't interfere
+        dname = os.path.join(self.tempdir, 'tfdisc_pkg' if package else 'tfdisc_dir')
+        os.mkdir(dname)
+        if package:
+            open(os.path.join(dname, '__init__.py'), 'w').close()
+
+        prefix = 'test_%s_' % ('pkg' if package else 'dir')
+        fnames = []
+        for name, src in [('a', _fixture_mod), ('b', _plain_mod), ('c', _fixture_mod)]:
+            fnames.append(os.path.join(dname, prefix + name + '.py'))
+            with open(fnames[-1], 'w') as f:
+                f.write(src)
+
+        # give the modules explicitly, since the order of a directory walk
+        # isn't defined
+        found = []
+        for result in discover.TestDiscoverer().get_iter(fnames):
+            if isinstance(result, list):
+                mods = set(os.path.basename(t.spec.split(':', 1)[0]) for t in result)
+                self.assertEqual(len(mods), 1)
+                self.assertEqual(len(result), 2)
+                found.append(mods.pop())
+            else:
+                found.append(os.path.basename(result.spec.split(':', 1)[0]))
+
+        # each fixture group comes right after its module has been scanned,
+        # not at the end of discovery
+        self.assertEqual(found, [prefix + 'a.py', prefix + 'b.py', prefix + 'c.py'])
+
+    def test_package_dir(self):
+        self._check_order(True)
+
+    def test_non_package_dir(self):
+        self._check_order(False)
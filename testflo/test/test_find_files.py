@@ -0,0 +1,101 @@
+import os
+import shutil
+import tempfile
+
+import unittest
+
+from testflo.util import find_files, _gitignore_pattern, _is_ignored
+
+
+class FindFilesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def _touch(self, *parts):
+        path = os.path.join(self.tempdir, *parts)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        open(path, 'w').close()
+        return path
+
+    @unittest.skipUnless(hasattr(os, 'symlink'), "requires os.symlink")
+    def test_symlink_cycle(self):
+        fname = self._touch('sub', 'test_a.py')
+        try:
+            os.symlink('..', os.path.join(self.tempdir, 'sub', 'loop'))
+        except (OSError, NotImplementedError):
+            raise unittest.SkipTest("can't create symlinks here")
+
+        for nthreads in (0, 2):
+            found = list(find_files(self.tempdir, match='*.py', nthreads=nthreads))
+            self.assertEqual(found, [fname])
+
+    def test_ignorefile(self):
+        with open(os.path.join(self.tempdir, '.ignore'), 'w') as f:
+            f.write("build/\n*_skip.py\n!keep_skip.py\n")
+        keep = self._touch('test_a.py')
+        self._touch('test_skip.py')
+        keep2 = self._touch('keep_skip.py')
+        self._touch('build', 'test_b.py')
+
+        found = sorted(find_files(self.tempdir, match='*.py', ignorefile='.ignore'))
+        self.assertEqual(found, sorted([keep, keep2]))
+
+
+class GitignorePatternTestCase(unittest.TestCase):
+    def _matches(self, pat, path):
+        return _gitignore_pattern(pat).match(path) is not None
+
+    def test_unanchored(self):
+        self.assertTrue(self._matches('*.pyc', 'a.pyc'))
+        self.assertTrue(self._matches('*.pyc', 'x/y/a.pyc'))
+        self.assertFalse(self._matches('*.pyc', 'a.py'))
+        self.assertFalse(self._matches('*.pyc', 'a.pyc/b'))
+
+    def test_anchored(self):
+        self.assertTrue(self._matches('/build', 'build'))
+        self.assertFalse(self._matches('/build', 'x/build'))
+        self.assertTrue(self._matches('docs/*.txt', 'docs/a.txt'))
+        self.assertFalse(self._matches('docs/*.txt', 'docs/x/a.txt'))
+
+    def test_double_star(self):
+        self.assertTrue(self._matches('a/**/b', 'a/b'))
+        self.assertTrue(self._matches('a/**/b', 'a/x/y/b'))
+        self.assertTrue(self._matches('a/**', 'a/x/y'))
+
+    def test_classes_and_escapes(self):
+        self.assertTrue(self._matches('test_[ab].py', 'test_a.py'))
+        self.assertFalse(self._matches('test_[!ab].py', 'test_a.py'))
+        self.assertTrue(self._matches('test_[!ab].py', 'test_c.py'))
+        self.assertTrue(self._matches('test?.py', 'test1.py'))
+        self.assertFalse(self._matches('test?.py', 'test/.py'))
+        self.assertTrue(self._matches(r'\#x', '#x'))
+
+
+class IsIgnoredTestCase(unittest.TestCase):
+    def test_rules(self):
+        base = os.path.join(os.sep, 'top')
+        rules = [(_gitignore_pattern('build'), False, True),
+                 (_gitignore_pattern('*.log'), False, False),
+                 (_gitignore_pattern('keep.log'), True, False)]
+        ignores = [(base, rules)]
+
+        self.assertTrue(_is_ignored(ignores, os.path.join(base, 'build'), True))
+        # dirs_only rules don't apply to files
+        self.assertFalse(_is_ignored(ignores, os.path.join(base, 'build'), False))
+        self.assertTrue(_is_ignored(ignores, os.path.join(base, 'x', 'a.log'), False))
+        # later negated rules override earlier ones
+        self.assertFalse(_is_ignored(ignores, os.path.join(base, 'keep.log'), False))
+        self.assertFalse(_is_ignored(ignores, os.path.join(base, 'a.py'), False))
+
+    def test_nested(self):
+        top = os.path.join(os.sep, 'top')
+        sub = os.path.join(top, 'sub')
+        ignores = [(top, [(_gitignore_pattern('*.tmp'), False, False)]),
+                   (sub, [(_gitignore_pattern('a.tmp'), True, False)])]
+        self.assertTrue(_is_ignored(ignores, os.path.join(top, 'a.tmp'), False))
+        self.assertFalse(_is_ignored(ignores, os.path.join(sub, 'a.tmp'), False))
+        self.assertTrue(_is_ignored(ignores, os.path.join(sub, 'b.tmp'), False))
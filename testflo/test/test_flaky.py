@@ -0,0 +1,151 @@
+import os
+import json
+import shutil
+import tempfile
+
+import unittest
+
+from testflo.flaky import FlakeDB, FlakyRerunner
+
+
+class FlakeDBTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.fname = os.path.join(self.tempdir, 'flakes.json')
+        self.startdir = os.getcwd()
+        os.chdir(self.tempdir)
+
+    def tearDown(self):
+        os.chdir(self.startdir)
+        shutil.rmtree(self.tempdir)
+
+    def test_record(self):
+        db = FlakeDB(self.fname)
+        db.record('test_a.py:test_1', failed=False)
+        self.assertIsNone(db.get('test_a.py:test_1'))
+
+        db.record('test_a.py:test_1', failed=True, flaky=True)
+        db.record('test_a.py:test_1', failed=False)
+        db.record('test_a.py:test_2', failed=True)
+
+        rec = db.get('test_a.py:test_1')
+        self.assertEqual((rec['runs'], rec['fails'], rec['flakes']), (2, 1, 1))
+        rec = db.get('test_a.py:test_2')
+        self.assertEqual((rec['runs'], rec['fails'], rec['flakes']), (1, 1, 0))
+
+        self.assertEqual(db.flaky_specs(),
+                         set([os.path.join(self.tempdir, 'test_a.py') + ':test_1']))
+
+    def test_save_and_load(self):
+        db = FlakeDB(self.fname)
+        db.record('test_a.py:test_1', failed=True, flaky=True)
+        db.save()
+
+        with open(self.fname) as f:
+            self.assertEqual(list(json.load(f)),
+                             [os.path.join(self.tempdir, 'test_a.py') + ':test_1'])
+
+        # the same test is found from another dir
+        os.mkdir('sub')
+        os.chdir('sub')
+        db = FlakeDB(self.fname)
+        self.assertEqual(db.get('../test_a.py:test_1')['flakes'], 1)
+        self.assertIsNone(db.get('test_a.py:test_1'))
+
+    def test_missing_or_bad_file(self):
+        self.assertEqual(FlakeDB(self.fname).flaky_specs(), set())
+
+        with open(self.fname, 'w') as f:
+            f.write('{not json')
+        self.assertEqual(FlakeDB(self.fname).flaky_specs(), set())
+
+
+class _Result(object):
+    def __init__(self, spec, status, expected_fail=False):
+        self.spec = spec
+        self.status = status
+        self.expected_fail = expected_fail
+        self.err_msg = ''
+
+
+class _Rerunner(FlakyRerunner):
+    """A FlakyRerunner whose reruns pass for the tests in 'passes' without
+    running anything.
+    """
+
+    def __init__(self, passes, *args, **kwargs):
+        super(_Rerunner, self).__init__(*args, **kwargs)
+        self.passes = passes
+        self.rerun = []
+
+    def _new_tests(self, result):
+        return [None] * self.reruns
+
+    def _rerun(self, result, tests):
+        self.rerun.append(result.spec)
+        if result.spec in self.passes:
+            result.status = 'FLAKY'
+        return result
+
+
+class FlakyRerunnerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.fname = os.path.join(self.tempdir, 'flakes.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def _check(self, background):
+        results = [
+            _Result('a.py:test_flaky', 'FAIL'),
+            _Result('a.py:test_ok', 'OK'),
+            _Result('a.py:test_fail', 'FAIL'),
+            _Result('a.py:test_xfail', 'FAIL', expected_fail=True),
+            _Result('a.py:test_limit', 'LIMIT'),
+            _Result('a.py', 'FAIL'),  # a module that couldn't be imported
+        ]
+        db = FlakeDB(self.fname)
+        rerunner = _Rerunner(['a.py:test_flaky'], 2, db, background=background)
+
+        out = list(rerunner.get_iter(iter(results)))
+
+        self.assertEqual(sorted(rerunner.rerun), ['a.py:test_fail', 'a.py:test_flaky'])
+        self.assertEqual(len(out), len(results))
+        self.assertEqual(set(out), set(results))
+        if not background:
+            # the reruns are passed on after everything else
+            self.assertEqual(set(r.spec for r in out[-2:]),
+                             set(['a.py:test_fail', 'a.py:test_flaky']))
+
+        statuses = dict((r.spec, r.status) for r in out)
+        self.assertEqual(statuses['a.py:test_flaky'], 'FLAKY')
+        self.assertEqual(statuses['a.py:test_fail'], 'FAIL')
+
+        self.assertIn('flaky in 1 of 1 recorded runs', results[0].err_msg)
+
+        db = FlakeDB(self.fname)
+        self.assertEqual(db.get('a.py:test_flaky')['flakes'], 1)
+        self.assertEqual(db.get('a.py:test_fail')['fails'], 1)
+        self.assertEqual(db.get('a.py:test_fail')['flakes'], 0)
+        self.assertIsNone(db.get('a.py:test_ok'))
+
+    def test_held(self):
+        self._check(background=False)
+
+    def test_background(self):
+        self._check(background=True)
+
+    def test_interrupted(self):
+        def interrupted():
+            yield _Result('a.py:test_flaky', 'FAIL')
+            raise KeyboardInterrupt()
+
+        rerunner = _Rerunner([], 1, FlakeDB(self.fname))
+        self.assertRaises(KeyboardInterrupt, list, rerunner.get_iter(interrupted()))
+        # whatever was recorded was still saved
+        self.assertTrue(os.path.isfile(self.fname))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,34 @@
+import os
+import sys
+import subprocess
+
+import unittest
+
+# modules that testflo should only import when a feature that needs them
+# is actually used
+_heavy_modules = ['coverage', 'mpi4py', 'distutils', 'webbrowser', 'cProfile',
+                  'pstats', 'json', 'asyncio', 'xml.sax']
+
+
+def _imported_modules(stmt):
+    """Execute stmt in a fresh interpreter and return which of the heavy
+    modules it imported.
+    """
+    env = os.environ.copy()
+    pkgdir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    env['PYTHONPATH'] = os.pathsep.join([pkgdir, env.get('PYTHONPATH', '')])
+    code = "import sys; %s; print(' '.join(m for m in %r if m in sys.modules))" % (
+                stmt, _heavy_modules)
+    out = subprocess.check_output([sys.executable, '-c', code], env=env,
+                                  universal_newlines=True)
+    return out.split()
+
+
+class LazyImportTestCase(unittest.TestCase):
+    def test_main_imports(self):
+        self.assertEqual(_imported_modules("import testflo.main"), [])
+
+    def test_subprocess_imports(self):
+        # these are what isolated and MPI subprocesses import
+        self.assertEqual(_imported_modules("import testflo.test, testflo.cover, "
+                                           "testflo.qman"), [])
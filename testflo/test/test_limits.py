@@ -0,0 +1,117 @@
+import time
+import traceback
+
+import unittest
+
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+
+from testflo.limits import ResourceLimits, ResourceLimitError
+
+
+class _Test(object):
+    def __init__(self, status, err_msg=''):
+        self.status = status
+        self.err_msg = err_msg
+
+
+@unittest.skipIf(resource is None, "requires the resource module")
+class ResourceLimitsTestCase(unittest.TestCase):
+    def _stop(self, limits, status, err_msg=''):
+        test = _Test(status, err_msg)
+        limits.stop(test)
+        return test
+
+    def test_restores_limits(self):
+        old = resource.getrlimit(resource.RLIMIT_NOFILE)
+        limits = ResourceLimits(files=10)
+        limits.start()
+        self.assertEqual(resource.getrlimit(resource.RLIMIT_NOFILE)[0], 10)
+
+        test = self._stop(limits, 'OK')
+        self.assertEqual(resource.getrlimit(resource.RLIMIT_NOFILE), old)
+        self.assertEqual(test.status, 'OK')
+        self.assertIsNone(limits.exceeded)
+
+    def test_files(self):
+        limits = ResourceLimits(files=5)
+        limits.start()
+        files = []
+        try:
+            try:
+                for i in range(10):
+                    files.append(open(__file__))
+            except (IOError, OSError):
+                err_msg = traceback.format_exc()
+            else:
+                self.fail("opened too many files")
+        finally:
+            for f in files:
+                f.close()
+
+        test = self._stop(limits, 'FAIL', err_msg)
+        self.assertEqual(test.status, 'LIMIT')
+        self.assertTrue(test.err_msg.startswith("Open files limit of 5 exceeded (used "),
+                        test.err_msg)
+        self.assertTrue(test.err_msg.endswith(err_msg))
+
+    def test_memory_error(self):
+        limits = ResourceLimits(memory=1e6)
+        limits.start()
+        test = self._stop(limits, 'FAIL', 'Traceback:\n  ...\nMemoryError\n')
+        self.assertEqual(test.status, 'LIMIT')
+        self.assertIn("Address space limit of 1000000.0 MB exceeded", test.err_msg)
+
+    def test_other_failures(self):
+        # a failure that isn't caused by a limit is left alone, and so is
+        # a MemoryError when there's no memory limit
+        limits = ResourceLimits(memory=1e6, files=1000)
+        limits.start()
+        test = self._stop(limits, 'FAIL', 'AssertionError: MemoryError\n')
+        self.assertEqual(test.status, 'FAIL')
+
+        limits = ResourceLimits(files=1000)
+        limits.start()
+        test = self._stop(limits, 'FAIL', 'MemoryError\n')
+        self.assertEqual(test.status, 'FAIL')
+
+    def _spin(self, secs):
+        # use up secs of CPU time, however long that takes
+        start = time.time()
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        end = usage.ru_utime + usage.ru_stime + secs
+        while time.time() - start < 60.:
+            usage = resource.getrusage(resource.RUSAGE_SELF)
+            if usage.ru_utime + usage.ru_stime > end:
+                break
+
+    def test_cpu_over_exact_limit(self):
+        # RLIMIT_CPU is in whole seconds, so going a little over the limit
+        # isn't caught by the OS, but it's still reported
+        limits = ResourceLimits(cpu=0.2)
+        limits.start()
+        try:
+            self._spin(0.3)
+        except ResourceLimitError:
+            pass
+        test = self._stop(limits, 'OK')
+        self.assertEqual(test.status, 'LIMIT')
+        self.assertIn("CPU time limit of 0.2 sec exceeded", test.err_msg)
+
+    def test_cpu_signal(self):
+        limits = ResourceLimits(cpu=0.5)
+        limits.start()
+        try:
+            self.assertRaises(ResourceLimitError, self._spin, 10.)
+        finally:
+            limits.disarm()
+        self.assertEqual(limits.exceeded, "CPU time limit of 0.5 sec exceeded")
+
+        test = self._stop(limits, 'FAIL', 'ResourceLimitError\n')
+        self.assertEqual(test.status, 'LIMIT')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,146 @@
+import os
+import json
+import shutil
+import tempfile
+
+import unittest
+
+from testflo import memory
+from testflo.memory import MemoryHistory, MemoryAdmission
+
+
+class _Test(object):
+    def __init__(self, spec, mem=None, status='OK', peak_memory=0.):
+        self.spec = spec
+        self.mod = None
+        self.tcase = None
+        self.status = status
+        self.peak_memory = peak_memory
+        if mem is not None:
+            # as if the module declared MEMORY_MB
+            self.mod = type('mod', (object,), {'MEMORY_MB': mem})
+
+    def __iter__(self):
+        return iter((self,))
+
+
+class MemoryHistoryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.fname = os.path.join(self.tempdir, 'memory.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_record(self):
+        hist = MemoryHistory(self.fname, keep=3)
+        self.assertIsNone(hist.predict('a.py:test_1'))
+
+        for peak in (50., 10., 20., 30.):
+            hist.record('a.py:test_1', peak)
+        # only the last 3 are kept
+        self.assertEqual(hist.predict('a.py:test_1'), 30.)
+        hist.record('a.py:test_1', 12.345)
+        self.assertEqual(hist._data['a.py:test_1'], [20., 30., 12.3])
+
+    def test_pipeline(self):
+        results = [
+            _Test('a.py:test_ok', peak_memory=100.),
+            _Test('a.py:test_fail', status='FAIL', peak_memory=200.),
+            _Test('a.py:test_skip', status='SKIP', peak_memory=300.),
+            _Test('a.py:test_none', peak_memory=0.),
+        ]
+        hist = MemoryHistory(self.fname)
+        self.assertEqual(list(hist.get_iter(results)), results)
+
+        with open(self.fname) as f:
+            self.assertEqual(json.load(f), {'a.py:test_ok': [100.],
+                                            'a.py:test_fail': [200.]})
+
+        self.assertEqual(MemoryHistory(self.fname).predict('a.py:test_fail'), 200.)
+
+
+class MemoryAdmissionTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.hist = MemoryHistory(os.path.join(self.tempdir, 'memory.json'))
+        self.avail = None
+        self._available_memory = memory.available_memory
+        memory.available_memory = lambda: self.avail
+
+    def tearDown(self):
+        memory.available_memory = self._available_memory
+        shutil.rmtree(self.tempdir)
+
+    def test_predict(self):
+        self.hist.record('a.py:T.test_1', 100.)
+        self.hist.record('a.py:T.test_2', 300.)
+        adm = MemoryAdmission(self.hist, budget=1000)
+
+        self.assertEqual(adm.predict(_Test('a.py:T.test_1')), 100.)
+        # a declared MEMORY_MB wins over the history
+        self.assertEqual(adm.predict(_Test('a.py:T.test_1', mem=50)), 50.)
+        # a group needs the most that any of its tests need
+        group = [_Test('a.py:T.test_1'), _Test('a.py:T.test_2'), _Test('a.py:T.test_3')]
+        self.assertEqual(adm.predict(group), 300.)
+        self.assertEqual(adm.predict(_Test('a.py:test_new')), 0.)
+
+    def test_fits(self):
+        adm = MemoryAdmission(self.hist, budget=1000)
+        self.assertTrue(adm._fits(400., 600.))
+        self.assertFalse(adm._fits(401., 600.))
+
+        # less is available than the budget allows for
+        self.avail = 300.
+        self.assertTrue(adm._fits(300., 600.))
+        self.assertFalse(adm._fits(301., 600.))
+        self.avail = 5000.
+        self.assertFalse(adm._fits(401., 600.))
+
+    def test_fits_unknown_memory(self):
+        adm = MemoryAdmission(self.hist)
+        self.assertIsNone(adm.budget)
+        self.assertTrue(adm._fits(1e9, 1e9))
+
+        self.avail = 1000.
+        adm = MemoryAdmission(self.hist)
+        self.assertEqual(adm.budget, 900.)
+
+    def _next(self, adm, it, running, nbusy):
+        tests, need = adm.next_group(it, running, nbusy)
+        return None if tests is None else tests.spec
+
+    def test_next_group(self):
+        tests = [_Test('big', mem=800), _Test('small1', mem=100),
+                 _Test('small2', mem=100), _Test('huge', mem=5000)]
+        it = iter(tests)
+        adm = MemoryAdmission(self.hist, budget=1000)
+
+        self.assertEqual(self._next(adm, it, 0., 0), 'big')
+        # the small ones fit next to it until the budget is used up
+        self.assertEqual(self._next(adm, it, 800., 1), 'small1')
+        self.assertEqual(self._next(adm, it, 950., 2), None)
+        self.assertEqual(self._next(adm, it, 800., 1), 'small2')
+        self.assertEqual(self._next(adm, it, 900., 2), None)
+        # one that needs more than the budget only starts on its own
+        self.assertEqual(self._next(adm, it, 100., 1), None)
+        self.assertEqual(self._next(adm, it, 0., 0), 'huge')
+        self.assertEqual(self._next(adm, it, 0., 0), None)
+
+    def test_max_skips(self):
+        tests = [_Test('big1', mem=600), _Test('big2', mem=600)]
+        tests.extend(_Test('small%d' % i, mem=10) for i in range(5))
+        it = iter(tests)
+        adm = MemoryAdmission(self.hist, budget=1000, max_skips=2)
+
+        self.assertEqual(self._next(adm, it, 0., 0), 'big1')
+        self.assertEqual(self._next(adm, it, 600., 1), 'small0')
+        self.assertEqual(self._next(adm, it, 610., 2), 'small1')
+        # big2 has been passed over twice, so nothing else starts until it fits
+        self.assertEqual(self._next(adm, it, 620., 3), None)
+        self.assertEqual(self._next(adm, it, 20., 2), 'big2')
+        self.assertEqual(self._next(adm, it, 620., 3), 'small2')
+
+
+if __name__ == '__main__':
+    unittest.main()
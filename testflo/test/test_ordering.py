@@ -0,0 +1,122 @@
+import os
+import time
+import shutil
+import tempfile
+
+import unittest
+
+from testflo.ordering import PriorityOrder, FailedFirst, FlakyFirst, ChangedFirst
+from testflo.flaky import FlakeDB
+
+
+class _Test(object):
+    def __init__(self, spec):
+        self.spec = spec
+
+    def __iter__(self):
+        return iter((self,))
+
+
+def _specs(groups):
+    return [[t.spec for t in tests] for tests in groups]
+
+
+class PriorityOrderTestCase(unittest.TestCase):
+    def test_order(self):
+        first = lambda t: t.spec.endswith('first')
+        second = lambda t: t.spec.endswith('second')
+
+        groups = [
+            _Test('a.py:test_1'),
+            _Test('a.py:test_second'),
+            [_Test('b.py:T.test_1'), _Test('b.py:T.test_first')],
+            _Test('a.py:test_2'),
+            _Test('c.py:test_first'),
+            [_Test('d.py:T.test_second'), _Test('d.py:T.test_1')],
+        ]
+
+        order = PriorityOrder(first, second)
+        self.assertEqual(_specs(order.get_iter(groups)), [
+            # groups are kept together
+            ['b.py:T.test_1', 'b.py:T.test_first'],
+            ['c.py:test_first'],
+            ['a.py:test_second'],
+            ['d.py:T.test_second', 'd.py:T.test_1'],
+            ['a.py:test_1'],
+            ['a.py:test_2'],
+        ])
+
+    def test_streaming(self):
+        # the first predicate's groups are passed on before discovery ends
+        def discover():
+            yield _Test('a.py:test_1')
+            yield _Test('a.py:test_first')
+            raise RuntimeError("discovery isn't done")
+
+        it = PriorityOrder(lambda t: t.spec.endswith('first')).get_iter(discover())
+        self.assertEqual(next(it).spec, 'a.py:test_first')
+        self.assertRaises(RuntimeError, next, it)
+
+    def test_no_predicates(self):
+        groups = [_Test('a.py:test_%d' % i) for i in range(3)]
+        self.assertEqual(list(PriorityOrder().get_iter(groups)), groups)
+
+
+class PredicateTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.startdir = os.getcwd()
+        os.chdir(self.tempdir)
+
+    def tearDown(self):
+        os.chdir(self.startdir)
+        shutil.rmtree(self.tempdir)
+
+    def test_failed_first(self):
+        with open('failtests.in', 'w') as f:
+            f.write('test_a.py:test_1\n%s:T.test_2\n' % os.path.abspath('test_b.py'))
+
+        pred = FailedFirst('failtests.in')
+        self.assertTrue(pred(_Test('test_a.py:test_1')))
+        self.assertTrue(pred(_Test(os.path.abspath('test_a.py') + ':test_1')))
+        self.assertTrue(pred(_Test('test_b.py:T.test_2')))
+        self.assertFalse(pred(_Test('test_a.py:test_2')))
+
+        os.mkdir('sub')
+        os.chdir('sub')
+        self.assertTrue(pred(_Test('../test_a.py:test_1')))
+
+    def test_failed_first_missing(self):
+        self.assertFalse(FailedFirst('nosuchfile.in')(_Test('test_a.py:test_1')))
+
+    def test_flaky_first(self):
+        db = FlakeDB('flakes.json')
+        db.record('test_a.py:test_flaky', failed=True, flaky=True)
+        db.record('test_a.py:test_fail', failed=True)
+        db.save()
+
+        os.mkdir('sub')
+        os.chdir('sub')
+        pred = FlakyFirst(os.path.join(self.tempdir, 'flakes.json'))
+        self.assertTrue(pred(_Test('../test_a.py:test_flaky')))
+        self.assertFalse(pred(_Test('../test_a.py:test_fail')))
+        self.assertFalse(pred(_Test('test_a.py:test_flaky')))
+
+    def test_changed_first(self):
+        for name in ('test_old.py', 'test_new.py'):
+            open(name, 'w').close()
+        since = time.time() - 100.
+        os.utime('test_old.py', (since - 100., since - 100.))
+
+        pred = ChangedFirst(since)
+        self.assertTrue(pred(_Test('test_new.py:test_1')))
+        self.assertFalse(pred(_Test('test_old.py:test_1')))
+        self.assertFalse(pred(_Test('test_gone.py:test_1')))
+
+        # results are cached per file
+        os.utime('test_old.py', None)
+        self.assertFalse(pred(_Test('test_old.py:test_2')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+import os
+import json
+import shutil
+import tempfile
+from xml.etree import ElementTree
+
+import unittest
+
+from testflo.options import get_options
+
+# testflo.test reads the options when it's imported, so make sure they
+# don't come from the command line of whatever is running these tests
+get_options([])
+
+from testflo.test import Test as _Test
+from testflo.reports import JUnitXMLWriter, JSONLinesWriter
+
+
+def _result(spec, status, err_msg='', expected_fail=False):
+    # giving Test an err_msg keeps it from importing the test
+    test = _Test(spec, err_msg='not run')
+    test.status = status
+    test.err_msg = err_msg
+    test.expected_fail = expected_fail
+    test.start_time = 100.
+    test.end_time = 101.5
+    return test
+
+
+def _results():
+    return [
+        _result('foo.py:FooTestCase.test_ok', 'OK'),
+        _result('foo.py:FooTestCase.test_fail', 'FAIL',
+                'Traceback:\n  <"quoted" & \x1b[31mcolored\x1b[0m>\nAssertionError: 1 != 2\n'),
+        _result('foo.py:test_skip', 'SKIP', 'not today & <never>'),
+        _result('foo.py:test_xfail', 'FAIL', 'AssertionError\n', expected_fail=True),
+        _result('foo.py:test_xpass', 'OK', expected_fail=True),
+        _result('foo.py:test_limit', 'LIMIT', 'exceeded the CPU time limit\n'),
+        _result('foo.py:test_cancelled', 'CANCELLED', 'Cancelled after another test failed.\n'),
+        _result('foo.py:test_unicode', 'OK', u'caf\xe9 \u2603 \x00\n'),
+    ]
+
+
+class ReportsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def _write(self, writer, results):
+        # the writer must pass every test on, in order
+        self.assertEqual(list(writer.get_iter(results)), results)
+
+    def test_jsonl(self):
+        fname = os.path.join(self.tempdir, 'results.jsonl')
+        results = _results()
+        self._write(JSONLinesWriter(fname), results)
+
+        with open(fname) as f:
+            records = [json.loads(line) for line in f]
+
+        self.assertEqual(len(records), len(results))
+        for rec, test in zip(records, results):
+            self.assertEqual(rec['spec'], test.spec)
+            self.assertEqual(rec['status'], test.status)
+            self.assertEqual(rec['err_msg'], test.err_msg)
+            self.assertEqual(rec['expected_fail'], test.expected_fail)
+            self.assertEqual(rec['elapsed'], 1.5)
+
+    def _junit(self, results):
+        fname = os.path.join(self.tempdir, 'results.xml')
+        self._write(JUnitXMLWriter(fname), results)
+        suite = ElementTree.parse(fname).getroot().find('testsuite')
+        cases = dict((c.get('classname') + ' ' + c.get('name'), c)
+                     for c in suite.findall('testcase'))
+        return suite, cases
+
+    def test_junit(self):
+        suite, cases = self._junit(_results())
+
+        self.assertEqual(suite.get('tests'), '8')
+        self.assertEqual(suite.get('failures'), '3')
+        self.assertEqual(suite.get('skipped'), '2')
+        self.assertEqual(len(cases), 8)
+
+        case = cases['foo.py:FooTestCase test_fail']
+        failure = case.find('failure')
+        self.assertEqual(failure.get('message'), 'AssertionError: 1 != 2')
+        # the control characters were replaced, everything else is intact
+        self.assertIn('<"quoted" & ?[31mcolored?[0m>', failure.text)
+        self.assertEqual(case.get('time'), '1.500')
+
+        self.assertEqual(cases['foo.py test_skip'].find('skipped').get('message'),
+                         'not today & <never>')
+        self.assertIsNotNone(cases['foo.py test_cancelled'].find('skipped'))
+        self.assertEqual(cases['foo.py test_xpass'].find('failure').get('message'),
+                         'unexpected success')
+        self.assertIsNotNone(cases['foo.py test_limit'].find('failure'))
+        self.assertIsNone(cases['foo.py test_xfail'].find('failure'))
+        self.assertIsNone(cases['foo.py:FooTestCase test_ok'].find('failure'))
+        self.assertEqual(cases['foo.py test_unicode'].find('system-err').text,
+                         u'caf\xe9 \u2603 ?\n')
+
+        props = dict((p.get('name'), p.get('value'))
+                     for p in cases['foo.py test_skip'].find('properties'))
+        self.assertEqual(props['worker_id'], '')
+
+    def test_junit_interrupted(self):
+        def interrupted():
+            for test in _results()[:2]:
+                yield test
+            raise KeyboardInterrupt()
+
+        fname = os.path.join(self.tempdir, 'results.xml')
+        it = JUnitXMLWriter(fname).get_iter(interrupted())
+        self.assertRaises(KeyboardInterrupt, list, it)
+
+        # the document was still closed and has the counts so far
+        suite = ElementTree.parse(fname).getroot().find('testsuite')
+        self.assertEqual(suite.get('tests'), '2')
+        self.assertEqual(suite.get('failures'), '1')
+        self.assertEqual(len(suite.findall('testcase')), 2)
+
+    def test_junit_empty(self):
+        suite, cases = self._junit([])
+        self.assertEqual(suite.get('tests'), '0')
+        self.assertEqual(cases, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
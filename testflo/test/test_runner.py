@@ -0,0 +1,221 @@
+import os
+import sys
+import json
+import shutil
+import tempfile
+import subprocess
+
+import unittest
+
+
+_crash_mod = """
+import os
+import signal
+import unittest
+
+class CrashTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        with open('setups.txt', 'a') as f:
+            f.write('%%d\\n' %% os.getpid())
+
+    def test_a(self):
+        pass
+
+    def test_b(self):
+        %s
+
+    def test_c(self):
+        pass
+
+    def test_d(self):
+        pass
+"""
+
+_hang_mod = """
+import time
+import signal
+
+def test_hang():
+    signal.signal(signal.SIGALRM, signal.SIG_IGN)
+    time.sleep(60)
+
+def test_ok():
+    pass
+"""
+
+_many_mod = """
+def test_1():
+    pass
+
+def test_2():
+    pass
+
+def test_3():
+    pass
+
+def test_4():
+    pass
+"""
+
+_stop_mod = """
+import time
+import unittest
+
+class GroupTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        pass
+
+    def test_1(self):
+        time.sleep(1)
+
+    def test_2(self):
+        time.sleep(1)
+
+    def test_3(self):
+        time.sleep(1)
+
+def test_fail():
+    time.sleep(0.3)
+    assert False
+"""
+
+_flaky_mod = """
+import os
+
+def test_flaky():
+    if not os.path.exists('ran_once'):
+        open('ran_once', 'w').close()
+        assert False
+
+def test_fail():
+    assert False
+"""
+
+_limit_mod = """
+import time
+
+def test_spin():
+    start = time.time()
+    while time.time() - start < 10.:
+        pass
+
+def test_files():
+    files = [open(__file__) for i in range(100)]
+
+def test_ok():
+    pass
+"""
+
+
+class RunnerTestCase(unittest.TestCase):
+    """Runs testflo in a subprocess on generated test modules and checks the
+    results it writes with --jsonl.
+    """
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def _run(self, src, *args):
+        with open(os.path.join(self.tempdir, 'test_gen.py'), 'w') as f:
+            f.write(src)
+
+        env = os.environ.copy()
+        pkgdir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        env['PYTHONPATH'] = os.pathsep.join([pkgdir, env.get('PYTHONPATH', '')])
+        cmd = [sys.executable, '-m', 'testflo.main', '--noreport',
+               '--jsonl', 'results.jsonl'] + list(args) + ['test_gen.py']
+        with open(os.devnull, 'w') as devnull:
+            subprocess.call(cmd, cwd=self.tempdir, env=env, stdout=devnull,
+                            stderr=devnull)
+
+        results = {}
+        with open(os.path.join(self.tempdir, 'results.jsonl')) as f:
+            for line in f:
+                rec = json.loads(line)
+                results[rec['spec'].rsplit('.', 1)[-1].rsplit(':', 1)[-1]] = rec
+        return results
+
+    def _setup_pids(self):
+        with open(os.path.join(self.tempdir, 'setups.txt')) as f:
+            return [int(line) for line in f]
+
+    def _check_crash(self, crash):
+        results = self._run(_crash_mod % crash, '-n', '2')
+
+        self.assertEqual(results['test_b']['status'], 'FAIL')
+        self.assertIn('worker process running this test died', results['test_b']['err_msg'])
+        for name in ('test_a', 'test_c', 'test_d'):
+            self.assertEqual(results[name]['status'], 'OK', results[name]['err_msg'])
+
+        # the rest of the group ran on a new worker, after setUpClass ran again
+        pids = self._setup_pids()
+        self.assertEqual(len(pids), 2)
+        self.assertEqual(results['test_a']['pid'], pids[0])
+        self.assertEqual(results['test_c']['pid'], pids[1])
+        self.assertEqual(results['test_d']['pid'], pids[1])
+
+    def test_exit_in_group(self):
+        self._check_crash("os._exit(1)")
+
+    @unittest.skipUnless(hasattr(__import__('signal'), 'SIGSEGV'), "requires SIGSEGV")
+    def test_segfault_in_group(self):
+        self._check_crash("os.kill(os.getpid(), signal.SIGSEGV)")
+
+    @unittest.skipUnless(hasattr(__import__('signal'), 'SIGALRM'), "requires SIGALRM")
+    def test_hung_worker_killed(self):
+        results = self._run(_hang_mod, '-n', '2', '--timeout', '1')
+
+        self.assertEqual(results['test_hang']['status'], 'FAIL')
+        self.assertIn('The worker process was killed', results['test_hang']['err_msg'])
+        # it was killed after the grace period rather than left to finish
+        self.assertLess(results['test_hang']['elapsed'], 30.)
+        self.assertEqual(results['test_ok']['status'], 'OK')
+
+    def test_max_tests_per_worker(self):
+        results = self._run(_many_mod, '-n', '2', '--max-tests-per-worker', '1')
+        self.assertEqual(len(results), 4)
+        self.assertEqual(len(set(r['pid'] for r in results.values())), 4)
+
+        results = self._run(_many_mod, '-n', '2')
+        self.assertLessEqual(len(set(r['pid'] for r in results.values())), 2)
+
+    def test_stop_cancels_whole_group(self):
+        results = self._run(_stop_mod, '-n', '2', '-x')
+
+        self.assertEqual(results['test_fail']['status'], 'FAIL')
+        # every test in the group that was running gets a result
+        for name in ('test_1', 'test_2', 'test_3'):
+            self.assertEqual(results[name]['status'], 'CANCELLED')
+
+    def test_rerun_failures(self):
+        for nprocs in ('1', '2'):
+            results = self._run(_flaky_mod, '-n', nprocs, '--rerun-failures', '2')
+            os.remove(os.path.join(self.tempdir, 'ran_once'))
+
+            self.assertEqual(results['test_flaky']['status'], 'FLAKY')
+            self.assertIn('Passed on isolated rerun 1 of 2', results['test_flaky']['err_msg'])
+            self.assertEqual(results['test_fail']['status'], 'FAIL')
+            self.assertIn('Failed again in 2 isolated reruns', results['test_fail']['err_msg'])
+
+        with open(os.path.join(self.tempdir, 'testflo_flakes.json')) as f:
+            flakes = json.load(f)
+        rec = flakes[os.path.join(os.path.realpath(self.tempdir), 'test_gen.py') + ':test_flaky']
+        self.assertEqual((rec['runs'], rec['fails'], rec['flakes']), (2, 2, 2))
+
+    @unittest.skipUnless(hasattr(__import__('signal'), 'SIGXCPU'), "requires SIGXCPU")
+    def test_limits(self):
+        for nprocs in ('1', '2'):
+            results = self._run(_limit_mod, '-n', nprocs, '--limit-cpu', '1',
+                                '--limit-files', '50')
+
+            self.assertEqual(results['test_spin']['status'], 'LIMIT')
+            self.assertIn('CPU time limit of 1.0 sec exceeded', results['test_spin']['err_msg'])
+            self.assertLess(results['test_spin']['elapsed'], 5.)
+            self.assertEqual(results['test_files']['status'], 'LIMIT')
+            self.assertIn('Open files limit of 50 exceeded', results['test_files']['err_msg'])
+            self.assertEqual(results['test_ok']['status'], 'OK')
@@ -0,0 +1,90 @@
+import random
+
+import unittest
+
+from six.moves import cStringIO
+
+from testflo.options import get_options
+
+# testflo.test reads the options when it's imported, so make sure they
+# don't come from the command line of whatever is running these tests
+get_options([])
+
+from testflo.test import Test as _Test
+from testflo.summary import SpillList, ResultSummary
+
+
+class SpillListTestCase(unittest.TestCase):
+    def test_in_memory(self):
+        names = SpillList(max_items=10)
+        for name in ('c', 'a', 'b'):
+            names.append(name)
+
+        self.assertEqual(len(names), 3)
+        self.assertEqual(names._files, [])
+        self.assertEqual(list(names), ['a', 'b', 'c'])
+        names.close()
+
+    def test_spill_and_merge(self):
+        items = ['test_%05d.py:test_%d' % (random.randint(0, 99999), i)
+                 for i in range(1000)]
+        items.extend(items[:50])  # duplicates are kept
+
+        names = SpillList(max_items=64)
+        for item in items:
+            names.append(item)
+
+        self.assertEqual(len(names), len(items))
+        self.assertEqual(len(names._files), len(items) // 64)
+        self.assertTrue(len(names._items) < 64)
+        self.assertEqual(list(names), sorted(items))
+        # iterating again gives the same thing
+        self.assertEqual(list(names), sorted(items))
+
+        names.close()
+        self.assertEqual(list(names), [])
+
+    def test_empty(self):
+        names = SpillList(max_items=1)
+        self.assertEqual(len(names), 0)
+        self.assertFalse(names)
+        self.assertEqual(list(names), [])
+
+
+def _result(spec, status):
+    # giving Test an err_msg keeps it from importing the test
+    test = _Test(spec, err_msg='not run')
+    test.status = status
+    return test
+
+
+class ResultSummaryTestCase(unittest.TestCase):
+    def _summary(self, results):
+        stream = cStringIO()
+        summary = ResultSummary(get_options([]), stream=stream)
+        self.assertEqual(list(summary.get_iter(results)), results)
+        return stream.getvalue()
+
+    def test_counts(self):
+        results = [_result('a.py:test_%d' % i, 'OK') for i in range(3)]
+        results.append(_result('b.py:test_fail', 'FAIL'))
+        results.append(_result('a.py:test_fail', 'FAIL'))
+        results.append(_result('a.py:test_skip', 'SKIP'))
+        results.extend(_result('c.py:test_%d' % i, 'CANCELLED') for i in range(2))
+
+        out = self._summary(results)
+
+        self.assertIn("The following tests failed:\na.py:test_fail\nb.py:test_fail\n", out)
+        self.assertIn("2 tests cancelled when the run stopped", out)
+        self.assertIn("Passed:  3\nFailed:  2\nSkipped: 1\nCancelled: 2\n", out)
+        self.assertIn("Ran 8 tests", out)
+
+    def test_ok(self):
+        out = self._summary([_result('a.py:test_1', 'OK')])
+        self.assertIn("\n\nOK", out)
+        self.assertNotIn("ancelled", out)
+        self.assertIn("Ran 1 test ", out)
+
+
+if __name__ == '__main__':
+    unittest.main()
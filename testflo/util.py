@@ -3,23 +3,28 @@ Misc. utility routines.
 """
 
 import os
+import re
 import sys
+import atexit
+import threading
 import itertools
 import inspect
 import warnings
 
 from six import string_types, PY3
 from six.moves.configparser import ConfigParser
+from six.moves import cPickle as pickle
 
 try:
     from multiprocessing import cpu_count
 except ImportError:
     pass
 
-from fnmatch import fnmatch
+from fnmatch import translate
 from os.path import join, dirname, basename, isfile,  abspath, split, splitext
 
-from argparse import ArgumentParser
+from argparse import ArgumentParser, SUPPRESS
+from tempfile import mkstemp
 
 from testflo.cover import start_coverage, stop_coverage
 
@@ -52,6 +57,59 @@ def _get_parser():
                         help='Number of processes to run. By default, this will '
                              'use the number of CPUs available.  To force serial'
                              ' execution, specify a value of 1.')
+    parser.add_argument('--adaptive', action='store_true', dest='adaptive',
+                        help='Vary the number of tests running at once, up to NUM_PROCS, '
+                             'based on the load average and, on linux, CPU and memory '
+                             'pressure, so tests use the CPUs other jobs leave free.')
+    parser.add_argument('--memory-aware', action='store_true', dest='memory_aware',
+                        help="Record the peak memory used by each test, and only start "
+                             "a test when its predicted peak memory fits in the "
+                             "available memory, running smaller tests meanwhile. A "
+                             "test's prediction comes from its MEMORY_MB attribute "
+                             "(on its TestCase, or its module for test functions) or "
+                             "from its recorded history.")
+    parser.add_argument('--memory-file', action='store', dest='memory_file',
+                        metavar='FILE', default='testflo_memory.json',
+                        help="File where --memory-aware keeps the peak memory of "
+                             "recent runs of each test. Default is testflo_memory.json.")
+    parser.add_argument('--mem-budget', action='store', dest='mem_budget', type=float,
+                        metavar='MB', default=0,
+                        help="With --memory-aware, the memory (in MB) that running tests "
+                             "may use. By default it's 90%% of the memory available "
+                             "when testing starts.")
+    parser.add_argument('--limit-memory', action='store', dest='limit_memory', type=float,
+                        metavar='MB', default=0,
+                        help="Limit the address space of the process running each test "
+                             "to MB megabytes.")
+    parser.add_argument('--limit-cpu', action='store', dest='limit_cpu', type=float,
+                        metavar='SEC', default=0,
+                        help="Limit the CPU time each test may use to SEC seconds. A "
+                             "test is stopped within a second after going over SEC, "
+                             "since the OS counts CPU time limits in whole seconds, "
+                             "but is reported as LIMIT for any use over SEC.")
+    parser.add_argument('--limit-files', action='store', dest='limit_files', type=int,
+                        metavar='NUM', default=0,
+                        help="Limit the number of files the process running each test "
+                             "may have open.")
+    parser.add_argument('--cgroup-memory', action='store', dest='cgroup_memory', type=float,
+                        metavar='MB', default=0,
+                        help="Limit the memory of each worker process, including any "
+                             "processes its tests start, using the cgroup v2 memory.max "
+                             "limit. Needs cgroup controllers delegated to testflo.")
+    parser.add_argument('--cgroup-cpus', action='store', dest='cgroup_cpus', type=float,
+                        metavar='CPUS', default=0,
+                        help="Limit each worker process to the given number of CPUs "
+                             "using the cgroup v2 cpu.max limit.")
+    parser.add_argument('--cgroup-pids', action='store', dest='cgroup_pids', type=int,
+                        metavar='NUM', default=0,
+                        help="Limit the number of processes and threads in each worker "
+                             "process's cgroup, using the cgroup v2 pids.max limit.")
+    parser.add_argument('--threads', type=int, action='store', dest='threads',
+                        metavar='NUM_THREADS', default=0,
+                        help='Run tests in NUM_THREADS threads of a single process '
+                             'instead of in worker processes. Only use this if your '
+                             'tests are thread safe. Test timeouts are not enforced '
+                             'in this mode.')
     parser.add_argument('-o', '--outfile', action='store', dest='outfile',
                         metavar='FILE', default='testflo_report.out',
                         help='Name of test report file.  Default is testflo_report.out.')
@@ -70,8 +128,17 @@ def _get_parser():
                         help="Save failed tests to failtests.in file.")
     parser.add_argument('--full_path', action='store_true', dest='full_path',
                         help="Display full test specs instead of shortened names.")                        
-    parser.add_argument('-i', '--isolated', action='store_true', dest='isolated',
-                        help="Run each test in a separate subprocess.")
+    parser.add_argument('--isolated', nargs='?', const='subprocess',
+                        choices=('subprocess', 'subinterp'), dest='isolated',
+                        default=False, metavar='MODE',
+                        help="Run each test in a separate subprocess, or with a MODE of "
+                             "'subinterp' (experimental), in a separate subinterpreter. "
+                             "Tests that can't be run in a subinterpreter fall back to "
+                             "a subprocess.")
+    # -i never takes a value, so that it can't swallow a testspec after it
+    parser.add_argument('-i', action='store_const', const='subprocess', dest='isolated',
+                        help="Run each test in a separate subprocess. Same as "
+                             "--isolated=subprocess.")
     parser.add_argument('--nompi', action='store_true', dest='nompi',
                         help="Force all tests to run without MPI. This can be useful "
                              "for debugging.")
@@ -115,8 +182,136 @@ def _get_parser():
 
     parser.add_argument('--timeout', action='store', dest='timeout',
                         default=-1.0, type=float,
-                        help='Timeout in seconds. Test will be terminated if it takes longer than timeout. Only'
-                             ' works for tests running in a subprocess (MPI and isolated).')
+                        help='Timeout in seconds. A test that takes longer than timeout is '
+                             'interrupted using SIGALRM and reported as failed. A test running in '
+                             'a concurrent worker that does not stop within a few seconds after '
+                             'that is killed along with its worker, which is replaced. A test '
+                             'running in the main process (e.g. with -n 1) that ignores SIGALRM '
+                             'or catches the resulting exception is not stopped, and neither is one '
+                             'run in a thread or on a platform without SIGALRM, where only '
+                             'hung workers are killed.')
+
+    parser.add_argument('--profile', action='store_true', dest='profile',
+                        help="Profile each test function using cProfile and combine the "
+                             "results into a single profile for the whole run.")
+    parser.add_argument('--profile-file', action='store', dest='profile_file',
+                        metavar='FILE', default='testflo_profile.prof',
+                        help='Name of the combined pstats file written when --profile is '
+                             'active. Default is testflo_profile.prof.')
+    parser.add_argument('--profile-top', action='store', dest='profile_top',
+                        metavar='N', default=20, type=int,
+                        help='Number of functions to show in the profile report. '
+                             'Default is 20.')
+
+    parser.add_argument('--watchdog', action='store', dest='watchdog',
+                        metavar='TIME', default=-1.0, type=float,
+                        help="If a test runs longer than TIME seconds, dump the stacks of "
+                             "all threads in its process to stderr and add them to the "
+                             "test's error message. Works with concurrent tests.")
+    parser.add_argument('--watchdog-interval', action='store', dest='watchdog_interval',
+                        metavar='TIME', default=30.0, type=float,
+                        help="Seconds between stack dumps of a test that is still "
+                             "running after the --watchdog time. Default is 30.")
+    parser.add_argument('--stack-samples', action='store', dest='stack_samples',
+                        metavar='FILE',
+                        help="Sample the stack of tests that run longer than the "
+                             "--watchdog time and write the samples to FILE in the "
+                             "folded format used by flame graph tools.")
+
+    parser.add_argument('--max-tests-per-worker', action='store', dest='max_tests_per_worker',
+                        metavar='N', default=0, type=int,
+                        help="Replace a concurrent worker process with a new one after it "
+                             "has run N tests. The worker is replaced only after finishing "
+                             "its current group of tests.")
+    parser.add_argument('--max-worker-rss', action='store', dest='max_worker_rss',
+                        metavar='MB', default=0., type=float,
+                        help="Replace a concurrent worker process with a new one once its "
+                             "memory usage exceeds MB megabytes. The worker is replaced only "
+                             "after finishing its current group of tests.")
+
+    parser.add_argument('--preload', action='store_true', dest='preload',
+                        help="Import all test modules before starting the concurrent "
+                             "worker processes, then fork the workers so that they share "
+                             "the imported modules instead of each importing them again. "
+                             "Tests don't start running until discovery is complete. "
+                             "Ignored with --watch.")
+    parser.add_argument('--preload-module', action='append', dest='preload_modules',
+                        metavar='MODULE',
+                        help="Import the given module before forking the concurrent worker "
+                             "processes. Implies --preload. This option can be used "
+                             "multiple times.")
+
+    parser.add_argument('--async-pipeline', action='store_true', dest='async_pipeline',
+                        help="Run each of the stages that process test results (printers, "
+                             "summaries, report writers, etc.) in its own thread, separately "
+                             "from the dispatching of tests, so that slow output never holds "
+                             "up the running of tests. Requires python 3.")
+
+    parser.add_argument('--junit-xml', action='store', dest='junit_xml',
+                        metavar='FILE',
+                        help="Write test results to FILE in JUnit XML format as the tests "
+                             "finish.")
+    parser.add_argument('--jsonl', action='store', dest='jsonl',
+                        metavar='FILE',
+                        help="Write test results to FILE as JSON Lines (one JSON object "
+                             "per test) as the tests finish.")
+
+    parser.add_argument('--max-err-size', action='store', dest='max_err_size',
+                        metavar='SIZE', default=0, type=int,
+                        help="Limit the captured stderr output of each test to SIZE "
+                             "characters, keeping the beginning and the end of the output.")
+    parser.add_argument('--err-dir', action='store', dest='err_dir',
+                        metavar='DIR',
+                        help="When a test's stderr output is truncated due to "
+                             "--max-err-size, save its full output to a file in DIR.")
+    parser.add_argument('--dedup-err', action='store_true', dest='dedup_err',
+                        help="Replace any traceback or warning in a test's output that is "
+                             "identical to one from an earlier test with a short note.")
+    parser.add_argument('--rerun-failures', action='store', dest='rerun_failures',
+                        metavar='NUM', type=int, default=0,
+                        help="Rerun each failed test up to NUM times in isolated processes "
+                             "and mark it FLAKY if it passes.")
+    parser.add_argument('--flaky-file', action='store', dest='flaky_file',
+                        metavar='FILE', default='testflo_flakes.json',
+                        help="File where the number of runs, failures and flaky runs of "
+                             "each test that has failed are kept when using "
+                             "--rerun-failures. Defaults to testflo_flakes.json.")
+    parser.add_argument('--flaky-first', action='store_true', dest='flaky_first',
+                        help="Run tests that were flaky in earlier runs first, so that "
+                             "any reruns they need overlap the rest of the run.")
+    parser.add_argument('--failed-first', action='store_true', dest='failed_first',
+                        help="Run the tests that failed in the last run (as listed in "
+                             "failtests.in) before any others.")
+    parser.add_argument('--changed-first', action='store_true', dest='changed_first',
+                        help="Run tests in modules that have changed since the last run "
+                             "before any others.")
+    parser.add_argument('--run-fixtures', action='store_true', dest='run_fixtures',
+                        help=SUPPRESS)  # used internally for isolated reruns
+    parser.add_argument('--watch', action='store_true', dest='watch',
+                        help="After running the tests, keep watching the test directories "
+                             "and --coverpkg packages, and rerun the tests affected by "
+                             "each change to their python files.")
+    parser.add_argument('--daemon', action='store_true', dest='daemon',
+                        help="Start a daemon that runs tests for later testflo commands "
+                             "that use --use-daemon.  Other options given here, e.g., "
+                             "--preload-module, apply to the daemon itself.")
+    parser.add_argument('--use-daemon', action='store_true', dest='use_daemon',
+                        help="Run the tests in the testflo daemon if it's running, "
+                             "else run them as usual.")
+    parser.add_argument('--stop-daemon', action='store_true', dest='stop_daemon',
+                        help="Stop the testflo daemon.")
+    parser.add_argument('--daemon-socket', action='store', dest='daemon_socket',
+                        metavar='PATH',
+                        help="Path of the Unix socket used to talk to the daemon. "
+                             "Defaults to a file in a private per-user directory in "
+                             "$XDG_RUNTIME_DIR or the temp directory.")
+    parser.add_argument('--gitignore', action='store_true', dest='gitignore',
+                        help="Don't look for tests in files or directories excluded by "
+                             ".gitignore files.")
+    parser.add_argument('--walk-threads', action='store', dest='walk_threads',
+                        metavar='NUM', type=int, default=0,
+                        help="Number of threads used to search directories for test files. "
+                             "This can speed up discovery on network filesystems.")
 
     return parser
 
@@ -126,10 +321,24 @@ def _get_testflo_subproc_args():
     cmdset = set([
       '--nocapture',
       '-s',
-      '--coverpkg',
       '--coverage',
       '--coverage-html',
+      '--profile',
+      '--memory-aware',
+    ])
+
+    # these args take a value
+    valset = set([
+      '--coverpkg',
       '--cover-omit',
+      '--watchdog',
+      '--watchdog-interval',
+      '--stack-samples',
+      '--max-err-size',
+      '--err-dir',
+      '--limit-memory',
+      '--limit-cpu',
+      '--limit-files',
     ])
 
     keep = []
@@ -138,17 +347,163 @@ def _get_testflo_subproc_args():
     argslen = len(args)
     while i < argslen:
         arg = args[i]
-        if arg.split('=',1)[0] in cmdset:
+        name = arg.split('=',1)[0]
+        if name in cmdset:
+            keep.append(arg)
+        elif name in valset:
             keep.append(arg)
-            if ((arg.startswith('--coverpkg') or arg.startswith('--cover-omit'))
-                        and '=' not in arg):
+            if '=' not in arg:
                 i += 1
                 keep.append(args[i])
         i += 1
 
     return keep
 
-def _file_gen(dname, fmatch=bool, dmatch=None):
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+
+def _listdir(dname):
+    """Return lists of the (name, path) pairs of the files and the
+    subdirectories of the given directory, or empty lists if it can't be read.
+    """
+    files = []
+    dirs = []
+    try:
+        if scandir is not None:
+            # scandir gets the entry types from the directory listing itself,
+            # so on most filesystems this doesn't need a stat per entry.
+            # Like os.walk, don't follow symlinks to directories, since a
+            # symlink cycle would otherwise find the same files repeatedly.
+            for entry in scandir(dname):
+                try:
+                    isdir = entry.is_dir(follow_symlinks=False)
+                    if not isdir and entry.is_symlink() and entry.is_dir():
+                        continue
+                except OSError:
+                    continue
+                (dirs if isdir else files).append((entry.name, entry.path))
+        else:
+            for name in os.listdir(dname):
+                path = join(dname, name)
+                if os.path.isdir(path):
+                    if not os.path.islink(path):
+                        dirs.append((name, path))
+                else:
+                    files.append((name, path))
+    except OSError:
+        pass
+    return files, dirs
+
+
+def _glob_matcher(patterns):
+    """Return a predicate that is True for any name matching any of the given
+    glob patterns, using a single precompiled regex.
+    """
+    if isinstance(patterns, string_types):
+        patterns = [patterns]
+    flags = re.IGNORECASE if os.path.normcase('A') == 'a' else 0
+    regex = re.compile('|'.join('(?:%s)' % translate(p) for p in patterns), flags)
+    return lambda name: regex.match(name) is not None
+
+
+def _gitignore_pattern(pat):
+    """Translate a .gitignore pattern into a regex matching paths relative to
+    the directory containing the .gitignore file.
+    """
+    anchored = '/' in pat
+    pat = pat.lstrip('/')
+    parts = []
+    i, n = 0, len(pat)
+    while i < n:
+        if pat.startswith('**/', i):
+            parts.append('(?:.*/)?')
+            i += 3
+        elif pat.startswith('**', i):
+            parts.append('.*')
+            i += 2
+        elif pat[i] == '*':
+            parts.append('[^/]*')
+            i += 1
+        elif pat[i] == '?':
+            parts.append('[^/]')
+            i += 1
+        elif pat[i] == '[' and ']' in pat[i+2:]:
+            j = pat.index(']', i + 2)
+            cls = pat[i+1:j].replace('\\', '\\\\')
+            if cls.startswith('!'):
+                cls = '^' + cls[1:]
+            parts.append('[%s]' % cls)
+            i = j + 1
+        else:
+            if pat[i] == '\\' and i + 1 < n:
+                i += 1
+            parts.append(re.escape(pat[i]))
+            i += 1
+    regex = ''.join(parts)
+    if not anchored:
+        regex = '(?:.*/)?' + regex
+    return re.compile(regex + '$')
+
+
+def _read_ignore_file(fname):
+    """Return a list of (regex, negated, dirs_only) rules from the given
+    .gitignore style file.
+    """
+    rules = []
+    try:
+        with open(fname) as f:
+            lines = f.read().splitlines()
+    except (IOError, OSError):
+        return rules
+
+    for line in lines:
+        if not line.endswith('\\ '):
+            line = line.rstrip(' ')
+        if not line or line.startswith('#'):
+            continue
+        negated = line.startswith('!')
+        if negated:
+            line = line[1:]
+        dirs_only = line.endswith('/')
+        line = line.rstrip('/')
+        if line:
+            rules.append((_gitignore_pattern(line), negated, dirs_only))
+    return rules
+
+
+def _is_ignored(ignores, path, isdir):
+    """Return True if the given path is excluded by the given list of
+    (base dir, rules) tuples, where later rules override earlier ones.
+    """
+    ignored = False
+    for base, rules in ignores:
+        rel = path[len(base):].lstrip(os.sep).replace(os.sep, '/')
+        for regex, negated, dirs_only in rules:
+            if (isdir or not dirs_only) and regex.match(rel):
+                ignored = not negated
+    return ignored
+
+
+def _add_ignores(dname, files, ignorefile, ignores):
+    """Return ignores plus the rules from ignorefile if it's one of the
+    (name, path) pairs in files.
+    """
+    for name, fpath in files:
+        if name == ignorefile:
+            rules = _read_ignore_file(fpath)
+            if rules:
+                return ignores + [(dname, rules)]
+            break
+    return ignores
+
+
+def _file_gen(dname, fmatch=bool, dmatch=None, ignorefile=None):
     """A generator returning files under the given directory, with optional
     file and directory filtering.
 
@@ -159,22 +514,86 @@ def _file_gen(dname, fmatch=bool, dmatch=None):
     dmatch: predicate funct
         A predicate function that returns True on a match.
         This is used to match directories only.
+
+    ignorefile: str
+        Name of .gitignore style files whose patterns exclude files and
+        directories in the directory containing them and below.
     """
     if dmatch is not None and not dmatch(dname):
         return
 
-    for path, dirlist, filelist in os.walk(dname):
-        if dmatch is not None:  # prune directories to search
-            newdl = [d for d in dirlist if dmatch(d)]
-            if len(newdl) != len(dirlist):
-                dirlist[:] = newdl  # replace contents of dirlist to cause pruning
+    for f in _walk(dname, fmatch, dmatch, ignorefile, []):
+        yield f
 
-        for name in [f for f in filelist if fmatch(f)]:
-            yield join(path, name)
+
+def _walk(dname, fmatch, dmatch, ignorefile, ignores):
+    """Yield the matching files under dname, given the ignore rules from
+    its parent directories.
+    """
+    stack = [(dname, ignores)]
+    while stack:
+        path, ignores = stack.pop()
+        files, dirs = _listdir(path)
+
+        if ignorefile is not None:
+            ignores = _add_ignores(path, files, ignorefile, ignores)
+
+        for name, fpath in files:
+            if fmatch(name) and not (ignores and _is_ignored(ignores, fpath, False)):
+                yield fpath
+
+        # directories are pruned here, before we ever look inside them
+        subdirs = []
+        for name, dpath in dirs:
+            if dmatch is not None and not dmatch(name):
+                continue
+            if ignores and _is_ignored(ignores, dpath, True):
+                continue
+            subdirs.append((dpath, ignores))
+
+        # keep the same top down order as os.walk
+        stack.extend(reversed(subdirs))
+
+
+def _parallel_file_gen(dname, nthreads, fmatch=bool, dmatch=None, ignorefile=None):
+    """Like _file_gen, but the subdirectories of dname are walked concurrently
+    using nthreads threads.  Most of the time spent walking is in filesystem
+    calls that release the GIL, so this helps a lot on network filesystems.
+    """
+    from multiprocessing.pool import ThreadPool
+
+    if dmatch is not None and not dmatch(dname):
+        return
+
+    files, dirs = _listdir(dname)
+
+    ignores = []
+    if ignorefile is not None:
+        ignores = _add_ignores(dname, files, ignorefile, ignores)
+
+    for name, fpath in files:
+        if fmatch(name) and not (ignores and _is_ignored(ignores, fpath, False)):
+            yield fpath
+
+    subdirs = [dpath for name, dpath in dirs
+               if (dmatch is None or dmatch(name)) and
+                  not (ignores and _is_ignored(ignores, dpath, True))]
+
+    def walk(d):
+        return list(_walk(d, fmatch, dmatch, ignorefile, ignores))
+
+    pool = ThreadPool(nthreads)
+    try:
+        # imap keeps the results in order while the walks run ahead
+        for found in pool.imap(walk, subdirs):
+            for f in found:
+                yield f
+    finally:
+        pool.terminate()
 
 
 def find_files(start, match=None, exclude=None,
-               dirmatch=None, direxclude=None):
+               dirmatch=None, direxclude=None, ignorefile=None, nthreads=0):
     """Return filenames (using a generator).
 
     start: str or list of str
@@ -200,6 +619,16 @@ def find_files(start, match=None, exclude=None,
         or a predicate function that returns True to exclude.
         This is used to exclude directories only.
 
+    ignorefile: str
+        If given, the name of .gitignore style files whose patterns
+        exclude files and directories.
+
+    nthreads: int
+        If greater than 1, the subdirectories of each starting directory
+        are walked concurrently using this many threads.
+
+    Any glob pattern may also be a list of glob patterns.
+
     Walks all subdirectories below each specified starting directory,
     subject to directory filtering.
 
@@ -208,44 +637,229 @@ def find_files(start, match=None, exclude=None,
     if len(startdirs) == 0:
         return iter([])
 
-    if match is None:
-        matcher = bool
-    elif isinstance(match, string_types):
-        matcher = lambda name: fnmatch(name, match)
-    else:
-        matcher = match
-
-    if dirmatch is None:
-        dmatcher = bool
-    elif isinstance(dirmatch, string_types):
-        dmatcher = lambda name: fnmatch(name, dirmatch)
+    def _matcher(m, dirs=False):
+        if m is None or callable(m):
+            return m
+        if not m:
+            return None
+        globmatch = _glob_matcher(m)
+        if dirs:
+            # starting dirs are matched using their full path
+            return lambda name: globmatch(basename(name.rstrip(os.sep)))
+        return globmatch
+
+    matcher = _matcher(match)
+    excluder = _matcher(exclude)
+    dmatcher = _matcher(dirmatch, dirs=True)
+    dexcluder = _matcher(direxclude, dirs=True)
+
+    if excluder is None:
+        fmatch = matcher or bool
+    elif matcher is None:
+        fmatch = lambda name: not excluder(name)
     else:
-        dmatcher = dirmatch
+        fmatch = lambda name: matcher(name) and not excluder(name)
 
-    if isinstance(exclude, string_types):
-        fmatch = lambda name: matcher(name) and not fnmatch(name, exclude)
-    elif exclude is not None:
-        fmatch = lambda name: matcher(name) and not exclude(name)
+    if dexcluder is None:
+        dmatch = dmatcher
+    elif dmatcher is None:
+        dmatch = lambda name: not dexcluder(name)
     else:
-        fmatch = matcher
+        dmatch = lambda name: dmatcher(name) and not dexcluder(name)
 
-    if isinstance(direxclude, string_types):
-        if dmatcher is bool:
-            dmatch = lambda name: not fnmatch(name, direxclude)
-        else:
-            dmatch = lambda name: dmatcher(name) and not fnmatch(name, direxclude)
-    elif direxclude is not None:
-        dmatch = lambda name: dmatcher(name) and not direxclude(name)
+    if nthreads > 1:
+        iters = [_parallel_file_gen(d, nthreads, fmatch=fmatch, dmatch=dmatch,
+                                    ignorefile=ignorefile) for d in startdirs]
     else:
-        dmatch = dmatcher
-
-    iters = [_file_gen(d, fmatch=fmatch, dmatch=dmatch) for d in startdirs]
+        iters = [_file_gen(d, fmatch=fmatch, dmatch=dmatch, ignorefile=ignorefile)
+                 for d in startdirs]
     if len(iters) > 1:
         return itertools.chain(*iters)
     else:
         return iters[0]
 
 
+# Caches used to avoid repeated stat calls when resolving modules.  These
+# assume that the test files don't move around during a run.
+_dir_listings = {}   # dir -> set of names in dir, or None if not a dir
+_file_cache = {}     # path -> True if path is a file
+_pkg_cache = {}      # dir -> dotted package name of dir, or '' if not a package
+_module_cache = {}   # (modname, sys.path) -> file name
+_dir_mtimes = {}     # dir -> modification time of dir when it was listed
+_cache_loaded = False
+_cache_file = None   # (pid, filename) of the file our caches were saved to
+_cache_saved = None
+_cache_lock = threading.Lock()
+
+# held by anything that changes sys.path while tests may be running in threads
+_path_lock = threading.Lock()
+
+
+def _load_module_cache():
+    """Populate our caches from the file named in TESTFLO_MODCACHE, if any,
+    which is written by the process that started this one.
+    """
+    global _cache_loaded
+    _cache_loaded = True
+    fname = os.environ.get('TESTFLO_MODCACHE')
+    if fname:
+        try:
+            with open(fname, 'rb') as f:
+                files, pkgs = pickle.load(f)
+        except Exception:
+            return
+        _file_cache.update(files)
+        _pkg_cache.update(pkgs)
+
+
+def _isfile(path):
+    """A cached isfile that lists each directory once rather than doing a stat
+    for every name we look for.
+    """
+    try:
+        return _file_cache[path]
+    except KeyError:
+        pass
+
+    if not _cache_loaded:
+        _load_module_cache()
+        if path in _file_cache:
+            return _file_cache[path]
+
+    d, name = split(path)
+    try:
+        names = _dir_listings[d]
+    except KeyError:
+        try:
+            _dir_mtimes[d] = os.stat(d or '.').st_mtime
+            names = _dir_listings[d] = set(os.listdir(d or '.'))
+        except OSError:
+            names = _dir_listings[d] = None
+
+    _file_cache[path] = found = names is not None and name in names and isfile(path)
+    return found
+
+
+def _package_name(path):
+    """Return the dotted name of the package in the given absolute directory,
+    or '' if it isn't a package.
+    """
+    try:
+        return _pkg_cache[path]
+    except KeyError:
+        pass
+
+    if _isfile(join(path, '__init__.py')):
+        parent, pname = split(path)
+        prefix = _package_name(parent) if parent != path else ''
+        name = prefix + '.' + pname if prefix else pname
+    else:
+        name = ''
+
+    _pkg_cache[path] = name
+    return name
+
+
+def revalidate_module_cache():
+    """Forget what we know about the contents of any directories that have
+    changed since we listed them.  This costs one stat per directory rather
+    than a stat per file or listing every directory again.
+    """
+    changed = False
+    for d, mtime in list(_dir_mtimes.items()):
+        try:
+            newtime = os.stat(d or '.').st_mtime
+        except OSError:
+            newtime = None
+        if newtime != mtime:
+            changed = True
+            del _dir_mtimes[d]
+            _dir_listings.pop(d, None)
+
+    if changed:
+        # a directory that didn't exist before may exist now
+        for d in [d for d, names in _dir_listings.items() if names is None]:
+            del _dir_listings[d]
+
+        # these are quickly rebuilt from the listings we still have
+        _file_cache.clear()
+        _pkg_cache.clear()
+        _module_cache.clear()
+
+
+def get_module_cache():
+    """Return the state of our module resolution caches, which can be
+    given to set_module_cache in another process.
+    """
+    return (_dir_mtimes, _dir_listings, _file_cache, _pkg_cache)
+
+
+def set_module_cache(state):
+    """Replace our module resolution caches with those from get_module_cache."""
+    clear_module_cache()
+    for cache, saved in zip(get_module_cache(), state):
+        cache.update(saved)
+
+
+def clear_module_cache():
+    """Forget everything we know about the files on disk."""
+    _dir_mtimes.clear()
+    _dir_listings.clear()
+    _file_cache.clear()
+    _pkg_cache.clear()
+    _module_cache.clear()
+
+
+def save_module_cache():
+    """Save our module resolution caches to a file and put its name in
+    TESTFLO_MODCACHE so that subprocesses started after this can use them.
+    """
+    global _cache_file, _cache_saved
+
+    pid = os.getpid()
+    if _cache_file is None or _cache_file[0] != pid:
+        # we may have been forked from a process that already has a file
+        fd, fname = mkstemp(prefix='testflo_modcache_', suffix='.pkl')
+        os.close(fd)
+        _cache_file = (pid, fname)
+        _cache_saved = None
+        atexit.register(remove_module_cache)
+
+    with _cache_lock:
+        sizes = (len(_file_cache), len(_pkg_cache))
+        if sizes != _cache_saved:
+            # copy the caches in case tests in other threads are changing them
+            state = (dict(_file_cache), dict(_pkg_cache))
+            try:
+                with open(_cache_file[1], 'wb') as f:
+                    pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+            except (IOError, OSError):
+                return
+            _cache_saved = sizes
+
+    os.environ['TESTFLO_MODCACHE'] = _cache_file[1]
+
+
+def set_module_cache_file(fname):
+    """Make save_module_cache in this process write to fname, which the
+    process that gave it to us is responsible for removing.
+    """
+    global _cache_file, _cache_saved
+    _cache_file = (os.getpid(), fname)
+    _cache_saved = None
+
+
+def remove_module_cache():
+    """Remove the file written by save_module_cache in this process, if any."""
+    global _cache_file
+    if _cache_file is not None and _cache_file[0] == os.getpid():
+        try:
+            os.remove(_cache_file[1])
+        except OSError:
+            pass
+        _cache_file = None
+
+
 def get_module_path(fpath):
     """Given a module filename, return its full Python name including
     enclosing packages. (based on existence of ``__init__.py`` files)
@@ -254,11 +868,10 @@ def get_module_path(fpath):
         pnames = []
     else:
         pnames = [splitext(basename(fpath))[0]]
-    path = dirname(abspath(fpath))
-    while isfile(join(path, '__init__.py')):
-            path, pname = split(path)
-            pnames.append(pname)
-    return '.'.join(pnames[::-1])
+    pkg = _package_name(dirname(abspath(fpath)))
+    if pkg:
+        pnames.insert(0, pkg)
+    return '.'.join(pnames)
 
 
 def parent_dirs(fpath):
@@ -277,6 +890,11 @@ def find_module(name):
     given module name, or None if it can't be found. The
     file must be an uncompiled Python (.py) file.
     """
+    key = (name, tuple(sys.path))
+    try:
+        return _module_cache[key]
+    except KeyError:
+        pass
 
     nameparts = name.split('.')
 
@@ -284,12 +902,20 @@ def find_module(name):
     endings.append(join(endings[0], '__init__.py'))
     endings[0] += '.py'
 
+    found = None
     for entry in sys.path:
+        # relative entries depend on the current dir, which tests may change
+        entry = abspath(entry)
         for ending in endings:
             f = join(entry, ending)
-            if isfile(f):
-                return f
-    return None
+            if _isfile(f):
+                found = f
+                break
+        if found:
+            break
+
+    _module_cache[key] = found
+    return found
 
 
 def get_module(fname):
@@ -317,26 +943,53 @@ def get_module(fname):
         # this might be a module that's not in the same
         # environment as testflo, so try temporarily prepending
         # its parent dirs to sys.path so it'll (hopefully) be
-        # importable
-        oldpath = sys.path[:]
-        sys.path.extend(parent_dirs(fname))
-        sys.path.append(os.getcwd())
-        try:
-            __import__(modpath)
-            mod = sys.modules[modpath]
-            # don't keep this module around in sys.modules, but
-            # keep a reference to it, else multiprocessing on Windows
-            # will have problems
-            _store[modpath] = sys.modules[modpath]
-            del sys.modules[modpath]
-        finally:
-            sys.path = oldpath
+        # importable.  sys.path is shared by tests running in threads, so
+        # nobody else may change it until it's restored.
+        with _path_lock:
+            oldpath = sys.path[:]
+            sys.path.extend(parent_dirs(fname))
+            sys.path.append(os.getcwd())
+            try:
+                __import__(modpath)
+                mod = sys.modules[modpath]
+                # don't keep this module around in sys.modules, but
+                # keep a reference to it, else multiprocessing on Windows
+                # will have problems
+                _store[modpath] = sys.modules[modpath]
+                del sys.modules[modpath]
+            finally:
+                sys.path = oldpath
     finally:
         stop_coverage()
 
     return fname, mod
 
 
+def load_json(fname):
+    """Return the contents of the given JSON file, or an empty dict if it
+    doesn't exist or can't be read.
+    """
+    import json
+    try:
+        with open(fname, 'r') as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def save_json(fname, data):
+    """Write data to the given JSON file, replacing it all at once so that
+    readers never see a partly written file.
+    """
+    import json
+    tmp = fname + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(data, f, indent=1, sort_keys=True)
+    if os.path.exists(fname):
+        os.remove(fname)  # python 2 can't rename over it on windows
+    os.rename(tmp, fname)
+
+
 def read_test_file(testfile):
     """Reads a file containing one testspec per line."""
     with open(os.path.abspath(testfile), 'r') as f:
@@ -386,6 +1039,88 @@ def get_memory_usage():
         except:
             return 0.
 
+def _proc_status_mb(field):
+    """Return the value of the given memory field of /proc/self/status in MB."""
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1]) / 1024.
+    raise OSError("%s not found in /proc/self/status" % field)
+
+def reset_peak_memory():
+    """Reset the peak memory usage of the current process and return its
+    current memory usage in MB, or None if the peak can't be measured
+    (this only works on linux).
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return _proc_status_mb('VmRSS')
+    except (IOError, OSError, ValueError):
+        return None
+
+def get_peak_memory():
+    """Return the peak memory usage of the current process in MB since the
+    last call to reset_peak_memory.
+    """
+    try:
+        return _proc_status_mb('VmHWM')
+    except (IOError, OSError, ValueError):
+        return 0.
+
+def available_memory():
+    """Return the memory in MB available for new processes without swapping,
+    or None if we can't tell.
+    """
+    try:
+        import psutil
+        return psutil.virtual_memory().available / (1024. * 1024.)
+    except ImportError:
+        pass
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) / 1024.
+    except (IOError, OSError, ValueError):
+        pass
+    return None
+
+def module_available(name):
+    """Return True if the named top level module can be imported, without
+    actually importing it.
+    """
+    if name in sys.modules:
+        return True
+    try:
+        from importlib.util import find_spec
+    except ImportError:  # python 2
+        import imp
+        try:
+            imp.find_module(name)
+        except ImportError:
+            return False
+        return True
+    return find_spec(name) is not None
+
+
+def find_executable(name):
+    """Return the full path of the named executable if it's found in the
+    system path, else None.
+    """
+    try:
+        from shutil import which
+    except ImportError:  # python 2
+        from distutils.spawn import find_executable as which
+    return which(name)
+
+
+def is_failure(result):
+    """Return True if the given result should make the run fail."""
+    return ((result.status == 'FAIL' and not result.expected_fail) or
+            result.status == 'LIMIT')
+
+
 def elapsed_str(elapsed):
     """return a string of the form hh:mm:sec"""
     hrs = int(elapsed/3600)
@@ -0,0 +1,425 @@
+"""
+Support for --watch, which keeps testflo (and its worker processes) running
+and reruns the tests affected by each change to the python files in the
+test directories and the --coverpkg packages.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import ast
+import time
+import errno
+import select
+import struct
+
+from fnmatch import fnmatch
+from os.path import isdir, isfile, dirname, abspath, join, basename
+
+from testflo.util import find_module, get_module_path, clear_module_cache
+
+
+# seconds between scans when polling for changes
+_poll_interval = 1.0
+
+# seconds without further changes before we start a rerun, so that saving
+# several files at once only causes one rerun
+_settle_time = 0.2
+
+
+def _is_excluded(path, skip_dirs):
+    name = basename(path)
+    for skip in skip_dirs:
+        if fnmatch(name, skip):
+            return True
+    return False
+
+
+def _walk_dirs(roots, skip_dirs):
+    """Yield all directories below the given roots that aren't excluded."""
+    for root in roots:
+        for path, dirlist, _ in os.walk(root):
+            dirlist[:] = [d for d in dirlist if not _is_excluded(d, skip_dirs)]
+            yield path
+
+
+class PollingWatcher(object):
+    """Finds changed python files by comparing modification times."""
+
+    def __init__(self, roots, skip_dirs=()):
+        self.roots = roots
+        self.skip_dirs = skip_dirs
+        self._mtimes = self._snapshot()
+
+    def _snapshot(self):
+        mtimes = {}
+        for d in _walk_dirs(self.roots, self.skip_dirs):
+            try:
+                names = os.listdir(d)
+            except OSError:
+                continue
+            for name in names:
+                if name.endswith('.py'):
+                    path = join(d, name)
+                    try:
+                        mtimes[path] = os.stat(path).st_mtime
+                    except OSError:
+                        pass
+        return mtimes
+
+    def wait(self):
+        """Block until some python files change, then return the set of
+        changed (including added and removed) file names.
+        """
+        while True:
+            time.sleep(_poll_interval)
+            new = self._snapshot()
+            changed = set(f for f, t in new.items() if self._mtimes.get(f) != t)
+            changed.update(f for f in self._mtimes if f not in new)
+            self._mtimes = new
+            if changed:
+                return changed
+
+    def close(self):
+        pass
+
+
+# inotify constants from <sys/inotify.h>
+_IN_CLOSE_WRITE = 0x8
+_IN_MOVED_FROM = 0x40
+_IN_MOVED_TO = 0x80
+_IN_CREATE = 0x100
+_IN_DELETE = 0x200
+_IN_Q_OVERFLOW = 0x4000
+_IN_ISDIR = 0x40000000
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+
+_IN_MASK = _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE
+
+_event_header = struct.Struct('iIII')
+
+
+class InotifyWatcher(object):
+    """Finds changed python files using inotify, so nothing is scanned
+    while waiting.  Raises OSError if inotify isn't available.
+    """
+
+    def __init__(self, roots, skip_dirs=()):
+        import ctypes
+        import ctypes.util
+
+        if not sys.platform.startswith('linux'):
+            raise OSError("inotify is only available on linux")
+
+        self.skip_dirs = skip_dirs
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                                 use_errno=True)
+        self._fd = self._libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        self._dirs = {}
+        for d in _walk_dirs(roots, skip_dirs):
+            self._add_watch(d)
+
+    def _add_watch(self, path):
+        import ctypes
+        wd = self._libc.inotify_add_watch(self._fd, path.encode(sys.getfilesystemencoding()),
+                                          _IN_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC:
+                self.close()
+                raise OSError(err, "too many directories to watch with inotify")
+            return
+        self._dirs[wd] = path
+
+    def _read_events(self, changed):
+        """Add the names of changed python files to the given set.  Returns
+        False if events were lost.
+        """
+        try:
+            buf = os.read(self._fd, 65536)
+        except OSError as err:
+            if err.errno == errno.EAGAIN:
+                return True
+            raise
+
+        i = 0
+        while i < len(buf):
+            wd, mask, _, length = _event_header.unpack_from(buf, i)
+            i += _event_header.size
+            name = buf[i:i+length].rstrip(b'\0').decode(sys.getfilesystemencoding())
+            i += length
+
+            if mask & _IN_Q_OVERFLOW:
+                return False
+
+            parent = self._dirs.get(wd)
+            if parent is None:
+                continue
+            path = join(parent, name)
+
+            if mask & _IN_ISDIR:
+                if mask & (_IN_CREATE | _IN_MOVED_TO) and \
+                   not _is_excluded(path, self.skip_dirs):
+                    for d in _walk_dirs([path], self.skip_dirs):
+                        self._add_watch(d)
+                        changed.update(join(d, f) for f in os.listdir(d)
+                                       if f.endswith('.py'))
+            elif name.endswith('.py'):
+                changed.add(path)
+
+        return True
+
+    def wait(self):
+        """Block until some python files change, then return the set of
+        changed (including added and removed) file names, or None if we
+        lost track of what changed.
+        """
+        changed = set()
+        timeout = None
+        while True:
+            ready, _, _ = select.select([self._fd], [], [], timeout)
+            if not ready:
+                if changed:
+                    return changed
+                timeout = None
+                continue
+            if not self._read_events(changed):
+                return None
+            timeout = _settle_time
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+def _norm_modfile(fname):
+    """Return the .py file name for a module __file__."""
+    if fname.endswith(('.pyc', '.pyo')):
+        fname = fname[:-1]
+    return abspath(fname)
+
+
+class ImportGraph(object):
+    """Keeps track of which python files under the watched directories import
+    which others, based on the import statements in each file.
+    """
+
+    def __init__(self, roots):
+        self.roots = [join(abspath(r), '') for r in roots]
+        self._imports = {}
+
+    def watched(self, fname):
+        return any(fname.startswith(r) for r in self.roots)
+
+    def forget(self, fnames):
+        for f in fnames:
+            self._imports.pop(f, None)
+
+    def _resolve(self, name, fname):
+        """Return the file for the named module as imported from fname."""
+        oldpath = sys.path
+        sys.path = [dirname(fname)] + sys.path
+        try:
+            return find_module(name)
+        finally:
+            sys.path = oldpath
+
+    def imports(self, fname):
+        """Return the set of watched files directly imported by fname."""
+        try:
+            return self._imports[fname]
+        except KeyError:
+            pass
+
+        found = set()
+        try:
+            with open(fname, 'rb') as f:
+                tree = ast.parse(f.read(), fname)
+        except Exception:
+            tree = None
+
+        names = set()
+        if tree is not None:
+            for node in ast.walk(tree):
+                if isinstance(node, ast.Import):
+                    for alias in node.names:
+                        parts = alias.name.split('.')
+                        names.update('.'.join(parts[:i+1]) for i in range(len(parts)))
+                elif isinstance(node, ast.ImportFrom):
+                    if node.level:
+                        pkg = get_module_path(fname).split('.')
+                        if not basename(fname).startswith('__init__.'):
+                            pkg = pkg[:-1]
+                        pkg = pkg[:len(pkg) - node.level + 1]
+                        base = '.'.join(pkg + ([node.module] if node.module else []))
+                    else:
+                        base = node.module
+                    if base:
+                        names.add(base)
+                        names.update(base + '.' + a.name for a in node.names)
+
+        for name in names:
+            path = self._resolve(name, fname)
+            if path is not None:
+                path = abspath(path)
+                if path != fname and self.watched(path):
+                    found.add(path)
+
+        self._imports[fname] = found
+        return found
+
+    def depends_on(self, fname, changed):
+        """Return True if fname or anything it imports (directly or not) is
+        in the set of changed files.
+        """
+        seen = set()
+        stack = [fname]
+        while stack:
+            f = stack.pop()
+            if f in changed:
+                return True
+            if f not in seen:
+                seen.add(f)
+                stack.extend(self.imports(f))
+        return False
+
+
+class TestWatcher(object):
+    """Reruns the tests affected by each change to the watched files.
+
+    It's also a pipeline stage that keeps track of which test files
+    were run and the specs used to run them.
+    """
+
+    def __init__(self, options, specs, run, runner, module_pattern='test*.py'):
+        self.options = options
+        self.specs = specs
+        self.run = run
+        self.runner = runner
+        self.module_pattern = module_pattern
+
+        # test file -> spec to use to rerun the tests in that file
+        self._specs = {}
+        self._test_dirs = []
+        roots = []
+        for spec in specs:
+            path = spec.split(':', 1)[0]
+            if isdir(path):
+                self._test_dirs.append(join(abspath(path), ''))
+                roots.append(path)
+                continue
+            if not path.endswith('.py'):
+                path = find_module(path)
+                if path is None:
+                    continue
+            path = abspath(path)
+            self._specs.setdefault(path, []).append(spec)
+            roots.append(dirname(path))
+
+        for pkg in options.coverpkgs or ():
+            path = pkg if isdir(pkg) else find_module(pkg)
+            if path is not None:
+                roots.append(path if isdir(path) else dirname(path))
+
+        # don't watch the same tree twice
+        roots = sorted(set(abspath(r) for r in roots))
+        self.roots = [r for r in roots
+                      if not any(r.startswith(join(o, '')) for o in roots)]
+
+        self.graph = ImportGraph(self.roots)
+        self._test_files = set()
+
+    def get_iter(self, input_iter):
+        for result in input_iter:
+            path = result.spec.split(':', 1)[0]
+            if path.endswith('.py'):
+                self._test_files.add(abspath(path))
+            yield result
+
+    def _make_watcher(self):
+        skip_dirs = self.options.skip_dirs
+        try:
+            return InotifyWatcher(self.roots, skip_dirs)
+        except (OSError, AttributeError, ImportError):
+            return PollingWatcher(self.roots, skip_dirs)
+
+    def _affected(self, changed):
+        """Return the test files affected by the given set of changed files."""
+        affected = set(f for f in self._test_files
+                       if isfile(f) and self.graph.depends_on(f, changed))
+
+        # new test files in the test directories
+        for f in changed:
+            if f not in self._test_files and isfile(f) and \
+               fnmatch(basename(f), self.module_pattern) and \
+               any(f.startswith(d) for d in self._test_dirs):
+                affected.add(f)
+
+        return affected
+
+    def _purge_modules(self, changed):
+        """Remove all loaded modules that are, or depend on, changed files
+        so they'll be imported again.
+        """
+        for name, mod in list(sys.modules.items()):
+            if name == '__main__' or name.split('.', 1)[0] == 'testflo':
+                continue
+            fname = getattr(mod, '__file__', None)
+            if fname:
+                fname = _norm_modfile(fname)
+                if self.graph.watched(fname) and self.graph.depends_on(fname, changed):
+                    del sys.modules[name]
+
+    def _rerun_specs(self, affected):
+        specs = []
+        for f in sorted(affected):
+            specs.extend(self._specs.get(f, [f]))
+        return specs
+
+    def watch(self):
+        """Run all of the tests, then rerun the affected tests each time
+        the watched files change, until interrupted.
+        """
+        retval = self.run(self.specs, [self.get_iter])
+
+        watcher = self._make_watcher()
+        try:
+            while True:
+                print("\nWatching for changes in %s (Ctrl-C to quit)..." %
+                      ', '.join(self.roots))
+                sys.stdout.flush()
+
+                changed = watcher.wait()
+
+                clear_module_cache()
+                if changed is None:
+                    # we don't know what changed, so rerun everything
+                    changed = set(self._test_files)
+                    self.graph = ImportGraph(self.roots)
+                else:
+                    self.graph.forget(changed)
+
+                affected = self._affected(changed)
+                self._purge_modules(changed)
+                self.runner.recycle_workers(
+                    lambda files: any(abspath(f) in affected for f in files))
+
+                if not affected:
+                    continue
+
+                print("\nRerunning tests in %d file(s) affected by changes to %s" %
+                      (len(affected), ', '.join(sorted(changed))))
+                retval = self.run(self._rerun_specs(affected), [self.get_iter])
+        except KeyboardInterrupt:
+            print()
+        finally:
+            watcher.close()
+
+        return retval
+
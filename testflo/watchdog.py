@@ -0,0 +1,126 @@
+"""
+A watchdog that dumps the stacks of all threads (and optionally collects
+stack samples) when a test runs longer than a given threshold.
+"""
+
+import sys
+import time
+import threading
+import traceback
+
+from os.path import basename
+
+from six.moves._thread import get_ident
+
+
+# interval in seconds between stack samples of a slow test
+_sample_interval = 0.01
+
+
+def format_stacks(skip=None):
+    """Return a string containing the current stack of every thread except
+    the one whose ident is skip.
+    """
+    names = dict((t.ident, t.name) for t in threading.enumerate())
+    lines = []
+    for tid, frame in sys._current_frames().items():
+        if tid == skip:
+            continue
+        lines.append("Thread %s (%s), most recent call last:\n" %
+                     (tid, names.get(tid, 'unknown')))
+        lines.extend(traceback.format_stack(frame))
+    return ''.join(lines)
+
+
+def folded_stack(frame):
+    """Return the given stack in 'folded' form, i.e., a semicolon separated
+    list of frames starting at the root, as used by flamegraph tools.
+    """
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append("%s:%s" % (basename(code.co_filename), code.co_name))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class StackWatchdog(object):
+    """Watches the thread that runs a test.  If the test runs longer than
+    threshold seconds, the stacks of all threads are dumped to stderr every
+    interval seconds and saved so they can be added to the test's err_msg.
+    If sample is True, the stack of the test thread is also sampled until
+    the test finishes.
+    """
+
+    def __init__(self, spec, threshold, interval, sample=False):
+        self.spec = spec
+        self.threshold = threshold
+        self.interval = interval
+        self.sample = sample
+        self.dumps = []
+        self.samples = {}
+        self._ident = get_ident()
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._watch)
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._done.set()
+        self._thread.join()
+
+    def _watch(self):
+        if self._done.wait(self.threshold):
+            return
+
+        start = time.time() - self.threshold
+        next_dump = 0.
+        while True:
+            now = time.time()
+            if now >= next_dump:
+                self.dump("still running after %.1f sec" % (now - start))
+                next_dump = now + self.interval
+
+            if self.sample:
+                frame = sys._current_frames().get(self._ident)
+                if frame is not None:
+                    stack = folded_stack(frame)
+                    self.samples[stack] = self.samples.get(stack, 0) + 1
+                    del frame
+                wait = _sample_interval
+            else:
+                wait = next_dump - now
+
+            if self._done.wait(wait):
+                return
+
+    def dump(self, reason):
+        """Dump the stacks of all threads to stderr and save them."""
+        msg = "\n%s %s. Thread stacks:\n%s" % (self.spec, reason,
+                                               format_stacks(get_ident()))
+        self.dumps.append(msg)
+
+        # use the real stderr since the test's stderr is being captured
+        sys.__stderr__.write(msg)
+        sys.__stderr__.flush()
+
+
+class StackSampleWriter(object):
+    """Writes the stack samples collected for slow tests to a file in folded
+    form, with the name of the test as the root frame, so that a flame graph
+    can be generated for all of the slow tests in the run.
+    """
+
+    def __init__(self, outfile='testflo_stacks.folded'):
+        self.outfile = outfile
+
+    def get_iter(self, input_iter):
+        with open(self.outfile, 'w') as f:
+            for test in input_iter:
+                if test.stack_samples:
+                    for stack, count in sorted(test.stack_samples.items()):
+                        f.write("%s;%s %d\n" % (test.short_name(), stack, count))
+                    test.stack_samples = None
+                yield test